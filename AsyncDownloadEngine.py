@@ -0,0 +1,631 @@
+import asyncio
+import hashlib
+import logging
+import os
+import ssl
+import time
+import urllib.parse
+from typing import Iterable
+from DownloadEngine import (DEFAULT_TIMEOUT, MAX_REFETCHES, USER_AGENT, DownloadResult, DownloadTask, EngineOptions,
+                            FileNames)
+from BulkReader import iter_links
+from DedupStore import DedupStore, url_sha256
+from DiskWriter import DiskWriter, PartFile
+from Integrity import Verifier
+from Journal import PART_SUFFIX
+from MemoryBudget import MemoryBudget
+from Metrics import Metrics, Reporter
+from RateLimiter import HostSlots, TokenBucket
+from RetryScheduler import CircuitBreaker, RetryPolicy, parse_retry_after
+from Services import Config, get_setting
+from UnzipStage import UnzipStage
+from WorkLedger import WorkLedger
+"""
+asyncio download backend, selected with Config.ASYNC_DOWNLOAD. Runs every
+transfer on one event loop with Config.THREAD_COUNT as the limit of
+concurrent transfers, which suits bulk lists of many small files where
+threads spend their time context switching.
+
+Follows the threaded engine's semantics: keep-alive connections shared
+per host, bodies streamed to '<name>.part' in at most
+Config.DOWNLOAD_CHUNK_SZ pieces, Config.HTTPS_CODES retries with per host
+breakers, Config.HOST_CONNS, Config.RATE_LIMIT, Config.DEDUP_DB,
+Config.UNZIP, Config.SYNC_WRITES, Config.VERIFY_HASH, Config.MEMORY_BUDGET
+and metrics. Files are not split into segments or journaled and zips are
+extracted once downloaded rather than while streaming, use the threaded
+engine for large archives.
+"""
+
+
+class _Response():
+    """
+    Minimal HTTP/1.1 response read off an asyncio stream
+    """
+
+    def __init__(self, status: int, headers: dict[str, str], reader: asyncio.StreamReader, method: str) -> None:
+        """
+        Args:
+            status (int): status code
+            headers (dict[str, str]): headers with lower case names
+            reader (asyncio.StreamReader): stream positioned at the body
+            method (str): method of the request, HEAD responses have no body
+        """
+        self.status = status
+        self.headers = headers
+        self.__reader = reader
+        self.chunked = "chunked" in headers.get("transfer-encoding", "").lower()
+        self.length = None
+        if status in (204, 304) or 100 <= status < 200 or method == "HEAD":
+            self.length = 0
+        elif not self.chunked and "content-length" in headers:
+            self.length = int(headers["content-length"])
+        # Bytes left of the current body or chunk, None until a chunk header is read
+        self.__left = self.length if not self.chunked else None
+        self.complete = self.length == 0
+        self.will_close = headers.get("connection", "").lower() == "close" or \
+            (self.length is None and not self.chunked)
+
+    def getheader(self, name: str, default: str | None = None) -> str | None:
+        return self.headers.get(name.lower(), default)
+
+    async def read(self, n: int) -> bytes:
+        """
+        Reads up to n bytes of the body
+
+        Args:
+            n (int): most bytes to return
+
+        Raises:
+            asyncio.IncompleteReadError: connection closed before the body ended
+
+        Returns:
+            bytes: body bytes, empty once the body is complete
+        """
+        if self.complete:
+            return b""
+        if self.chunked:
+            if not self.__left:
+                size = int((await self.__reader.readuntil(b"\r\n")).split(b";", 1)[0], 16)
+                if size == 0:
+                    # Skip trailers up to the blank line
+                    while await self.__reader.readuntil(b"\r\n") != b"\r\n":
+                        pass
+                    self.complete = True
+                    return b""
+                self.__left = size
+            data = await self.__reader.read(min(n, self.__left))
+            if not data:
+                raise asyncio.IncompleteReadError(b"", self.__left)
+            self.__left -= len(data)
+            if not self.__left:
+                await self.__reader.readexactly(2)
+            return data
+        if self.length is None:
+            data = await self.__reader.read(n)
+            self.complete = not data
+            return data
+        data = await self.__reader.read(min(n, self.__left))
+        if not data:
+            raise asyncio.IncompleteReadError(b"", self.__left)
+        self.__left -= len(data)
+        self.complete = not self.__left
+        return data
+
+    async def drain(self) -> None:
+        """
+        Reads and discards the rest of the body
+        """
+        while await self.read(64 * 1024):
+            pass
+
+
+class AsyncConnectionPool():
+    """
+    Keep-alive connections per (scheme, host) for a single event loop
+    """
+
+    def __init__(self, max_idle_per_host: int, timeout: float = DEFAULT_TIMEOUT) -> None:
+        """
+        Args:
+            max_idle_per_host (int): idle connections kept per host, extras are closed
+            timeout (float, optional): seconds to wait for a connection, response
+                headers or the next piece of a body. Defaults to DEFAULT_TIMEOUT.
+        """
+        self.__idle = dict()
+        self.__max_idle = max_idle_per_host
+        self.timeout = timeout
+        self.__ssl = None
+
+    async def request(self, method: str, url: str, headers: dict | None = None) -> tuple[_Response, tuple]:
+        """
+        Sends a request on a pooled connection, replacing a reused
+        connection the server has since closed
+
+        Args:
+            method (str): HTTP method
+            url (str): absolute url
+            headers (dict | None, optional): extra request headers. Defaults to None.
+
+        Raises:
+            ValueError: url is not http or https
+            OSError, asyncio.TimeoutError, asyncio.IncompleteReadError: request failed
+
+        Returns:
+            tuple[_Response, tuple]: response and a key to hand back to
+                finish() once the response has been consumed
+        """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError("{url} is not an http(s) url".format(url=url))
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        lines = ["{method} {target} HTTP/1.1".format(method=method, target=target),
+                 "Host: {host}".format(host=parts.netloc),
+                 "User-Agent: {agent}".format(agent=USER_AGENT),
+                 "Connection: keep-alive"]
+        for k, v in (headers or dict()).items():
+            lines.append("{k}: {v}".format(k=k, v=v))
+        payload = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+        key = (parts.scheme, parts.netloc)
+        while True:
+            idle = self.__idle.get(key)
+            reused = bool(idle)
+            if reused:
+                reader, writer = idle.pop()
+            else:
+                reader, writer = await asyncio.wait_for(self.__connect(parts), self.timeout)
+            try:
+                writer.write(payload)
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.timeout)
+                break
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                writer.close()
+                # Stale keep-alive connection, try again with another
+                if not reused:
+                    raise ConnectionError("Connection closed before response") from e
+            except BaseException:
+                writer.close()
+                raise
+
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        response_headers = dict()
+        for line in header_lines:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                response_headers[k.strip().lower()] = v.strip()
+        status = int(status_line.split(" ", 2)[1])
+        return _Response(status, response_headers, reader, method), (key, reader, writer)
+
+    async def __connect(self, parts: urllib.parse.SplitResult) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """
+        Opens a new connection to the host of parts
+        """
+        context = None
+        if parts.scheme == "https":
+            if self.__ssl is None:
+                self.__ssl = ssl.create_default_context()
+            context = self.__ssl
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        return await asyncio.open_connection(parts.hostname, port, ssl=context, limit=256 * 1024)
+
+    def finish(self, response: _Response, key: tuple) -> None:
+        """
+        Returns the connection of a response to the pool if it can be reused,
+        closes it otherwise
+        """
+        pool_key, reader, writer = key
+        idle = self.__idle.setdefault(pool_key, list())
+        if response.complete and not response.will_close and len(idle) < self.__max_idle:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+    def close(self) -> None:
+        """
+        Closes every idle connection
+        """
+        for conns in self.__idle.values():
+            for _, writer in conns:
+                writer.close()
+        self.__idle.clear()
+
+
+class AsyncDownloadEngine():
+    """
+    Event loop download engine with the same interface as DownloadEngine,
+    built from the settings returned by PandoraArgInterpretor.interpret.
+    Config.THREAD_COUNT worker coroutines pull files from a queue.
+    """
+
+    def __init__(self, settings: dict, retry_policy: RetryPolicy | None = None,
+                 metrics: Metrics | None = None) -> None:
+        """
+        Args:
+            settings (dict): dict returned by PandoraArgInterpretor.interpret
+            retry_policy (RetryPolicy | None, optional): backoff used for retries.
+                Defaults to None for RetryPolicy().
+            metrics (Metrics | None, optional): metrics to record into.
+                Defaults to None for a new Metrics.
+
+        Raises:
+            ValueError: Config.DOWNLOAD_FOLDER was not set or a numeric config is not positive
+        """
+        self.settings = settings
+        options = EngineOptions.from_settings(settings)
+        self.folder = options.folder
+        self.concurrency = options.thread_count
+        self.chunk_sz = options.chunk_sz
+        self.retry_codes = options.retry_codes
+        self.max_retries = options.max_retries
+        self.host_slots = HostSlots(options.host_conns)
+        self.bucket = TokenBucket(options.rate_limit) if options.rate_limit else None
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = CircuitBreaker(self.retry_policy)
+        self.store = DedupStore(options.dedup_db) if options.dedup_db else None
+        self.verify = options.verify
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.reporter = Reporter.from_settings(settings, self.metrics)
+        # Called with every DownloadResult once it is recorded
+        self.listeners = list()
+        self.budget = MemoryBudget.from_settings(settings)
+        self.read_sz = self.budget.read_sz(self.chunk_sz, self.concurrency)
+        self.unzip = UnzipStage(self.budget.workers("unzip"), self.metrics,
+                                self.budget.pending("unzip")) if options.unzip else None
+        self.writer = DiskWriter(options.sync_writes, metrics=self.metrics, max_bytes=self.budget.share("write"))
+        self.__idle_per_host = min(self.concurrency, options.host_conns or self.concurrency)
+
+    def download(self, urls: Iterable[str]) -> list[DownloadResult]:
+        """
+        Downloads every url on a new event loop and waits for completion
+
+        Args:
+            urls (Iterable[str]): urls to download
+
+        Returns:
+            list[DownloadResult]: result of every url, in completion order
+        """
+        return asyncio.run(self.download_async(urls))
+
+    def run(self) -> list[DownloadResult]:
+        """
+        Downloads every link of the Config.DOWNLOAD_URL bulk file, streamed
+        so the first download starts before the file is fully read. With
+        Config.WORK_LEDGER only the links this process claims are downloaded.
+
+        Returns:
+            list[DownloadResult]: result of every link
+        """
+        source = get_setting(self.settings, Config.DOWNLOAD_URL)
+        if not source:
+            return list()
+        ledger = WorkLedger.from_settings(self.settings)
+        if ledger is None:
+            return self.download(iter_links(source))
+        listener = lambda result: ledger.complete(result.url, result.ok)
+        with ledger:
+            ledger.load_source(source)
+            self.listeners.append(listener)
+            try:
+                results = self.download(ledger.claims(self.concurrency * 2, wait=False))
+                # Polled between runs, waiting inside the url iterator would hold up the event loop
+                while ledger.held_elsewhere():
+                    time.sleep(ledger.poll_interval)
+                    results += self.download(ledger.claims(self.concurrency * 2, wait=False))
+                return results
+            finally:
+                self.listeners.remove(listener)
+
+    async def download_async(self, urls: Iterable[str]) -> list[DownloadResult]:
+        """
+        Downloads every url on the running event loop
+
+        Args:
+            urls (Iterable[str]): urls to download, consumed lazily
+
+        Returns:
+            list[DownloadResult]: result of every url, in completion order
+        """
+        self.__pool = AsyncConnectionPool(self.__idle_per_host)
+        self.__queue = asyncio.Queue()
+        # Bounds how far the producer may run ahead of the workers
+        self.__slots = asyncio.Semaphore(self.concurrency * 2)
+        self.__pending = 0
+        self.__produced = False
+        self.__done = asyncio.Event()
+        self.__results = list()
+        self.__timers = set()
+        # Extractions being handed to the unzip stage off the loop
+        self.__unzipping = set()
+        # Sampled from the reporter's thread, both only ever read their length
+        queue, timers = self.__queue, self.__timers
+        self.metrics.gauge("queue_depth", queue.qsize, stage="download")
+        self.metrics.gauge("queue_depth", lambda: len(timers), stage="retry")
+        if self.reporter is not None:
+            self.reporter.start()
+
+        workers = [asyncio.create_task(self.__work()) for _ in range(self.concurrency)]
+        names = FileNames()
+        try:
+            for url in urls:
+                await self.__slots.acquire()
+                self.__pending += 1
+                self.__queue.put_nowait((DownloadTask(url, os.path.join(self.folder, names.name(url))), True))
+            self.__produced = True
+            if self.__pending == 0:
+                self.__done.set()
+            await self.__done.wait()
+            await asyncio.gather(*self.__unzipping)
+        finally:
+            for timer in self.__timers:
+                timer.cancel()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self.__pool.close()
+            self.writer.close()
+        if self.unzip is not None:
+            # Downloads are done, nothing is left for the loop to run meanwhile
+            self.unzip.join()
+        if self.reporter is not None:
+            self.reporter.stop()
+        return self.__results
+
+    def __defer(self, task: DownloadTask, delay: float) -> None:
+        """
+        Puts a task back on the queue after delay seconds without holding a worker
+        """
+        loop = asyncio.get_running_loop()
+        timer = None
+
+        def due():
+            self.__timers.discard(timer)
+            self.__queue.put_nowait((task, False))
+        timer = loop.call_later(delay, due)
+        self.__timers.add(timer)
+
+    def __record(self, result: DownloadResult) -> None:
+        """
+        Logs and stores the result of a finished file
+        """
+        if result.error:
+            logging.warning("Failed to download {url}: {error}".format(url=result.url, error=result.error))
+        else:
+            logging.debug("Downloaded {url} -> {path}".format(url=result.url, path=result.path))
+            if self.store is not None and result.linked_from is None:
+                try:
+                    result.linked_from = self.store.add(result.path, result.url, result.etag, result.sha256)
+                except (OSError, ValueError) as e:
+                    logging.warning("Could not index {path}: {error}".format(path=result.path, error=repr(e)))
+            if self.unzip is not None and result.linked_from != result.path:
+                # Blocks while the pool is full, which would stall every transfer
+                future = asyncio.ensure_future(asyncio.to_thread(self.unzip.submit, result.path))
+                self.__unzipping.add(future)
+                future.add_done_callback(self.__unzipping.discard)
+        self.metrics.inc("files_total", outcome=result.outcome)
+        for listener in self.listeners:
+            listener(result)
+        self.__results.append(result)
+        self.__pending -= 1
+        if self.__produced and self.__pending == 0:
+            self.__done.set()
+
+    async def __work(self) -> None:
+        """
+        Worker coroutine, mirrors DownloadEngine's worker loop
+        """
+        while True:
+            task, new = await self.__queue.get()
+            if new:
+                self.__slots.release()
+            host = urllib.parse.urlsplit(task.url).netloc
+            wait = self.breaker.allow(host)
+            if wait > 0:
+                self.__defer(task, wait + self.retry_policy.jitter())
+                continue
+            if not self.host_slots.acquire(host, task):
+                continue
+            try:
+                result = await self.fetch(task)
+            except Exception as e:
+                self.breaker.release(host)
+                result = DownloadResult(task.url, task.path, error=repr(e))
+            finally:
+                parked = self.host_slots.release(host)
+                if parked:
+                    self.__queue.put_nowait((parked, False))
+            if result:
+                self.__record(result)
+
+    async def fetch(self, task: DownloadTask) -> DownloadResult | None:
+        """
+        Downloads a task
+
+        Args:
+            task (DownloadTask): task to download
+
+        Returns:
+            DownloadResult | None: outcome of the download, None if it was
+                deferred for a retry
+        """
+        host = urllib.parse.urlsplit(task.url).netloc
+        if self.store is not None:
+            result = self.__reuse(task, self.store.find_url(task.url) or self.store.find_hash(url_sha256(task.url)))
+            if result:
+                # Nothing was requested, a probe of a paused host passes to the next job
+                self.breaker.release(host)
+                return result
+        start = time.perf_counter()
+        response, key = await self.__pool.request("GET", task.url)
+        self.metrics.observe("ttfb_seconds", time.perf_counter() - start, host=host)
+        try:
+            if response.status in self.retry_codes:
+                await response.drain()
+                return self.__retry(task, host, response)
+            self.breaker.success(host)
+            if response.status != 200:
+                await response.drain()
+                return DownloadResult(task.url, task.path, status=response.status,
+                                      error="HTTP {status}".format(status=response.status))
+            etag = response.getheader("ETag")
+            if self.store is not None:
+                # Body is left unread, finish() closes the connection
+                result = self.__reuse(task, self.store.find_etag(host, etag, response.length), response.status)
+                if result:
+                    return result
+            part = self.writer.open(task.path + PART_SUFFIX, response.length)
+            verifier = Verifier.for_url(task.url, self.verify) if self.verify is not None else None
+            observers = [verifier] if verifier is not None else list()
+            hasher = None
+            if self.store is not None and verifier is not None and verifier.hash_type == "sha256":
+                # One sha256 serves both
+                hasher = verifier.hasher
+            elif self.store is not None:
+                hasher = hashlib.sha256()
+                observers.append(hasher)
+            try:
+                written = await self.__stream(response, part, observers, host)
+                corrupt = None
+                if response.length is not None and written != response.length:
+                    corrupt = "Expected {size} bytes, received {written}".format(size=response.length, written=written)
+                elif not response.complete:
+                    # Only a body read until the connection closes may end there
+                    corrupt = "Connection closed before the last chunk, received {written} bytes".format(
+                        written=written)
+                elif verifier is not None:
+                    corrupt = verifier.verify(part.path, written)
+            except BaseException:
+                part.close()
+                _remove(part.path)
+                raise
+            if corrupt:
+                part.close()
+                _remove(part.path)
+                if verifier is not None:
+                    return self.__refetch(task, corrupt)
+                return DownloadResult(task.url, task.path, written, response.status, corrupt)
+            error = await self.__commit(part, task.path)
+            if error:
+                return DownloadResult(task.url, task.path, written, response.status, error)
+            return DownloadResult(task.url, task.path, written, response.status,
+                                  etag=etag if etag and not etag.startswith("W/") else None,
+                                  sha256=hasher.hexdigest() if hasher else None,
+                                  digest=verifier.digest() if verifier is not None else None)
+        finally:
+            self.__pool.finish(response, key)
+
+    def __reuse(self, task: DownloadTask, known: str | None, status: int = 0) -> DownloadResult | None:
+        """
+        Satisfies a task with the indexed file known instead of downloading
+        it, see DownloadEngine
+
+        Returns:
+            DownloadResult | None: result of the task, None if it must be downloaded
+        """
+        if known is None or not self.store.reuse(known, task.path, task.url):
+            return None
+        logging.info("{url} already downloaded as {known}, skipped".format(url=task.url, known=known))
+        return DownloadResult(task.url, task.path, os.path.getsize(task.path), status, linked_from=known)
+
+    def __retry(self, task: DownloadTask, host: str, response: _Response) -> DownloadResult | None:
+        """
+        Pauses host and defers task, or fails it once out of retries
+        """
+        pause = self.breaker.failure(host, parse_retry_after(response.getheader("Retry-After")))
+        if self.max_retries is not None and task.attempts >= self.max_retries:
+            return DownloadResult(task.url, task.path, status=response.status,
+                                  error="HTTP {status} after {n} retries".format(status=response.status, n=task.attempts))
+        task.attempts += 1
+        self.metrics.inc("retries_total", code=response.status)
+        logging.info("HTTP {status} from {host}, retry {n} of {url} in {pause:.1f}s".format(
+            status=response.status, host=host, n=task.attempts, url=task.url, pause=pause))
+        self.__defer(task, pause + self.retry_policy.jitter())
+        return None
+
+    def __refetch(self, task: DownloadTask, error: str) -> DownloadResult | None:
+        """
+        Defers a task whose file came out corrupt to download it again, or
+        fails it once out of attempts, see DownloadEngine
+        """
+        limit = self.max_retries if self.max_retries is not None else MAX_REFETCHES
+        if task.attempts >= limit:
+            return DownloadResult(task.url, task.path, status=200, error="{error}, after {n} retries".format(
+                error=error, n=task.attempts))
+        task.attempts += 1
+        self.metrics.inc("retries_total", code="corrupt")
+        logging.warning("{url} is corrupt, downloading it again: {error}".format(url=task.url, error=error))
+        self.__defer(task, self.retry_policy.delay(task.attempts))
+        return None
+
+    async def __commit(self, part: PartFile, path: str) -> str | None:
+        """
+        Commits a finished partial file to the writer and waits, without
+        blocking the loop, until it is in place. A synced commit may wait for
+        the memory budget and is handed over from a thread.
+
+        Returns:
+            str | None: why the file could not be moved into place, None if it was
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        done = lambda error: loop.call_soon_threadsafe(future.set_result, error)
+        if self.writer.sync and self.writer.max_bytes is not None:
+            await asyncio.to_thread(self.writer.commit, part, path, done)
+        else:
+            self.writer.commit(part, path, done)
+        return await future
+
+    async def __stream(self, response: _Response, part: PartFile, observers: list | None = None,
+                       host: str = "") -> int:
+        """
+        Streams a response body into part, at most read_sz bytes are read
+        at a time and each read waits at most the pool timeout. observers'
+        update() is called with every chunk. Bytes are recorded under host.
+
+        Returns:
+            int: bytes written, short of the body and with the response not
+                complete if the connection closed early
+        """
+        timeout = self.__pool.timeout
+        read_sz = self.read_sz
+        if self.bucket:
+            read_sz = min(read_sz, max(int(self.bucket.rate) // 10, 16 * 1024))
+        written = 0
+        metrics = self.metrics
+        while True:
+            # Network time includes waiting for the loop, which other transfers hold
+            start = time.perf_counter()
+            try:
+                data = await asyncio.wait_for(response.read(read_sz), timeout)
+            except asyncio.IncompleteReadError:
+                break
+            read = time.perf_counter()
+            metrics.inc("stage_seconds_total", read - start, stage="network")
+            if not data:
+                break
+            part.write(written, data)
+            wrote = time.perf_counter()
+            metrics.inc("stage_seconds_total", wrote - read, stage="disk")
+            if observers:
+                for observer in observers:
+                    observer.update(data)
+                metrics.inc("stage_seconds_total", time.perf_counter() - wrote, stage="hash")
+            metrics.inc("bytes_total", len(data), host=host)
+            written += len(data)
+            if self.bucket:
+                wait = self.bucket.reserve(len(data))
+                if wait > 0:
+                    metrics.inc("stage_seconds_total", wait, stage="throttle")
+                    await asyncio.sleep(wait)
+        return written
+
+
+def _remove(path: str) -> None:
+    """
+    Removes a file if it exists
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
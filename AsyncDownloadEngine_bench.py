@@ -0,0 +1,46 @@
+import resource
+import sys
+import tempfile
+import time
+import PandoraArgInterpretor
+from AsyncDownloadEngine import AsyncDownloadEngine
+from DownloadEngine import DownloadEngine
+from MockServer import MockServerProcess, gen_path
+"""
+Compares the asyncio engine with the threaded engine on many small files
+served by a MockServer in a child process.
+
+Run directly: python AsyncDownloadEngine_bench.py [file count] [file size] [concurrency]
+"""
+
+
+def bench(engine_type: type, count: int, size: int, concurrency: int) -> float:
+    """
+    Downloads count files of size bytes with an engine
+
+    Returns:
+        float: files per second
+    """
+    with MockServerProcess() as server, tempfile.TemporaryDirectory() as folder:
+        urls = [server.url(gen_path(size, i, "f{i}.jpg".format(i=i))) for i in range(count)]
+        settings = PandoraArgInterpretor.interpret(['.py', '-d', folder, '-t', str(concurrency)])
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+        results = engine_type(settings).download(urls)
+        elapsed = time.perf_counter() - start
+        after = resource.getrusage(resource.RUSAGE_SELF)
+    assert len(results) == count and all(r.ok for r in results)
+    cpu = (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime)
+    print("{name:<20} concurrency={c:<4} {fps:8.1f} files/s  {cpu:6.2f} cpu s  {per:7.1f} files/cpu s  "
+          "connections={n}".format(name=engine_type.__name__, c=concurrency, fps=count / elapsed, cpu=cpu,
+                                   per=count / cpu if cpu else 0, n=server.stats["connections"]))
+    return count / elapsed
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 8 * 1024
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+    for c in sorted({6, concurrency}):
+        bench(DownloadEngine, count, size, c)
+        bench(AsyncDownloadEngine, count, size, c)
@@ -0,0 +1,247 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import unittest
+import PandoraArgInterpretor
+from AsyncDownloadEngine import AsyncDownloadEngine
+from DownloadEngine import DownloadEngine, create_engine
+from MockServer import MockServer, pattern
+from RetryScheduler import RetryPolicy
+from UnzipStage_test import make_zip
+
+
+class AsyncDownloadEngineTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """
+        Starts a local server and creates a scratch download folder
+        """
+        logging.basicConfig(level=logging.INFO)
+        self.server = MockServer()
+        self.server.start()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        self.tmp.cleanup()
+
+    def settings(self, *args: str) -> dict:
+        """
+        Interprets args with the async switch, download folder is always
+        the scratch folder
+        """
+        return PandoraArgInterpretor.interpret(['.py', '-a', '-d', self.tmp.name] + list(args))
+
+    def read(self, fname: str) -> bytes:
+        with open(os.path.join(self.tmp.name, fname), 'rb') as fp:
+            return fp.read()
+
+    def test_create_engine(self):
+        """
+        --async selects the event loop engine
+        """
+        self.assertIsInstance(create_engine(self.settings()), AsyncDownloadEngine)
+        settings = PandoraArgInterpretor.interpret(['.py', '-d', self.tmp.name])
+        self.assertIsInstance(create_engine(settings), DownloadEngine)
+
+    def test_many_files(self):
+        """
+        Many small files over a bounded number of keep-alive connections
+        """
+        urls = [self.server.add_generated("/f{i}.bin".format(i=i), 500 + i, seed=i) for i in range(200)]
+        results = AsyncDownloadEngine(self.settings('-t', '16')).download(urls)
+
+        self.assertEqual(200, len(results))
+        self.assertTrue(all(r.ok for r in results))
+        for i in range(0, 200, 17):
+            self.assertEqual(pattern(500 + i, i), self.read("f{i}.bin".format(i=i)))
+        self.assertLessEqual(self.server.connections, 16)
+        self.assertLessEqual(self.server.max_active, 16)
+
+    def test_sync_writes(self):
+        """
+        Synced files land in place without blocking the loop
+        """
+        urls = [self.server.add_generated("/f{i}.bin".format(i=i), 500 + i, seed=i) for i in range(20)]
+        engine = AsyncDownloadEngine(self.settings('-t', '8', '--fsync'))
+        results = engine.download(urls)
+
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(20, engine.writer.committed)
+        self.assertEqual(20, len(os.listdir(self.tmp.name)))
+
+    def test_chunked_stream(self):
+        """
+        Content-Length and chunked bodies larger than the chunk size
+        """
+        plain = self.server.add_generated("/plain.bin", 300000, seed=1)
+        chunked = self.server.add_file("/chunked.bin", pattern(300000, 2), chunked=True)
+        results = AsyncDownloadEngine(self.settings('-t', '1', '-c', '4096')).download([plain, chunked])
+
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(pattern(300000, 1), self.read("plain.bin"))
+        self.assertEqual(pattern(300000, 2), self.read("chunked.bin"))
+        # Both bodies were fully read so the connection was reused
+        self.assertEqual(1, self.server.connections)
+
+    def test_chunked_cut_short(self):
+        """
+        A chunked body dropped before its last chunk fails like in the threaded engine
+        """
+        url = self.server.add_file("/cut.bin", pattern(50000, 3), chunked=True, cut_after=20000)
+        results = AsyncDownloadEngine(self.settings('-t', '1')).download([url])
+        threaded = DownloadEngine(PandoraArgInterpretor.interpret(['.py', '-d', self.tmp.name])).download([url])
+
+        self.assertFalse(results[0].ok)
+        self.assertIn("last chunk", results[0].error)
+        self.assertFalse(threaded[0].ok)
+        self.assertEqual([], os.listdir(self.tmp.name))
+
+    def test_retry_codes(self):
+        """
+        Scripted 429 responses are retried, retry limit is honored
+        """
+        ok = self.server.add_generated("/ok.bin", 1000)
+        self.server.script("/ok.bin", [429, (429, {"Retry-After": "0"})])
+        bad = self.server.add_generated("/bad.bin", 1000)
+        self.server.script("/bad.bin", [403] * 5)
+        engine = AsyncDownloadEngine(self.settings('-r', '2'), RetryPolicy(base=0.01))
+        results = {r.url: r for r in engine.download([ok, bad])}
+
+        self.assertTrue(results[ok].ok)
+        self.assertEqual(3, self.server.hits["/ok.bin"])
+        self.assertEqual(403, results[bad].status)
+        self.assertEqual(3, self.server.hits["/bad.bin"])
+        self.assertEqual((2, 2), (engine.metrics.counter("retries_total", code=429),
+                                  engine.metrics.counter("retries_total", code=403)))
+        self.assertEqual((1, 1), (engine.metrics.counter("files_total", outcome="ok"),
+                                  engine.metrics.counter("files_total", outcome="failed")))
+
+    def test_host_conns(self):
+        """
+        Concurrent requests to a host never exceed --host_conns
+        """
+        self.server.stop()
+        self.server = MockServer(throttle=2000000)
+        self.server.start()
+        urls = [self.server.add_generated("/a{i}".format(i=i), 20000) for i in range(12)]
+        results = AsyncDownloadEngine(self.settings('-t', '8', '--host_conns', '3')).download(urls)
+
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(3, self.server.max_active)
+
+    def test_errors(self):
+        """
+        Missing files and dropped connections are reported, partial files removed
+        """
+        missing = self.server.url("/missing.bin")
+        dropped = self.server.add_generated("/drop.bin", 100000, cut_after=1000)
+        results = AsyncDownloadEngine(self.settings()).download([missing, dropped])
+        results = {r.url: r for r in results}
+
+        self.assertEqual(404, results[missing].status)
+        self.assertFalse(results[dropped].ok)
+        self.assertEqual([], os.listdir(self.tmp.name))
+
+    def test_dedup(self):
+        """
+        Known urls are skipped and identical content hardlinked, the index
+        is shared with the threaded engine
+        """
+        db = os.path.join(self.tmp.name, "index.db")
+        first = self.server.add_generated("/a.bin", 20000, seed=1, headers={"ETag": ""})
+        second = self.server.add_generated("/b.bin", 20000, seed=1, headers={"ETag": ""})
+        DownloadEngine(PandoraArgInterpretor.interpret(['.py', '-d', self.tmp.name, '--dedup', db])).download([first])
+        results = AsyncDownloadEngine(self.settings('--dedup', db)).download([first, second])
+        results = {r.url: r for r in results}
+
+        self.assertEqual(1, self.server.hits["/a.bin"])
+        self.assertEqual(os.path.join(self.tmp.name, "a.bin"), results[second].linked_from)
+        self.assertTrue(os.path.samefile(os.path.join(self.tmp.name, "a.bin"), os.path.join(self.tmp.name, "b.bin")))
+
+    def test_same_file_name(self):
+        """
+        Urls of one run ending in the same name are saved side by side
+        """
+        urls = [self.server.add_generated("/{d}/image.jpg".format(d=d), 5000, seed=i) for i, d in enumerate("ab")]
+        results = AsyncDownloadEngine(self.settings()).download(urls)
+
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(pattern(5000, 0), self.read("image.jpg"))
+        self.assertEqual(pattern(5000, 1), self.read("image (2).jpg"))
+
+    def test_dedup_breaker_probe(self):
+        """
+        Indexed urls of a paused host do not hold on to the breaker's probe
+        """
+        db = os.path.join(self.tmp.name, "index.db")
+        known = [self.server.add_generated("/k{i}.bin".format(i=i), 1000, seed=i) for i in range(5)]
+        AsyncDownloadEngine(self.settings('--dedup', db)).download(known)
+        url = self.server.add_generated("/r.bin", 1000)
+        self.server.script("/r.bin", [429])
+        engine = AsyncDownloadEngine(self.settings('-t', '1', '--dedup', db), RetryPolicy(base=0.05))
+        results = list()
+        thread = threading.Thread(target=lambda: results.extend(engine.download([url] + known)), daemon=True)
+        thread.start()
+        thread.join(10)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(6, len(results))
+        self.assertTrue(all(result.ok for result in results))
+
+    def test_memory_budget(self):
+        """
+        Commits and extractions waiting for a tight budget do not stall the loop
+        """
+        urls = [self.server.add_file("/z{i}.zip".format(i=i), make_zip(members={"a.txt": pattern(5000, i)}))
+                for i in range(4)]
+        urls += [self.server.add_generated("/f{i}.bin".format(i=i), 5000, seed=i) for i in range(4)]
+        engine = AsyncDownloadEngine(self.settings('-t', '4', '--fsync', '-u', '-m', '1000'), RetryPolicy(base=0.01))
+        lags = list()
+
+        async def tick():
+            loop = asyncio.get_running_loop()
+            while True:
+                start = loop.time()
+                await asyncio.sleep(0.01)
+                lags.append(loop.time() - start - 0.01)
+
+        async def run():
+            ticker = asyncio.create_task(tick())
+            try:
+                return await engine.download_async(urls)
+            finally:
+                ticker.cancel()
+        results = asyncio.run(run())
+
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(4, len(engine.unzip.results))
+        self.assertEqual(200, engine.writer.max_bytes)
+        # Each synced commit waits out a flush interval on its own
+        self.assertLess(max(lags), 0.15)
+        for i in range(4):
+            self.assertEqual(pattern(5000, i), self.read(os.path.join("z{i}".format(i=i), "a.txt")))
+
+    def test_verify_refetch(self):
+        """
+        Corrupt and short files are downloaded again
+        """
+        data = os.urandom(30000)
+        sha = hashlib.sha256(data).hexdigest()
+        corrupt = self.server.add_file("/data/{sha}.bin".format(sha=sha), data, corrupt=2)
+        plain = self.server.add_file("/plain.bin", b"plain")
+        engine = AsyncDownloadEngine(self.settings('--verify', 'blake2b'), RetryPolicy(base=0.01))
+        results = {result.url: result for result in engine.download([corrupt, plain])}
+
+        self.assertTrue(all(result.ok for result in results.values()))
+        self.assertEqual(data, self.read(sha + ".bin"))
+        self.assertEqual("sha256:" + sha, results[corrupt].digest)
+        self.assertEqual("blake2b:" + hashlib.blake2b(b"plain").hexdigest(), results[plain].digest)
+        self.assertEqual(2, engine.metrics.counter("retries_total", code="corrupt"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,269 @@
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+import PandoraArgInterpretor
+from DownloadEngine import create_engine
+from KemonoComponent import KemonoComponent
+from MockServer import MockServerProcess, gen_creator, gen_path
+from RetryScheduler import RetryPolicy
+"""
+Reproducible benchmark of the download pipeline against a MockServer in
+a child process, serving generated files of a configurable size or a
+generated Kemono creator, optionally throttled, without ranges or with
+429/403 bursts.
+
+Every thread count and chunk size combination runs in a fresh process so
+its peak RSS is its own, and is measured in files/s, MB/s, peak RSS and
+CPU seconds per MB. Results are saved as JSON named after the commit so
+runs on different commits can be compared.
+
+Run directly:
+    python Benchmark.py -t 1,6,12 -c 65536,8388608 --files 500 --size 1048576 --repeat 3
+    python Benchmark.py --kemono --files 200 --files-per-post 5 --bursts 50,4
+    python Benchmark.py --compare benchmarks/abc1234.json
+"""
+
+# Where results go by default, '<commit>.json' inside
+RESULTS_FOLDER = "benchmarks"
+
+
+@dataclass
+class Scenario:
+    """
+    What the server serves and how the engine is set up
+
+    files: files to download, or posts with kemono
+    size: bytes of every file
+    kemono: download a generated Kemono creator of files posts instead of urls
+    files_per_post: files of every post with kemono
+    throttle: bytes/sec cap per server connection, None for none
+    bursts: (every, length) of 429/403 bursts, None for none, see MockServer
+    ranges: server honors byte ranges
+    async_engine: use the asyncio engine, not with kemono
+    retry_base: base delay in seconds of the engine's RetryPolicy
+    """
+    files: int = 500
+    size: int = 64 * 1024
+    kemono: bool = False
+    files_per_post: int = 4
+    throttle: int | None = None
+    bursts: tuple[int, int] | None = None
+    ranges: bool = True
+    async_engine: bool = False
+    retry_base: float = 0.05
+
+
+@dataclass
+class RunResult:
+    """
+    Measurements of one thread count and chunk size
+
+    peak_rss_mb: peak resident memory of the process that ran the download
+    cpu_s_per_mb: user and system CPU seconds spent per MB downloaded
+    retries: responses retried, by HTTP code
+    """
+    threads: int
+    chunk_sz: int
+    files: int
+    failed: int
+    bytes: int
+    seconds: float
+    files_per_s: float
+    mb_per_s: float
+    peak_rss_mb: float
+    cpu_s_per_mb: float
+    retries: dict = field(default_factory=dict)
+
+
+def run_one(base_url: str, scenario: Scenario, threads: int, chunk_sz: int) -> RunResult:
+    """
+    Downloads the scenario once. Runs in a fresh child process.
+
+    Args:
+        base_url (str): url of the server, without a path
+        scenario (Scenario): what to download
+        threads (int): Config.THREAD_COUNT
+        chunk_sz (int): Config.DOWNLOAD_CHUNK_SZ
+
+    Returns:
+        RunResult: measurements of the download
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        args = ['.py', '-d', folder, '-t', str(threads), '-c', str(chunk_sz)]
+        if scenario.async_engine:
+            args.append('-a')
+        settings = PandoraArgInterpretor.interpret(args)
+        policy = RetryPolicy(base=scenario.retry_base)
+        engine = create_engine(settings, policy)
+        cpu = time.process_time()
+        start = time.perf_counter()
+        if scenario.kemono:
+            component = KemonoComponent(settings, policy, engine.metrics)
+            try:
+                results = component.download_creator(
+                    base_url + gen_creator(scenario.files, scenario.files_per_post, scenario.size), engine)
+            finally:
+                component.close()
+        else:
+            results = engine.download(base_url + gen_path(scenario.size, i, "f{i}.bin".format(i=i))
+                                      for i in range(scenario.files))
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu
+    ok = [result for result in results if result.ok]
+    size = sum(result.size for result in ok)
+    retries = {str(series["labels"]["code"]): series["value"] for series in engine.metrics.snapshot()["counters"]
+               if series["name"] == "retries_total"}
+    # Kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != "darwin" else 1024 * 1024)
+    return RunResult(threads, chunk_sz, len(ok), len(results) - len(ok), size, elapsed, len(ok) / elapsed,
+                     size / elapsed / 1e6, peak, cpu / (size / 1e6) if size else 0.0, retries)
+
+
+def run_suite(scenario: Scenario, threads: list[int], chunk_szs: list[int], repeat: int = 1) -> list[RunResult]:
+    """
+    Runs the scenario for every thread count and chunk size against one server
+
+    Args:
+        scenario (Scenario): what to download
+        threads (list[int]): thread counts to try
+        chunk_szs (list[int]): chunk sizes to try
+        repeat (int, optional): runs of every combination, the run of median
+            files/s is kept. Defaults to 1.
+
+    Raises:
+        ValueError: the asyncio engine was asked for with a Kemono scenario
+
+    Returns:
+        list[RunResult]: result of every combination
+    """
+    if scenario.kemono and scenario.async_engine:
+        raise ValueError("Kemono downloads need the threaded engine")
+    results = list()
+    context = multiprocessing.get_context("spawn")
+    with MockServerProcess(ranges=scenario.ranges, throttle=scenario.throttle, bursts=scenario.bursts) as server:
+        for thread_count in threads:
+            for chunk_sz in chunk_szs:
+                runs = list()
+                for _ in range(repeat):
+                    with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as executor:
+                        future = executor.submit(run_one, server.url(""), scenario, thread_count, chunk_sz)
+                        runs.append(future.result())
+                runs.sort(key=lambda run: run.files_per_s)
+                results.append(runs[len(runs) // 2])
+    return results
+
+
+def get_commit() -> str:
+    """
+    Returns:
+        str: short hash of the checked out commit, '+dirty' suffixed if the
+            tree has changes, 'unknown' outside a git checkout
+    """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=folder, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=folder,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("+dirty" if dirty else "")
+
+
+def save(path: str, scenario: Scenario, results: list[RunResult]) -> dict:
+    """
+    Writes results with the scenario, commit and machine they were measured on
+
+    Returns:
+        dict: document written
+    """
+    document = {"commit": get_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+                "scenario": asdict(scenario), "results": [asdict(result) for result in results]}
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fp:
+        json.dump(document, fp, indent=1)
+    return document
+
+
+def compare(new: dict, old: dict) -> list[str]:
+    """
+    Compares the runs of two saved documents with the same thread count and chunk size
+
+    Args:
+        new (dict): document of the run to judge
+        old (dict): document to compare against
+
+    Returns:
+        list[str]: one line per run found in both, changes in percent
+    """
+    # Tuples come back from JSON as lists
+    if json.dumps(new["scenario"], sort_keys=True) != json.dumps(old["scenario"], sort_keys=True):
+        lines = ["Scenarios differ, comparison is not like for like"]
+    else:
+        lines = list()
+    before = {(run["threads"], run["chunk_sz"]): run for run in old["results"]}
+    for run in new["results"]:
+        previous = before.get((run["threads"], run["chunk_sz"]))
+        if previous is None:
+            continue
+        changes = list()
+        for key, unit in (("files_per_s", "files/s"), ("mb_per_s", "MB/s"), ("peak_rss_mb", "MB RSS"),
+                          ("cpu_s_per_mb", "cpu s/MB")):
+            change = (run[key] - previous[key]) * 100 / previous[key] if previous[key] else 0.0
+            changes.append("{value:.4g} {unit} ({change:+.1f}%)".format(value=run[key], unit=unit, change=change))
+        lines.append("threads={t:<3} chunk={c:<9} {changes}  vs {commit}".format(
+            t=run["threads"], c=run["chunk_sz"], changes=", ".join(changes), commit=old["commit"]))
+    return lines
+
+
+def _ints(value: str) -> list[int]:
+    return [int(token) for token in value.split(",") if token.strip()]
+
+
+def main(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the download pipeline against a local mock server")
+    parser.add_argument("-t", "--threads", type=_ints, default=[1, 6, 12], help="comma separated thread counts")
+    parser.add_argument("-c", "--chunks", type=_ints, default=[64 * 1024 * 1024], help="comma separated chunk sizes")
+    parser.add_argument("--files", type=int, default=500, help="files, or posts with --kemono")
+    parser.add_argument("--size", type=int, default=64 * 1024, help="bytes per file")
+    parser.add_argument("--kemono", action="store_true", help="download a generated Kemono creator")
+    parser.add_argument("--files-per-post", type=int, default=4)
+    parser.add_argument("--throttle", type=int, help="bytes/sec per server connection")
+    parser.add_argument("--bursts", type=_ints, help="'every,length', 429/403 bursts of length every requests")
+    parser.add_argument("--no-ranges", action="store_true", help="server ignores Range requests")
+    parser.add_argument("--async", dest="async_engine", action="store_true", help="use the asyncio engine")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per combination, the median is kept")
+    parser.add_argument("--out", help="results file, defaults to {folder}/<commit>.json".format(folder=RESULTS_FOLDER))
+    parser.add_argument("--compare", help="results file of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    scenario = Scenario(args.files, args.size, args.kemono, args.files_per_post, args.throttle,
+                        tuple(args.bursts) if args.bursts else None, not args.no_ranges, args.async_engine)
+    results = run_suite(scenario, args.threads, args.chunks, args.repeat)
+    for result in results:
+        print("threads={t:<3} chunk={c:<9} {fps:9.1f} files/s {mbs:8.1f} MB/s {rss:7.1f} MB RSS "
+              "{cpu:6.3f} cpu s/MB failed={failed} retries={retries}".format(
+                  t=result.threads, c=result.chunk_sz, fps=result.files_per_s, mbs=result.mb_per_s,
+                  rss=result.peak_rss_mb, cpu=result.cpu_s_per_mb, failed=result.failed, retries=result.retries))
+    path = args.out or os.path.join(RESULTS_FOLDER, "{commit}.json".format(commit=get_commit()))
+    document = save(path, scenario, results)
+    print("Saved {path}".format(path=path))
+    if args.compare:
+        with open(args.compare) as fp:
+            for line in compare(document, json.load(fp)):
+                print(line)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,81 @@
+import json
+import logging
+import os
+import tempfile
+import unittest
+from Benchmark import Scenario, compare, run_suite, save
+from MockServer import MockServer, gen_creator, gen_path, pattern
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """
+        Creates a scratch folder
+        """
+        logging.basicConfig(level=logging.INFO)
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_generated_creator(self):
+        """
+        Generated creators are listed in pages and their files served under /data
+        """
+        with MockServer() as server:
+            page = server.get_entry("/api/v1" + gen_creator(60, 2, 100), "o=50")
+            posts = json.loads(page.read(0, page.size))
+
+            self.assertEqual(["10", "9"], [post["id"] for post in posts[:2]])
+            self.assertEqual(10, len(posts))
+            path = posts[0]["attachments"][1]["path"]
+            self.assertEqual(gen_path(100, 21, "10-1.bin"), path)
+            entry = server.get_entry("/data" + path)
+            self.assertEqual(pattern(100, 21), entry.read(0, 100))
+
+    def test_bursts(self):
+        """
+        Bursts answer generated payloads 429 and 403 in turn
+        """
+        with MockServer(bursts=(2, 2)) as server:
+            answers = [server.next_burst() for _ in range(8)]
+
+        self.assertEqual([None, None, (429, {}), (403, {})] * 2, answers)
+
+    def test_suite(self):
+        """
+        Every combination is measured in a child process, bursts are retried
+        """
+        results = run_suite(Scenario(files=6, size=5000, kemono=True, files_per_post=2, bursts=(5, 2),
+                                     retry_base=0.01), [1, 2], [4096])
+
+        self.assertEqual([(1, 4096), (2, 4096)], [(r.threads, r.chunk_sz) for r in results])
+        for result in results:
+            self.assertEqual((12, 0, 60000), (result.files, result.failed, result.bytes))
+            self.assertGreater(sum(result.retries.values()), 0)
+            self.assertGreater(result.peak_rss_mb, 1)
+        with self.assertRaises(ValueError):
+            run_suite(Scenario(kemono=True, async_engine=True), [1], [4096])
+
+    def test_save_compare(self):
+        """
+        Saved runs compare against runs of the same combination
+        """
+        scenario = Scenario(files=4, size=1000)
+        results = run_suite(scenario, [1], [65536])
+        path = os.path.join(self.tmp.name, "runs", "a.json")
+        document = save(path, scenario, results)
+        with open(path) as fp:
+            old = json.load(fp)
+
+        self.assertEqual(4, old["results"][0]["files"])
+        lines = compare(document, old)
+        self.assertEqual(1, len(lines))
+        self.assertIn("(+0.0%)", lines[0])
+        scenario.size = 2000
+        self.assertTrue(compare(save(path, scenario, results), old)[0].startswith("Scenarios differ"))
+
+
+if __name__ == '__main__':
+    unittest.main()
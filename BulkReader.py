@@ -0,0 +1,207 @@
+import gzip
+import hashlib
+import io
+import math
+import sys
+from typing import Iterator, TextIO
+"""
+Streaming reader for Config.DOWNLOAD_URL. Links are yielded one at a time
+as the bulk file is read so downloads start with the first line and
+memory does not grow with the size of the list. Plain text, gzip
+compressed files, stdin ('-') and a single url are accepted.
+
+Usage:
+    for url in iter_links(get_setting(settings, Config.DOWNLOAD_URL)):
+        engine.submit(url)
+"""
+
+# Source value meaning read links from stdin
+STDIN = "-"
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def is_url(source: str) -> bool:
+    """
+    Returns:
+        bool: True if source is an http(s) url rather than a file
+    """
+    return source.lower().startswith(("http://", "https://"))
+
+
+def open_source(source: str) -> TextIO:
+    """
+    Opens a bulk file for reading as text, gzip files are detected by
+    their magic bytes rather than their extension
+
+    Args:
+        source (str): file path or '-' for stdin
+
+    Returns:
+        TextIO: text stream of the links
+    """
+    if source == STDIN:
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", errors="replace") \
+            if hasattr(sys.stdin, "buffer") else sys.stdin
+    fp = open(source, "rb")
+    if fp.peek(2)[:2] == GZIP_MAGIC:
+        return io.TextIOWrapper(gzip.GzipFile(fileobj=fp), encoding="utf-8", errors="replace")
+    return io.TextIOWrapper(fp, encoding="utf-8", errors="replace")
+
+
+def iter_links(source: str, seen: "SeenSet | BloomFilter | None" = None) -> Iterator[str]:
+    """
+    Lazily yields each link of a bulk source once. Blank lines and lines
+    starting with '#' are skipped.
+
+    Args:
+        source (str): file path, '-' for stdin or a single url
+        seen (SeenSet | BloomFilter | None, optional): filter of links already
+            yielded, a new SeenSet if not provided. Defaults to None.
+
+    Yields:
+        str: links in file order, duplicates removed
+    """
+    seen = SeenSet() if seen is None else seen
+    if is_url(source):
+        if seen.add(source):
+            yield source
+        return
+    fp = open_source(source)
+    try:
+        for line in fp:
+            link = line.strip()
+            if link and not link.startswith("#") and seen.add(link):
+                yield link
+    finally:
+        if source != STDIN:
+            fp.close()
+
+
+def _digest(link: str) -> int:
+    """
+    Returns a 64 bit hash of a link, stable across runs unlike hash()
+    """
+    return int.from_bytes(hashlib.blake2b(link.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class SeenSet():
+    """
+    Exact set of links stored as 64 bit digests instead of strings, less
+    than half the memory of a set of urls. Chance of two different
+    links colliding stays below one in a million up to six million links.
+    """
+
+    def __init__(self) -> None:
+        self.__digests = set()
+
+    def __len__(self) -> int:
+        return len(self.__digests)
+
+    def __contains__(self, link: str) -> bool:
+        return _digest(link) in self.__digests
+
+    def add(self, link: str) -> bool:
+        """
+        Adds a link
+
+        Returns:
+            bool: True if the link was not seen before
+        """
+        digest = _digest(link)
+        if digest in self.__digests:
+            return False
+        self.__digests.add(digest)
+        return True
+
+
+class BloomFilter():
+    """
+    Scalable Bloom filter for link lists too large for SeenSet. Uses a
+    few bits per link; a new link is wrongly reported as seen with
+    probability at most error_rate across all stages. When a stage is
+    full, a stage twice as large with a tighter error rate is added, so
+    the size of the list does not need to be known in advance.
+    """
+
+    def __init__(self, capacity: int = 1 << 20, error_rate: float = 1e-6) -> None:
+        """
+        Args:
+            capacity (int, optional): links the first stage holds. Defaults to 1 << 20.
+            error_rate (float, optional): false positive bound. Defaults to 1e-6.
+        """
+        self.__capacity = capacity
+        # Stage i gets error_rate * 2^-(i+1), the sum stays below error_rate
+        self.__error_rate = error_rate
+        self.__stages = list()
+        self.__count = 0
+        self.__add_stage()
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def __add_stage(self) -> None:
+        """
+        Adds a stage twice the size of the last one
+        """
+        n = self.__capacity << len(self.__stages)
+        p = self.__error_rate / (2 ** (len(self.__stages) + 1))
+        bits = max(int(-n * math.log(p) / (math.log(2) ** 2)), 8)
+        hashes = max(int(round(bits / n * math.log(2))), 1)
+        # [bit array, bit count, hash count, capacity, items]
+        self.__stages.append([bytearray((bits + 7) // 8), bits, hashes, n, 0])
+
+    @staticmethod
+    def __hashes(link: str) -> tuple[int, int]:
+        """
+        Two 64 bit hashes of a link from one digest, every bit index is
+        derived from them through double hashing
+        """
+        digest = hashlib.blake2b(link.encode("utf-8"), digest_size=16).digest()
+        return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+    def __seen(self, h1: int, h2: int) -> bool:
+        """
+        Returns:
+            bool: True if every bit of the hashes is set in any stage
+        """
+        for array, bits, hashes, _, _ in self.__stages:
+            for i in range(hashes):
+                index = (h1 + i * h2) % bits
+                if not array[index >> 3] & (1 << (index & 7)):
+                    break
+            else:
+                return True
+        return False
+
+    def __contains__(self, link: str) -> bool:
+        return self.__seen(*self.__hashes(link))
+
+    def add(self, link: str) -> bool:
+        """
+        Adds a link
+
+        Returns:
+            bool: True if the link was not seen before, subject to the error rate
+        """
+        h1, h2 = self.__hashes(link)
+        if self.__seen(h1, h2):
+            return False
+        stage = self.__stages[-1]
+        if stage[4] >= stage[3]:
+            self.__add_stage()
+            stage = self.__stages[-1]
+        array, bits, hashes = stage[0], stage[1], stage[2]
+        for i in range(hashes):
+            index = (h1 + i * h2) % bits
+            array[index >> 3] |= 1 << (index & 7)
+        stage[4] += 1
+        self.__count += 1
+        return True
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Returns:
+            int: bytes used by the bit arrays
+        """
+        return sum(len(stage[0]) for stage in self.__stages)
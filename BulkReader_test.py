@@ -0,0 +1,101 @@
+import gzip
+import io
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from BulkReader import BloomFilter, SeenSet, iter_links
+
+
+class BulkReaderTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """
+        Creates a scratch folder for bulk files
+        """
+        logging.basicConfig(level=logging.INFO)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.lines = "https://a/1\n\n  https://a/2  \n# comment\nhttps://a/1\nhttps://a/3\n"
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_plain(self):
+        """
+        Blank lines, comments and duplicates are skipped, order is kept
+        """
+        path = os.path.join(self.tmp.name, "links.txt")
+        with open(path, 'w') as fp:
+            fp.write(self.lines)
+        self.assertEqual(["https://a/1", "https://a/2", "https://a/3"], list(iter_links(path)))
+
+    def test_gzip(self):
+        """
+        Gzip files are read whatever their extension
+        """
+        path = os.path.join(self.tmp.name, "links.txt")
+        with gzip.open(path, 'wt') as fp:
+            fp.write(self.lines)
+        self.assertEqual(["https://a/1", "https://a/2", "https://a/3"], list(iter_links(path)))
+
+    def test_stdin(self):
+        """
+        '-' reads stdin
+        """
+        stdin = io.TextIOWrapper(io.BytesIO(self.lines.encode()))
+        with mock.patch.object(sys, 'stdin', stdin):
+            self.assertEqual(["https://a/1", "https://a/2", "https://a/3"], list(iter_links('-')))
+
+    def test_url(self):
+        """
+        A url source is a single link
+        """
+        self.assertEqual(["https://a/x.zip"], list(iter_links("https://a/x.zip")))
+
+    def test_lazy(self):
+        """
+        First link is yielded before the rest of a large file is read
+        """
+        path = os.path.join(self.tmp.name, "links.txt")
+        with open(path, 'w') as fp:
+            for i in range(200000):
+                fp.write("https://a/{i}\n".format(i=i))
+        links = iter_links(path)
+        self.assertEqual("https://a/0", next(links))
+        links.close()
+
+    def test_shared_filter(self):
+        """
+        A filter passed in carries over between sources
+        """
+        seen = SeenSet()
+        self.assertEqual(["https://a/x"], list(iter_links("https://a/x", seen)))
+        path = os.path.join(self.tmp.name, "links.txt")
+        with open(path, 'w') as fp:
+            fp.write(self.lines)
+        self.assertEqual(["https://a/2", "https://a/3"], list(iter_links(path, seen))[1:])
+        self.assertEqual([], list(iter_links("https://a/x", seen)))
+        self.assertEqual(4, len(seen))
+        self.assertEqual(["https://a/1", "https://a/2", "https://a/3"], list(iter_links(path, BloomFilter(capacity=2))))
+
+    def test_bloom(self):
+        """
+        No false negatives, few false positives, grows past its capacity
+        """
+        bloom = BloomFilter(capacity=1000, error_rate=1e-6)
+        for i in range(5000):
+            self.assertTrue(bloom.add("https://a/{i}".format(i=i)))
+        for i in range(5000):
+            self.assertIn("https://a/{i}".format(i=i), bloom)
+            self.assertFalse(bloom.add("https://a/{i}".format(i=i)))
+        false = sum("https://b/{i}".format(i=i) in bloom for i in range(20000))
+        self.assertLessEqual(false, 10)
+        self.assertEqual(5000, len(bloom))
+        # A few bytes per link, far less than the links themselves
+        self.assertLess(bloom.nbytes, 5000 * 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import urllib.parse
+"""
+Index of every file downloaded so far, kept across runs in the sqlite
+database given by Config.DEDUP_DB. Files are found by url, by the
+(host, ETag, Content-Length) the server sent and by the sha256 of their
+content so a file already on disk is hardlinked instead of downloaded
+and stored again.
+
+Rows whose file was since deleted or modified are dropped when looked up,
+a file is only trusted while its size and mtime match the index.
+"""
+
+# Kemono style data urls are named after the sha256 of the file,
+# for example '/data/5c/98/5c98...e3.png'
+URL_SHA256 = re.compile(r"/([0-9a-f]{64})(?:\.[^/]*)?$")
+# Read size when hashing a file already on disk
+HASH_CHUNK_SZ = 1024 * 1024
+
+
+def url_sha256(url: str) -> str | None:
+    """
+    Returns:
+        str | None: sha256 of the content a url names, None if the url
+            does not contain one
+    """
+    match = URL_SHA256.search(urllib.parse.urlsplit(url).path.lower())
+    return match.group(1) if match else None
+
+
+def hash_file(path: str) -> str:
+    """
+    Returns:
+        str: hex sha256 of the content of path
+    """
+    hasher = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for data in iter(lambda: fp.read(HASH_CHUNK_SZ), b""):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def link_file(src: str, dst: str) -> bool:
+    """
+    Replaces dst with a hardlink to src. dst is never left missing or half
+    written, the link is made beside it and renamed over it.
+
+    Args:
+        src (str): existing file
+        dst (str): path to link, replaced if it exists
+
+    Returns:
+        bool: True if linked, False if the filesystem cannot link the two
+            paths, for example across devices
+    """
+    tmp = dst + ".link"
+    try:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.link(src, tmp)
+        os.replace(tmp, dst)
+        return True
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+
+
+class DedupStore():
+    """
+    Thread safe sqlite index of downloaded files. One row per file on
+    disk; a file reachable from several urls keeps the url it was last
+    recorded under.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+            path (str): database file, created if it does not exist
+        """
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        with self.__lock, self.__db:
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__db.execute("PRAGMA synchronous=NORMAL")
+            self.__db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, url TEXT, host TEXT, "
+                              "etag TEXT, size INTEGER, mtime INTEGER, sha256 TEXT, stamp REAL)")
+            self.__db.execute("CREATE INDEX IF NOT EXISTS files_url ON files (url)")
+            self.__db.execute("CREATE INDEX IF NOT EXISTS files_etag ON files (etag, size)")
+            self.__db.execute("CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256, size)")
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return self.__db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def find_url(self, url: str) -> str | None:
+        """
+        Returns:
+            str | None: file last downloaded from url, None if there is none
+        """
+        return self.__find("url = ?", (url,))
+
+    def find_etag(self, host: str, etag: str | None, size: int | None) -> str | None:
+        """
+        Finds a file served by the same host under the same strong ETag and
+        length. ETags are only unique per host so they are never matched
+        across hosts.
+
+        Args:
+            host (str): host, with port, the response came from
+            etag (str | None): ETag response header
+            size (int | None): Content-Length of the response
+
+        Returns:
+            str | None: matching file, None if there is none
+        """
+        if not etag or etag.startswith("W/") or size is None:
+            return None
+        return self.__find("etag = ? AND size = ? AND host = ?", (etag, size, host))
+
+    def find_hash(self, sha256: str | None, size: int | None = None) -> str | None:
+        """
+        Args:
+            sha256 (str | None): hex sha256 of the content
+            size (int | None, optional): size of the content, matched too if
+                given. Defaults to None.
+
+        Returns:
+            str | None: file with that content, None if there is none
+        """
+        if not sha256:
+            return None
+        if size is None:
+            return self.__find("sha256 = ?", (sha256,))
+        return self.__find("sha256 = ? AND size = ?", (sha256, size))
+
+    def add(self, path: str, url: str, etag: str | None = None, sha256: str | None = None) -> str | None:
+        """
+        Records a downloaded file. If another file with the same content is
+        already indexed, path is replaced by a hardlink to it.
+
+        Args:
+            path (str): file now on disk
+            url (str): url it was downloaded from
+            etag (str | None, optional): ETag the server sent. Defaults to None.
+            sha256 (str | None, optional): hex sha256 of the content. Defaults to None.
+
+        Returns:
+            str | None: file path was hardlinked to, None if it was kept as is
+        """
+        size = os.path.getsize(path)
+        linked = None
+        existing = self.find_hash(sha256, size)
+        if existing and not os.path.samefile(existing, path) and link_file(existing, path):
+            linked = existing
+        if etag and etag.startswith("W/"):
+            etag = None
+        self.__put(path, url, etag, sha256)
+        return linked
+
+    def reuse(self, known: str, path: str, url: str) -> bool:
+        """
+        Makes path, the target of url, a hardlink to the indexed file known
+        unless it already is one, and records it
+
+        Args:
+            known (str): indexed file with the content of url
+            path (str): file url is saved to
+            url (str): url path stands for
+
+        Returns:
+            bool: True if path now holds the content, False if it could not be
+                linked and url must be downloaded
+        """
+        if not (os.path.exists(path) and os.path.samefile(known, path)) and not link_file(known, path):
+            return False
+        with self.__lock:
+            row = self.__db.execute("SELECT etag, sha256 FROM files WHERE path = ?", (known,)).fetchone()
+        etag, sha256 = row if row else (None, None)
+        self.__put(path, url, etag, sha256)
+        return True
+
+    def close(self) -> None:
+        """
+        Closes the database
+        """
+        with self.__lock:
+            self.__db.close()
+
+    def __put(self, path: str, url: str, etag: str | None, sha256: str | None) -> None:
+        """
+        Inserts or replaces the row of path with its current size and mtime
+        """
+        stat = os.stat(path)
+        host = urllib.parse.urlsplit(url).netloc
+        with self.__lock, self.__db:
+            self.__db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              (path, url, host, etag, stat.st_size, stat.st_mtime_ns, sha256, time.time()))
+
+    def __find(self, where: str, args: tuple) -> str | None:
+        """
+        Returns the most recently recorded file matching where that is still
+        unchanged on disk, rows of missing or modified files are dropped
+        """
+        with self.__lock:
+            rows = self.__db.execute("SELECT path, size, mtime FROM files WHERE " + where +
+                                     " ORDER BY stamp DESC", args).fetchall()
+        for path, size, mtime in rows:
+            try:
+                stat = os.stat(path)
+                if stat.st_size == size and stat.st_mtime_ns == mtime:
+                    return path
+            except OSError:
+                pass
+            with self.__lock, self.__db:
+                self.__db.execute("DELETE FROM files WHERE path = ?", (path,))
+        return None
@@ -0,0 +1,138 @@
+import hashlib
+import logging
+import os
+import tempfile
+import unittest
+from DedupStore import DedupStore, hash_file, link_file, url_sha256
+
+
+class DedupStoreTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """
+        Creates a scratch folder holding the index
+        """
+        logging.basicConfig(level=logging.INFO)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = DedupStore(os.path.join(self.tmp.name, "index.db"))
+
+    def tearDown(self) -> None:
+        self.store.close()
+        self.tmp.cleanup()
+
+    def write(self, fname: str, data: bytes) -> str:
+        path = os.path.join(self.tmp.name, fname)
+        with open(path, 'wb') as fp:
+            fp.write(data)
+        return path
+
+    def test_find(self):
+        """
+        Files are found by url, by host ETag and length, and by hash
+        """
+        path = self.write("a.bin", b"abc")
+        digest = hashlib.sha256(b"abc").hexdigest()
+        self.assertIsNone(self.store.add(path, "http://h:1/a.bin", '"e1"', digest))
+
+        self.assertEqual(path, self.store.find_url("http://h:1/a.bin"))
+        self.assertEqual(path, self.store.find_etag("h:1", '"e1"', 3))
+        self.assertEqual(path, self.store.find_hash(digest))
+        self.assertEqual(path, self.store.find_hash(digest, 3))
+        self.assertIsNone(self.store.find_url("http://h:1/b.bin"))
+        # ETags are per host and must match the length
+        self.assertIsNone(self.store.find_etag("other:1", '"e1"', 3))
+        self.assertIsNone(self.store.find_etag("h:1", '"e1"', 4))
+        self.assertIsNone(self.store.find_hash(digest, 4))
+        self.assertIsNone(self.store.find_hash(None))
+
+    def test_weak_etag(self):
+        """
+        Weak ETags do not identify content and are not indexed
+        """
+        path = self.write("a.bin", b"abc")
+        self.store.add(path, "http://h/a.bin", 'W/"e1"')
+
+        self.assertIsNone(self.store.find_etag("h", 'W/"e1"', 3))
+        self.assertEqual(path, self.store.find_url("http://h/a.bin"))
+
+    def test_persists(self):
+        """
+        Index survives reopening
+        """
+        path = self.write("a.bin", b"abc")
+        self.store.add(path, "http://h/a.bin")
+        self.store.close()
+        self.store = DedupStore(os.path.join(self.tmp.name, "index.db"))
+
+        self.assertEqual(path, self.store.find_url("http://h/a.bin"))
+        self.assertEqual(1, len(self.store))
+
+    def test_stale(self):
+        """
+        Deleted or modified files are dropped from the index
+        """
+        deleted = self.write("a.bin", b"abc")
+        modified = self.write("b.bin", b"abc")
+        self.store.add(deleted, "http://h/a.bin")
+        self.store.add(modified, "http://h/b.bin")
+        os.remove(deleted)
+        self.write("b.bin", b"abcd")
+
+        self.assertIsNone(self.store.find_url("http://h/a.bin"))
+        self.assertIsNone(self.store.find_url("http://h/b.bin"))
+        self.assertEqual(0, len(self.store))
+
+    def test_add_links_identical(self):
+        """
+        Adding a file with the content of an indexed file hardlinks it
+        """
+        first = self.write("a.bin", b"same")
+        second = self.write("b.bin", b"same")
+        digest = hash_file(first)
+        self.store.add(first, "http://h/a.bin", sha256=digest)
+
+        self.assertEqual(first, self.store.add(second, "http://h/b.bin", sha256=digest))
+        self.assertTrue(os.path.samefile(first, second))
+        self.assertEqual(second, self.store.find_url("http://h/b.bin"))
+        # Adding again is a no-op
+        self.assertIsNone(self.store.add(second, "http://h/b.bin", sha256=digest))
+
+    def test_reuse(self):
+        """
+        Reusing a known file links it to the new path and indexes the new url
+        """
+        known = self.write("a.bin", b"abc")
+        self.store.add(known, "http://h/a.bin", '"e1"', hash_file(known))
+        path = os.path.join(self.tmp.name, "copy.bin")
+
+        self.assertTrue(self.store.reuse(known, path, "http://h/copy.bin"))
+        self.assertTrue(os.path.samefile(known, path))
+        self.assertEqual(path, self.store.find_url("http://h/copy.bin"))
+        self.assertIn(self.store.find_hash(hash_file(known)), (known, path))
+
+    def test_link_file(self):
+        """
+        Existing destination is replaced, unlinkable paths report failure
+        """
+        src = self.write("a.bin", b"new")
+        dst = self.write("b.bin", b"old")
+
+        self.assertTrue(link_file(src, dst))
+        self.assertTrue(os.path.samefile(src, dst))
+        self.assertFalse(link_file(os.path.join(self.tmp.name, "missing"), dst))
+        self.assertEqual(["a.bin", "b.bin", "index.db"], sorted(f for f in os.listdir(self.tmp.name)
+                                                           if not f.startswith("index.db-")))
+
+    def test_url_sha256(self):
+        """
+        Content hash is read from Kemono style data urls
+        """
+        digest = hashlib.sha256(b"x").hexdigest()
+        self.assertEqual(digest, url_sha256("https://c.kemono.su/data/2d/71/" + digest + ".png?f=a.png"))
+        self.assertEqual(digest, url_sha256("https://c.kemono.su/data/2d/71/" + digest))
+        self.assertIsNone(url_sha256("https://c.kemono.su/data/2d/71/" + digest[:-1] + ".png"))
+        self.assertIsNone(url_sha256("https://site.com/file.png"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,336 @@
+import collections
+import ctypes
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Callable
+from Metrics import Metrics
+"""
+Writes downloads to disk. Every file is written into its partial file
+through a single descriptor opened once, preallocated to its
+Content-Length and written by offset, so the segments of a file share
+the descriptor and write from reused buffers without seeking or copying.
+
+Finished files are moved into place with an atomic rename. With
+Config.SYNC_WRITES the data is flushed to disk first, by one syncer
+thread in batches: download threads never wait on a flush, a batch on
+Linux is flushed with a single syncfs() per filesystem instead of an
+fsync() per file, and the folder of a batch is flushed once.
+
+Usage:
+    writer = DiskWriter(sync=True)
+    part = writer.open("a.bin.part", size)
+    part.write(0, data)
+    writer.commit(part, "a.bin", lambda error: ...)
+    writer.close()
+"""
+
+# Files committed before a batch is flushed without waiting for more
+SYNC_BATCH = 256
+# Seconds a committed file waits for its batch to fill
+SYNC_INTERVAL = 0.2
+
+
+def preallocate(fd: int, size: int) -> None:
+    """
+    Sizes an open file to size bytes, reserving the blocks up front where
+    the platform supports it so parallel writes do not fragment the file.
+
+    Args:
+        fd (int): descriptor of a file opened for writing
+        size (int): final size of the file in bytes
+    """
+    if size > 0 and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            # Filesystem does not support fallocate, truncate still sizes the file
+            pass
+    os.ftruncate(fd, size)
+
+
+def _load_syncfs() -> Callable[[int], int] | None:
+    """
+    Returns:
+        Callable[[int], int] | None: libc syncfs(fd), flushes the filesystem
+            holding fd. None where it does not exist.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        return ctypes.CDLL(None, use_errno=True).syncfs
+    except (OSError, AttributeError):
+        return None
+
+
+class PartFile():
+    """
+    Open partial file, written by offset from any number of threads. Where
+    os.pwrite is missing, on Windows, a write seeks and writes under a lock
+    of the file instead.
+    """
+
+    def __init__(self, path: str, size: int | None = None, truncate: bool = True) -> None:
+        """
+        Args:
+            path (str): partial file, created if it does not exist
+            size (int | None, optional): final size to preallocate, None if
+                unknown. Defaults to None.
+            truncate (bool, optional): discard the current content, False to
+                resume the file. Defaults to True.
+        """
+        self.path = path
+        # Serializes seek and write pairs where os.pwrite is missing
+        self.__lock = threading.Lock()
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        if truncate:
+            flags |= os.O_TRUNC
+        self.fd = os.open(path, flags, 0o666)
+        try:
+            if size is not None and truncate:
+                preallocate(self.fd, size)
+        except BaseException:
+            os.close(self.fd)
+            raise
+
+    def write(self, offset: int, data) -> int:
+        """
+        Writes data at offset, retrying short writes
+
+        Args:
+            offset (int): position in the file
+            data (bytes | memoryview): bytes to write
+
+        Returns:
+            int: bytes written, always len(data)
+        """
+        view = memoryview(data)
+        written = 0
+        pwrite = getattr(os, "pwrite", None)
+        if pwrite is not None:
+            while written < len(view):
+                written += pwrite(self.fd, view[written:], offset + written)
+            return written
+        with self.__lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            while written < len(view):
+                written += os.write(self.fd, view[written:])
+        return written
+
+    def close(self) -> None:
+        """
+        Closes the descriptor, does nothing if already closed
+        """
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+# done(error) is called once a commit finished, error is None on success
+Done = Callable[[str | None], None]
+
+
+class DiskWriter():
+    """
+    Opens partial files and moves finished ones into place. Thread safe.
+    """
+
+    def __init__(self, sync: bool = False, batch_sz: int = SYNC_BATCH, interval: float = SYNC_INTERVAL,
+                 metrics: Metrics | None = None, max_bytes: int | None = None) -> None:
+        """
+        Args:
+            sync (bool, optional): flush files to disk before renaming them.
+                Defaults to False.
+            batch_sz (int, optional): files flushed per batch. Defaults to SYNC_BATCH.
+            interval (float, optional): seconds a batch waits to fill. Defaults to SYNC_INTERVAL.
+            metrics (Metrics | None, optional): records the time batches take to
+                flush. Defaults to None for a private Metrics.
+            max_bytes (int | None, optional): bytes of committed files waiting
+                for their flush before commit blocks, None for no limit.
+                Defaults to None.
+        """
+        self.sync = sync
+        self.batch_sz = batch_sz
+        self.interval = interval
+        self.max_bytes = max_bytes
+        # Files committed and batches flushed
+        self.committed = 0
+        self.batches = 0
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.__queue = collections.deque()
+        # Bytes of the files queued or being flushed
+        self.__queued_bytes = 0
+        self.__cond = threading.Condition()
+        self.__thread = None
+        self.__stopping = False
+        self.__syncfs = _load_syncfs()
+        self.metrics.gauge("queue_depth", self.__len__, stage="disk")
+
+    def __len__(self) -> int:
+        """
+        Returns:
+            int: committed files waiting to be flushed
+        """
+        with self.__cond:
+            return len(self.__queue)
+
+    def open(self, path: str, size: int | None = None, truncate: bool = True) -> PartFile:
+        """
+        Returns:
+            PartFile: partial file at path, see PartFile
+        """
+        return PartFile(path, size, truncate)
+
+    def commit(self, part: PartFile, path: str, done: Done) -> None:
+        """
+        Closes a finished partial file and renames it to path, after flushing
+        it to disk when syncing. Without sync done is called before
+        returning, otherwise from the syncer thread once the batch is on disk.
+        Blocks while max_bytes are waiting to be flushed.
+
+        Args:
+            part (PartFile): finished partial file, must not be written again
+            path (str): final path, replaced if it exists
+            done (Done): called with None once path holds the file, or with
+                the error that left it as a partial file
+        """
+        if not self.sync:
+            part.close()
+            error = self.__rename(part, path)
+            with self.__cond:
+                self.committed += 1
+            done(error)
+            return
+        size = os.fstat(part.fd).st_size
+        with self.__cond:
+            if self.max_bytes is not None:
+                # A file larger than the limit waits for an empty queue
+                self.__cond.wait_for(lambda: not self.__queued_bytes or
+                                     self.__queued_bytes + size <= self.max_bytes)
+            self.__queued_bytes += size
+            if self.__thread is None:
+                self.__stopping = False
+                self.__thread = threading.Thread(target=self.__run, name="pandora-sync", daemon=True)
+                self.__thread.start()
+            self.__queue.append((part, path, done, size))
+            # First file starts the interval of a batch, a full batch ends it
+            if len(self.__queue) == 1 or len(self.__queue) >= self.batch_sz:
+                self.__cond.notify_all()
+
+    def close(self) -> None:
+        """
+        Flushes the files still queued and stops the syncer thread, a later
+        commit starts it again
+        """
+        with self.__cond:
+            thread = self.__thread
+            self.__thread = None
+            self.__stopping = True
+            self.__cond.notify_all()
+        if thread:
+            thread.join()
+
+    def __run(self) -> None:
+        """
+        Syncer loop, flushes a batch once it is full, once the oldest file
+        waited interval seconds or when stopping
+        """
+        while True:
+            with self.__cond:
+                self.__cond.wait_for(lambda: self.__queue or self.__stopping)
+                if not self.__queue:
+                    return
+                deadline = time.monotonic() + self.interval
+                while len(self.__queue) < self.batch_sz and not self.__stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.__cond.wait(remaining)
+                batch = [self.__queue.popleft() for _ in range(min(len(self.__queue), self.batch_sz))]
+            self.__flush(batch)
+
+    def __flush(self, batch: list[tuple[PartFile, str, Done, int]]) -> None:
+        """
+        Flushes and renames a batch of files, then flushes each folder the
+        batch renamed into once
+        """
+        start = time.perf_counter()
+        errors = list()
+        folders = set()
+        synced = self.__sync_devices([part for part, _, _, _ in batch]) if len(batch) > 1 else set()
+        for part, path, _, _ in batch:
+            error = None
+            try:
+                if os.fstat(part.fd).st_dev not in synced:
+                    os.fsync(part.fd)
+            except OSError as e:
+                error = repr(e)
+            part.close()
+            error = error or self.__rename(part, path)
+            errors.append(error)
+            if error is None:
+                folders.add(os.path.dirname(os.path.abspath(path)))
+        for folder in folders:
+            _sync_folder(folder)
+        elapsed = time.perf_counter() - start
+        self.metrics.observe("fsync_seconds", elapsed)
+        self.metrics.inc("stage_seconds_total", elapsed, stage="fsync")
+        with self.__cond:
+            self.committed += len(batch)
+            self.batches += 1
+            self.__queued_bytes -= sum(size for _, _, _, size in batch)
+            self.__cond.notify_all()
+        for (part, _, done, _), error in zip(batch, errors):
+            try:
+                done(error)
+            except Exception:
+                # Keep flushing the batches of other files
+                logging.exception("Failed to finish {path}".format(path=part.path))
+
+    def __sync_devices(self, parts: list[PartFile]) -> set[int]:
+        """
+        Flushes the filesystems holding parts with one syncfs() each
+
+        Returns:
+            set[int]: devices flushed, parts on other devices still need an fsync()
+        """
+        if self.__syncfs is None:
+            return set()
+        devices = dict()
+        for part in parts:
+            try:
+                devices.setdefault(os.fstat(part.fd).st_dev, part.fd)
+            except OSError:
+                pass
+        return {device for device, fd in devices.items() if self.__syncfs(fd) == 0}
+
+    @staticmethod
+    def __rename(part: PartFile, path: str) -> str | None:
+        """
+        Returns:
+            str | None: why part could not be renamed to path, None if it was
+        """
+        try:
+            os.replace(part.path, path)
+            return None
+        except OSError as e:
+            return repr(e)
+
+
+def _sync_folder(folder: str) -> None:
+    """
+    Flushes the entries of a folder so renames into it survive a crash,
+    not supported on every platform
+    """
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError as e:
+        logging.debug("Could not sync {folder}: {error}".format(folder=folder, error=repr(e)))
+    finally:
+        os.close(fd)
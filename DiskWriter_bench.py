@@ -0,0 +1,74 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+from DiskWriter import DiskWriter, preallocate
+"""
+Compares writing many small downloads the way the engine used to, opening
+each partial file twice, with a DiskWriter, with and without flushing to
+disk. Run on tmpfs to see the system call overhead alone and on a real
+disk to see the cost of flushing.
+
+Run directly: python DiskWriter_bench.py [file count] [file size] [folder...]
+Folders default to /dev/shm, when present, and the system temp folder.
+"""
+
+
+def reopen(folder: str, names: list[str], data: bytes, sync: bool) -> None:
+    """
+    Creates and preallocates each partial file, reopens it to write and
+    renames it, flushing every file and the folder when syncing
+    """
+    for name in names:
+        part = os.path.join(folder, name + ".part")
+        with open(part, "wb") as fp:
+            preallocate(fp.fileno(), len(data))
+        with open(part, "r+b") as fp:
+            fp.write(data)
+            if sync:
+                fp.flush()
+                os.fsync(fp.fileno())
+        os.replace(part, os.path.join(folder, name))
+        if sync:
+            fd = os.open(folder, os.O_RDONLY)
+            os.fsync(fd)
+            os.close(fd)
+
+
+def writer(folder: str, names: list[str], data: bytes, sync: bool) -> None:
+    """
+    Writes each file through a DiskWriter, flushes are batched when syncing
+    """
+    disk = DiskWriter(sync)
+    for name in names:
+        part = disk.open(os.path.join(folder, name + ".part"), len(data))
+        part.write(0, data)
+        disk.commit(part, os.path.join(folder, name), lambda error: None)
+    disk.close()
+
+
+def bench(name: str, write, folder: str, count: int, size: int, sync: bool) -> None:
+    scratch = tempfile.mkdtemp(dir=folder)
+    try:
+        names = ["f{i}.bin".format(i=i) for i in range(count)]
+        data = os.urandom(size)
+        start = time.perf_counter()
+        write(scratch, names, data, sync)
+        elapsed = time.perf_counter() - start
+        print("{name:<18} {fps:10.0f} files/s {mbps:8.1f} MB/s".format(
+            name=name, fps=count / elapsed, mbps=count * size / elapsed / 1e6))
+    finally:
+        shutil.rmtree(scratch)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 16 * 1024
+    folders = sys.argv[3:] or [f for f in ("/dev/shm", tempfile.gettempdir()) if os.path.isdir(f)]
+    for folder in folders:
+        print("{folder}: {count} files of {size} bytes".format(folder=folder, count=count, size=size))
+        bench("reopen", reopen, folder, count, size, False)
+        bench("writer", writer, folder, count, size, False)
+        bench("reopen + fsync", reopen, folder, count, size, True)
+        bench("writer + fsync", writer, folder, count, size, True)
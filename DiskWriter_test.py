@@ -0,0 +1,160 @@
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from DiskWriter import DiskWriter, PartFile
+
+
+class DiskWriterTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """
+        Creates a scratch folder
+        """
+        logging.basicConfig(level=logging.INFO)
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def path(self, fname: str) -> str:
+        return os.path.join(self.tmp.name, fname)
+
+    def read(self, fname: str) -> bytes:
+        with open(self.path(fname), 'rb') as fp:
+            return fp.read()
+
+    def test_part(self):
+        """
+        Parts are preallocated and written by offset from several threads
+        """
+        part = PartFile(self.path("a.part"), 4000)
+        self.assertEqual(4000, os.path.getsize(self.path("a.part")))
+        threads = [threading.Thread(target=part.write, args=(i * 1000, bytes([i]) * 1000)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        part.close()
+        part.close()
+
+        self.assertEqual(b"".join(bytes([i]) * 1000 for i in range(4)), self.read("a.part"))
+
+    def test_part_without_pwrite(self):
+        """
+        Parts are written by seeking under a lock where os.pwrite is missing
+        """
+        with mock.patch.dict(vars(os)):
+            del os.pwrite
+            part = PartFile(self.path("a.part"), 4000)
+            threads = [threading.Thread(target=part.write, args=(i * 1000, bytes([i]) * 1000)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            part.write(3998, memoryview(b"xyz")[1:])
+            part.close()
+        self.assertTrue(hasattr(os, "pwrite"))
+
+        self.assertEqual(b"".join(bytes([i]) * 1000 for i in range(4))[:3998] + b"yz", self.read("a.part"))
+
+    def test_resume(self):
+        """
+        Parts opened without truncation keep their content
+        """
+        part = PartFile(self.path("a.part"), 6)
+        part.write(0, b"abc")
+        part.close()
+        part = PartFile(self.path("a.part"), truncate=False)
+        part.write(3, memoryview(b"xdef")[1:])
+        part.close()
+
+        self.assertEqual(b"abcdef", self.read("a.part"))
+
+    def test_commit(self):
+        """
+        Without sync parts are renamed before commit returns
+        """
+        writer = DiskWriter()
+        part = writer.open(self.path("a.part"), 1)
+        part.write(0, b"a")
+        errors = list()
+        writer.commit(part, self.path("a"), errors.append)
+
+        self.assertEqual([None], errors)
+        self.assertEqual(b"a", self.read("a"))
+        self.assertFalse(os.path.exists(self.path("a.part")))
+
+    def test_sync_batches(self):
+        """
+        Synced commits are flushed in batches off the calling thread
+        """
+        writer = DiskWriter(sync=True, batch_sz=4, interval=5)
+        done = list()
+        for i in range(10):
+            part = writer.open(self.path("{i}.part".format(i=i)))
+            part.write(0, str(i).encode())
+            writer.commit(part, self.path(str(i)), done.append)
+        # The last two files wait for their batch to fill until close
+        writer.close()
+
+        self.assertEqual([None] * 10, done)
+        self.assertEqual(10, writer.committed)
+        self.assertEqual(3, writer.batches)
+        for i in range(10):
+            self.assertEqual(str(i).encode(), self.read(str(i)))
+
+        # Writer restarts after close
+        part = writer.open(self.path("x.part"))
+        writer.commit(part, self.path("x"), done.append)
+        writer.close()
+        self.assertTrue(os.path.exists(self.path("x")))
+
+    def test_sync_interval(self):
+        """
+        A file committed alone is flushed once the interval passes
+        """
+        writer = DiskWriter(sync=True, interval=0.01)
+        for name in ("a", "b"):
+            event = threading.Event()
+            writer.commit(writer.open(self.path(name + ".part")), self.path(name), lambda error: event.set())
+            self.assertTrue(event.wait(5))
+        writer.close()
+
+        self.assertEqual(2, writer.batches)
+
+    def test_max_bytes(self):
+        """
+        Commits block while max_bytes wait to be flushed
+        """
+        writer = DiskWriter(sync=True, batch_sz=100, interval=0.2, max_bytes=150)
+        done = list()
+        for name in ("a", "b"):
+            part = writer.open(self.path(name + ".part"), 100)
+            part.write(0, b"x" * 100)
+            writer.commit(part, self.path(name), done.append)
+            # b waited for a to be flushed on its own
+            self.assertEqual(1 if name == "b" else 0, writer.batches)
+        writer.close()
+
+        self.assertEqual([None, None], done)
+        self.assertEqual(2, writer.batches)
+
+    def test_sync_error(self):
+        """
+        Files that cannot be moved into place report why
+        """
+        writer = DiskWriter(sync=True, interval=0)
+        errors = list()
+        writer.commit(writer.open(self.path("a.part")), self.path("missing/a"), errors.append)
+        writer.close()
+
+        self.assertEqual(1, len(errors))
+        self.assertIn("FileNotFoundError", errors[0])
+        self.assertTrue(os.path.exists(self.path("a.part")))
+
+
+if __name__ == '__main__':
+    unittest.main()
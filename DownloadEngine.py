@@ -0,0 +1,1263 @@
+import hashlib
+import http.client
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass
+from typing import Callable, Iterable
+from BulkReader import iter_links
+from DedupStore import DedupStore, hash_file, url_sha256
+from DiskWriter import DiskWriter, PartFile
+from Integrity import Verifier, new_hasher
+from Journal import DEFAULT_CHECKPOINT_SZ, Journal, PART_SUFFIX, get_validator
+from MemoryBudget import MemoryBudget
+from Metrics import Metrics, Reporter
+from RateLimiter import HostSlots, TokenBucket
+from RetryScheduler import (DEFAULT_HTTPS_CODES, DEFAULT_HTTPS_RETRIES, CircuitBreaker, RetryPolicy,
+                            RetryScheduler, parse_retry_after)
+from Services import Config, get_setting
+from UnzipStage import UnzipStage
+from WorkLedger import WorkLedger
+"""
+Pooled multi-threaded download engine. A bounded pool of worker
+threads pulls download tasks from a queue, shares keep-alive HTTP
+connections per host and streams each response to disk in
+Config.DOWNLOAD_CHUNK_SZ pieces.
+
+Usage:
+    settings = PandoraArgInterpretor.interpret(sys.argv)
+    results = create_engine(settings).run()
+"""
+
+# Defaults for configs not provided by the user, see Config descriptions
+DEFAULT_THREAD_COUNT = 6
+DEFAULT_CHUNK_SZ = 64 * 1024 * 1024
+# Seconds before a socket operation is abandoned
+DEFAULT_TIMEOUT = 30
+USER_AGENT = "PandoraDownloader"
+# Downloads of a corrupt file when Config.HTTPS_RETRIES leaves retries unlimited
+MAX_REFETCHES = 3
+
+
+@dataclass
+class DownloadTask:
+    """
+    A single file to download
+
+    url: url to download from
+    path: absolute path the file is written to
+    attempts: retries made so far
+    """
+    url: str
+    path: str
+    attempts: int = 0
+
+
+@dataclass
+class DownloadResult:
+    """
+    Outcome of a DownloadTask
+
+    url: url downloaded from
+    path: absolute path the file was written to
+    size: bytes written to disk
+    status: last HTTP status received, 0 if no response was received
+    error: description of the failure, None if download succeeded
+    etag: strong ETag the server sent, None if it sent none
+    sha256: hex sha256 of the file, None if it was not hashed
+    linked_from: indexed file path was hardlinked to instead of being
+        stored again, None if path holds its own copy
+    digest: '<hash type>:<hex>' of the file with Config.VERIFY_HASH, None
+        if it was not hashed
+    """
+    url: str
+    path: str
+    size: int = 0
+    status: int = 0
+    error: str | None = None
+    etag: str | None = None
+    sha256: str | None = None
+    linked_from: str | None = None
+    digest: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def outcome(self) -> str:
+        """
+        Returns:
+            str: 'failed', 'linked' to an indexed file or 'ok'
+        """
+        if self.error:
+            return "failed"
+        return "linked" if self.linked_from else "ok"
+
+
+@dataclass
+class EngineOptions:
+    """
+    Download configs shared by every engine, read from the settings
+    returned by PandoraArgInterpretor.interpret with defaults applied
+
+    folder: Config.DOWNLOAD_FOLDER
+    thread_count: Config.THREAD_COUNT, workers or concurrent transfers
+    chunk_sz: Config.DOWNLOAD_CHUNK_SZ
+    retry_codes: Config.HTTPS_CODES
+    max_retries: Config.HTTPS_RETRIES, None for unlimited
+    host_conns: Config.HOST_CONNS, None for no per host limit
+    rate_limit: Config.RATE_LIMIT, None for no limit
+    dedup_db: Config.DEDUP_DB, None to not index downloads
+    unzip: Config.UNZIP
+    sync_writes: Config.SYNC_WRITES
+    verify: Config.VERIFY_HASH, None to not verify downloads
+    checkpoint_sz: Config.JOURNAL_CHECKPOINT
+    """
+    folder: str
+    thread_count: int = DEFAULT_THREAD_COUNT
+    chunk_sz: int = DEFAULT_CHUNK_SZ
+    retry_codes: frozenset = frozenset(DEFAULT_HTTPS_CODES)
+    max_retries: int | None = DEFAULT_HTTPS_RETRIES
+    host_conns: int | None = None
+    rate_limit: int | None = None
+    dedup_db: str | None = None
+    unzip: bool = False
+    sync_writes: bool = False
+    verify: str | None = None
+    checkpoint_sz: int = DEFAULT_CHECKPOINT_SZ
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> "EngineOptions":
+        """
+        Args:
+            settings (dict): dict returned by PandoraArgInterpretor.interpret
+
+        Raises:
+            ValueError: Config.DOWNLOAD_FOLDER was not set, a numeric config is
+                not positive or the Config.VERIFY_HASH hash is unavailable
+
+        Returns:
+            EngineOptions: options of settings
+        """
+        folder = get_setting(settings, Config.DOWNLOAD_FOLDER)
+        if not folder:
+            raise ValueError("{switch} is required".format(switch=Config.DOWNLOAD_FOLDER.value[0][0]))
+        options = cls(folder,
+                      get_setting(settings, Config.THREAD_COUNT, DEFAULT_THREAD_COUNT),
+                      get_setting(settings, Config.DOWNLOAD_CHUNK_SZ, DEFAULT_CHUNK_SZ),
+                      frozenset(get_setting(settings, Config.HTTPS_CODES, DEFAULT_HTTPS_CODES)),
+                      get_setting(settings, Config.HTTPS_RETRIES, DEFAULT_HTTPS_RETRIES),
+                      get_setting(settings, Config.HOST_CONNS),
+                      get_setting(settings, Config.RATE_LIMIT),
+                      get_setting(settings, Config.DEDUP_DB),
+                      get_setting(settings, Config.UNZIP, False),
+                      get_setting(settings, Config.SYNC_WRITES, False),
+                      get_setting(settings, Config.VERIFY_HASH),
+                      get_setting(settings, Config.JOURNAL_CHECKPOINT, DEFAULT_CHECKPOINT_SZ))
+        if options.thread_count < 1 or options.chunk_sz < 1 or options.checkpoint_sz < 1:
+            raise ValueError("thread count, chunk size and checkpoint size must be positive")
+        if (options.host_conns is not None and options.host_conns < 1) or \
+                (options.rate_limit is not None and options.rate_limit < 1):
+            raise ValueError("host connections and rate limit must be positive")
+        if options.max_retries is not None and options.max_retries < 0:
+            options.max_retries = None
+        if options.verify is not None:
+            new_hasher(options.verify)
+        return options
+
+
+class ConnectionPool():
+    """
+    Thread safe pool of keep-alive HTTP connections shared between
+    workers. Idle connections are kept per (scheme, host) and handed
+    back out most recently used first.
+    """
+
+    def __init__(self, max_idle_per_host: int = DEFAULT_THREAD_COUNT, timeout: float = DEFAULT_TIMEOUT) -> None:
+        """
+        Args:
+            max_idle_per_host (int, optional): idle connections kept per host,
+                extras are closed. Defaults to DEFAULT_THREAD_COUNT.
+            timeout (float, optional): socket timeout in seconds. Defaults to DEFAULT_TIMEOUT.
+        """
+        self.__idle = dict()
+        self.__lock = threading.Lock()
+        self.__max_idle = max_idle_per_host
+        self.__timeout = timeout
+
+    def acquire(self, scheme: str, netloc: str) -> tuple[http.client.HTTPConnection, bool]:
+        """
+        Returns an idle connection to host or a new one if none are idle
+
+        Args:
+            scheme (str): 'http' or 'https'
+            netloc (str): host with optional port
+
+        Returns:
+            tuple[http.client.HTTPConnection, bool]: connection and True if
+                the connection was reused
+        """
+        with self.__lock:
+            idle = self.__idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.__timeout), False
+        return http.client.HTTPConnection(netloc, timeout=self.__timeout), False
+
+    def release(self, scheme: str, netloc: str, conn: http.client.HTTPConnection) -> None:
+        """
+        Returns a connection to the pool, response on the connection
+        must be fully read before releasing.
+
+        Args:
+            scheme (str): scheme conn was acquired with
+            netloc (str): netloc conn was acquired with
+            conn (http.client.HTTPConnection): connection to return
+        """
+        with self.__lock:
+            idle = self.__idle.setdefault((scheme, netloc), list())
+            if len(idle) < self.__max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method: str, url: str, headers: dict | None = None) -> tuple[http.client.HTTPResponse, tuple]:
+        """
+        Sends a request on a pooled connection. A reused connection the
+        server has since closed is replaced transparently.
+
+        Args:
+            method (str): HTTP method
+            url (str): absolute url
+            headers (dict | None, optional): extra request headers. Defaults to None.
+
+        Raises:
+            ValueError: url is not http or https
+            OSError, http.client.HTTPException: request failed
+
+        Returns:
+            tuple[http.client.HTTPResponse, tuple]: response and a key to hand
+                back to finish() once the response has been consumed
+        """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError("{url} is not an http(s) url".format(url=url))
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        send_headers = {"User-Agent": USER_AGENT, "Connection": "keep-alive"}
+        if headers:
+            send_headers.update(headers)
+
+        while True:
+            conn, reused = self.acquire(parts.scheme, parts.netloc)
+            try:
+                conn.request(method, target, headers=send_headers)
+                response = conn.getresponse()
+                return response, (parts.scheme, parts.netloc, conn)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                # Stale keep-alive connection, try again with another
+                if not reused:
+                    raise
+            except BaseException:
+                conn.close()
+                raise
+
+    def finish(self, response: http.client.HTTPResponse, key: tuple) -> None:
+        """
+        Returns the connection a response was received on to the pool if
+        the connection can be reused, closes it otherwise.
+
+        Args:
+            response (http.client.HTTPResponse): response returned by request()
+            key (tuple): key returned by request()
+        """
+        scheme, netloc, conn = key
+        if response.isclosed() and not response.will_close:
+            self.release(scheme, netloc, conn)
+        else:
+            conn.close()
+
+    def close(self) -> None:
+        """
+        Closes all idle connections
+        """
+        with self.__lock:
+            for conns in self.__idle.values():
+                for conn in conns:
+                    conn.close()
+            self.__idle.clear()
+
+
+def get_file_name(url: str) -> str:
+    """
+    Determines the file name to save a url to. Kemono style '?f=name'
+    query parameters take priority over the last path segment.
+
+    Args:
+        url (str): url to name
+
+    Returns:
+        str: file name without any directories
+    """
+    parts = urllib.parse.urlsplit(url)
+    name = urllib.parse.parse_qs(parts.query).get("f", [""])[0]
+    if not name:
+        name = urllib.parse.unquote(parts.path.rsplit("/", 1)[-1])
+    # Never let a remote name escape the download folder
+    name = os.path.basename(name.replace("\\", "/"))
+    if name in ("", ".", ".."):
+        name = "index.html"
+    return name
+
+
+class FileNames():
+    """
+    Names of the files of one run. Urls downloaded without a name are named
+    after the url, a name an earlier file of the run already took gets a
+    ' (n)' suffix the way KemonoLayout names collisions, so two urls ending
+    in 'image.jpg' never share a partial file. Thread safe.
+    """
+
+    def __init__(self) -> None:
+        # Names taken, as the filesystem compares them
+        self.__taken = set()
+        self.__lock = threading.Lock()
+
+    def name(self, url: str, fname: str | None = None) -> str:
+        """
+        Args:
+            url (str): url to download
+            fname (str | None, optional): name chosen by the caller, kept as
+                is. Defaults to None to name the file after url.
+
+        Returns:
+            str: file name, unique in the run if it was derived from url
+        """
+        with self.__lock:
+            if fname:
+                self.__taken.add(os.path.normcase(fname))
+                return fname
+            name = get_file_name(url)
+            stem, ext = os.path.splitext(name)
+            n = 1
+            while os.path.normcase(name) in self.__taken:
+                n += 1
+                name = "{stem} ({n}){ext}".format(stem=stem, n=n, ext=ext)
+            self.__taken.add(os.path.normcase(name))
+            return name
+
+    def clear(self) -> None:
+        """
+        Forgets the names taken, done when a run ends
+        """
+        with self.__lock:
+            self.__taken.clear()
+
+
+class _SegmentedFile():
+    """
+    Shared state of a file being downloaded into its partial file as one or
+    more byte range segments. Every segment writes through the one open
+    part. The worker finishing the last segment commits the partial file
+    to the DiskWriter, which moves it into place, and the DownloadResult
+    is handed to record once it is.
+
+    etag is the strong ETag of the file. observers are objects with an
+    update(bytes) method, such as hasher, fed the body as it streams; only
+    a fresh file read in a single stream is observed since segments arrive
+    out of order.
+
+    verifier checks the finished file, see Integrity.py. A file that is
+    short or fails verification is removed and handed to refetch, which
+    returns its failed result once out of attempts.
+    """
+
+    def __init__(self, task: DownloadTask, size: int | None, journal: Journal | None, segments: int,
+                 part: PartFile, writer: DiskWriter, record: Callable[[DownloadResult], None]) -> None:
+        """
+        Args:
+            task (DownloadTask): task being downloaded
+            size (int | None): size of the file, None if the server did not say
+            journal (Journal | None): journal of the partial file, None if the
+                file cannot be resumed
+            segments (int): number of segments outstanding
+            part (PartFile): open partial file
+            writer (DiskWriter): writer to commit the finished file to
+            record (Callable[[DownloadResult], None]): called with the result
+                of a committed file
+        """
+        self.task = task
+        self.part = part
+        self.writer = writer
+        self.record = record
+        self.size = size
+        self.journal = journal
+        self.remaining = segments
+        self.written = 0
+        self.error = None
+        self.status = 200
+        self.etag = None
+        self.hasher = None
+        self.observers = list()
+        self.verifier = None
+        self.refetch = None
+        self.__lock = threading.Lock()
+
+    def done(self, written: int, status: int, error: str | None) -> DownloadResult | None:
+        """
+        Records a finished segment, once every segment is done the partial
+        file is committed or, if it failed and cannot be resumed, removed.
+
+        Args:
+            written (int): bytes the segment wrote
+            status (int): HTTP status the segment received
+            error (str | None): why the segment failed, None if it succeeded
+
+        Returns:
+            DownloadResult | None: result of the file if it failed, None if
+                segments are outstanding or it was committed, record then
+                receives the result
+        """
+        with self.__lock:
+            self.written += written
+            if error and not self.error:
+                self.error = error
+                self.status = status
+            self.remaining -= 1
+            if self.remaining:
+                return None
+
+        corrupt = None
+        if not self.error and self.journal and self.journal.first_missing() != self.size:
+            self.error = "Expected {size} bytes, missing bytes from {offset}".format(
+                size=self.size, offset=self.journal.first_missing())
+        elif not self.error and not self.journal and self.size is not None and self.written != self.size:
+            corrupt = "Expected {size} bytes, received {written}".format(size=self.size, written=self.written)
+        elif not self.error and self.verifier is not None:
+            corrupt = self.verifier.verify(self.part.path, self.written)
+        if corrupt:
+            self.part.close()
+            _remove(self.part.path)
+            if self.journal:
+                self.journal.remove()
+            if self.refetch is not None:
+                return self.refetch(self.task, corrupt)
+            self.error = corrupt
+            return self.__result()
+
+        if not self.error:
+            self.writer.commit(self.part, self.task.path, self.__committed)
+            return None
+        self.part.close()
+        if not self.journal:
+            # Nothing to resume from, do not leave garbage behind
+            _remove(self.part.path)
+        return self.__result()
+
+    def __committed(self, error: str | None) -> None:
+        """
+        Records the result of the file once the writer moved it into place
+        """
+        if error:
+            self.error = error
+        elif self.journal:
+            self.journal.remove()
+        self.record(self.__result())
+
+    def __result(self) -> DownloadResult:
+        sha256 = self.hasher.hexdigest() if self.hasher and not self.error else None
+        digest = None
+        if self.verifier is not None and self.verifier.fed == self.written and not self.error:
+            digest = self.verifier.digest()
+            if sha256 is None and self.verifier.hash_type == "sha256":
+                # Read back to verify, spares indexing another read
+                sha256 = self.verifier.hasher.hexdigest()
+        return DownloadResult(self.task.url, self.task.path, self.written, self.status, self.error,
+                              self.etag, sha256, digest=digest)
+
+
+@dataclass
+class _Segment:
+    """
+    Byte range [start, end) of a _SegmentedFile, index is the segment's
+    index in the file's journal and attempts the retries made so far
+    """
+    file: _SegmentedFile
+    index: int
+    start: int
+    end: int | None
+    attempts: int = 0
+
+    @property
+    def url(self) -> str:
+        return self.file.task.url
+
+
+def _range_start(response: http.client.HTTPResponse) -> int | None:
+    """
+    Returns the first byte of a 206 response's Content-Range, None if the
+    header is missing or malformed
+    """
+    content_range = response.getheader("Content-Range") or ""
+    unit, _, spec = content_range.partition(" ")
+    if unit != "bytes":
+        return None
+    try:
+        return int(spec.split("-", 1)[0])
+    except ValueError:
+        return None
+
+
+def _host(url: str) -> str:
+    """
+    Returns the host, with port, a url points to
+    """
+    return urllib.parse.urlsplit(url).netloc
+
+
+def _remove(path: str) -> None:
+    """
+    Removes a file if it exists
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def create_engine(settings: dict, retry_policy: RetryPolicy | None = None, metrics: Metrics | None = None):
+    """
+    Builds the download engine selected by Config.ASYNC_DOWNLOAD, the
+    asyncio engine is only imported when selected
+
+    Args:
+        settings (dict): dict returned by PandoraArgInterpretor.interpret
+        retry_policy (RetryPolicy | None, optional): backoff used for retries. Defaults to None.
+        metrics (Metrics | None, optional): metrics to record into. Defaults to None.
+
+    Returns:
+        DownloadEngine | AsyncDownloadEngine: engine with download() and run()
+    """
+    if get_setting(settings, Config.ASYNC_DOWNLOAD, False):
+        from AsyncDownloadEngine import AsyncDownloadEngine
+        return AsyncDownloadEngine(settings, retry_policy, metrics)
+    return DownloadEngine(settings, retry_policy, metrics)
+
+
+class DownloadEngine():
+    """
+    Bounded pool of download workers built from the settings returned by
+    PandoraArgInterpretor.interpret. Uses Config.THREAD_COUNT workers,
+    Config.DOWNLOAD_CHUNK_SZ byte chunks and writes into
+    Config.DOWNLOAD_FOLDER.
+
+    Files larger than a chunk on servers advertising 'Accept-Ranges: bytes'
+    are split into up to Config.THREAD_COUNT byte range segments that are
+    fetched in parallel and written at their offset in a preallocated file.
+
+    Files are written to '<name>.part' and journaled chunk by chunk, see
+    Journal.py, so a later run resumes an interrupted file. A DiskWriter
+    preallocates partial files and renames finished ones into place,
+    flushing them to disk in batches with Config.SYNC_WRITES, see
+    DiskWriter.py.
+
+    Responses with a Config.HTTPS_CODES status are retried up to
+    Config.HTTPS_RETRIES times through a RetryScheduler, the host that sent
+    them is paused while other hosts keep downloading.
+
+    Config.HOST_CONNS caps the jobs running against a single host so a slow
+    host cannot hold every worker, Config.RATE_LIMIT caps the bytes/sec of
+    all workers together.
+
+    With Config.DEDUP_DB, urls already downloaded and urls naming the
+    sha256 of an indexed file are not fetched, responses whose host,
+    ETag and length match an indexed file are abandoned after the headers
+    and finished files with the content of an indexed file are
+    hardlinked to it, see DedupStore.py.
+
+    With Config.UNZIP, finished archives are extracted by an UnzipStage
+    while downloads continue and zips streamed in one piece are extracted
+    as they arrive, see UnzipStage.py. join() waits for the extractions.
+
+    With Config.VERIFY_HASH, files are hashed as they stream and files
+    that come out short or do not match the sha256 their url names are
+    downloaded again through the RetryScheduler, see Integrity.py.
+
+    Config.MEMORY_BUDGET caps the read buffers, the bytes waiting for
+    Config.SYNC_WRITES and the extraction processes, see MemoryBudget.py.
+
+    Every stage records into metrics, reported while workers run with
+    Config.METRICS_FILE or Config.VERBOSE, see Metrics.py.
+    """
+    # Queue priorities, segments of files in progress are taken before new files
+    __SEGMENT = 0
+    __RETRY = 1
+    __TASK = 2
+    __STOP = 3
+
+    def __init__(self, settings: dict, retry_policy: RetryPolicy | None = None,
+                 metrics: Metrics | None = None) -> None:
+        """
+        Args:
+            settings (dict): dict returned by PandoraArgInterpretor.interpret
+            retry_policy (RetryPolicy | None, optional): backoff used for retries.
+                Defaults to None for RetryPolicy().
+            metrics (Metrics | None, optional): metrics to record into.
+                Defaults to None for a new Metrics.
+
+        Raises:
+            ValueError: Config.DOWNLOAD_FOLDER was not set, a numeric config is
+                not positive or the Config.VERIFY_HASH hash is unavailable
+        """
+        self.settings = settings
+        options = EngineOptions.from_settings(settings)
+        self.folder = options.folder
+        self.thread_count = options.thread_count
+        self.chunk_sz = options.chunk_sz
+        self.retry_codes = options.retry_codes
+        self.max_retries = options.max_retries
+        self.host_conns = options.host_conns
+        self.host_slots = HostSlots(self.host_conns)
+        self.bucket = TokenBucket(options.rate_limit) if options.rate_limit else None
+        self.store = DedupStore(options.dedup_db) if options.dedup_db else None
+        self.verify = options.verify
+        self.checkpoint_sz = options.checkpoint_sz
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.reporter = Reporter.from_settings(settings, self.metrics)
+        # Called with every DownloadResult once it is recorded
+        self.listeners = list()
+        self.budget = MemoryBudget.from_settings(settings)
+        self.read_sz = self.budget.read_sz(self.chunk_sz, self.thread_count)
+        self.unzip = UnzipStage(self.budget.workers("unzip"), self.metrics,
+                                self.budget.pending("unzip")) if options.unzip else None
+        self.writer = DiskWriter(options.sync_writes, metrics=self.metrics, max_bytes=self.budget.share("write"))
+
+        self.pool = ConnectionPool(min(self.thread_count, self.host_conns or self.thread_count))
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = CircuitBreaker(self.retry_policy)
+        self.scheduler = RetryScheduler(self.__requeue)
+        # Workers enqueue segments themselves so the queue cannot be bounded,
+        # slots bound how far producers may run ahead of the workers instead
+        self.__queue = queue.PriorityQueue()
+        self.__slots = threading.Semaphore(self.thread_count * 2)
+        self.__seq = itertools.count()
+        # Files submitted without a result yet, including deferred ones
+        self.__pending = 0
+        self.__pending_cond = threading.Condition()
+        self.__results = list()
+        self.__results_lock = threading.Lock()
+        self.__names = FileNames()
+        self.__workers = list()
+        self.__local = threading.local()
+        self.metrics.gauge("queue_depth", self.__queue.qsize, stage="download")
+        self.metrics.gauge("queue_depth", self.scheduler.__len__, stage="retry")
+
+    def start(self) -> None:
+        """
+        Starts the worker threads, does nothing if already started
+        """
+        if self.__workers:
+            return
+        if self.reporter is not None:
+            self.reporter.start()
+        for i in range(self.thread_count):
+            worker = threading.Thread(target=self.__work, name="pandora-{i}".format(i=i), daemon=True)
+            worker.start()
+            self.__workers.append(worker)
+
+    def submit(self, url: str, fname: str | None = None) -> DownloadTask:
+        """
+        Queues a url for download, blocks while the queue is full
+
+        Args:
+            url (str): url to download
+            fname (str | None, optional): file name to save as, derived from url
+                and made unique in the run if not provided. Defaults to None.
+
+        Returns:
+            DownloadTask: task queued
+        """
+        self.start()
+        task = DownloadTask(url, os.path.join(self.folder, self.__names.name(url, fname)))
+        self.__slots.acquire()
+        with self.__pending_cond:
+            self.__pending += 1
+        self.__put(self.__TASK, task)
+        return task
+
+    def join(self) -> list[DownloadResult]:
+        """
+        Waits for every queued task to finish and stops the workers
+
+        Returns:
+            list[DownloadResult]: result of every task queued, in completion order
+        """
+        # Wait for segments and deferred retries as well as tasks before
+        # telling workers to stop
+        with self.__pending_cond:
+            self.__pending_cond.wait_for(lambda: self.__pending == 0)
+        self.scheduler.stop()
+        self.writer.close()
+        for _ in self.__workers:
+            self.__put(self.__STOP, None)
+        for worker in self.__workers:
+            worker.join()
+        self.__workers.clear()
+        self.pool.close()
+        if self.unzip is not None:
+            self.unzip.join()
+        if self.reporter is not None:
+            self.reporter.stop()
+        with self.__results_lock:
+            results = self.__results
+            self.__results = list()
+        self.__names.clear()
+        return results
+
+    def download(self, urls: Iterable[str]) -> list[DownloadResult]:
+        """
+        Downloads every url and waits for completion
+
+        Args:
+            urls (Iterable[str]): urls to download
+
+        Returns:
+            list[DownloadResult]: result of every url
+        """
+        self.start()
+        for url in urls:
+            self.submit(url)
+        return self.join()
+
+    def run(self) -> list[DownloadResult]:
+        """
+        Downloads every link of the Config.DOWNLOAD_URL bulk file, streamed
+        so the first download starts before the file is fully read. With
+        Config.WORK_LEDGER only the links this process claims are downloaded.
+
+        Returns:
+            list[DownloadResult]: result of every link
+        """
+        source = get_setting(self.settings, Config.DOWNLOAD_URL)
+        if not source:
+            return list()
+        ledger = WorkLedger.from_settings(self.settings)
+        if ledger is None:
+            return self.download(iter_links(source))
+        listener = lambda result: ledger.complete(result.url, result.ok)
+        with ledger:
+            ledger.load_source(source)
+            self.listeners.append(listener)
+            try:
+                return self.download(ledger.claims(self.thread_count * 2))
+            finally:
+                self.listeners.remove(listener)
+
+    def __put(self, priority: int, job: DownloadTask | _Segment | None) -> None:
+        """
+        Queues a job, jobs of equal priority are run first in first out
+        """
+        self.__queue.put((priority, next(self.__seq), job))
+
+    def __requeue(self, job: DownloadTask | _Segment) -> None:
+        """
+        Puts a job the scheduler held back onto the queue again
+        """
+        self.__put(self.__SEGMENT if isinstance(job, _Segment) else self.__RETRY, job)
+
+    def __work(self) -> None:
+        """
+        Worker loop, runs jobs until a None sentinel is received. Jobs of
+        a paused host are handed to the scheduler and jobs of a host
+        without a free slot are parked instead of being run.
+        """
+        while True:
+            priority, _, job = self.__queue.get()
+            try:
+                if job is None:
+                    return
+                if priority == self.__TASK:
+                    self.__slots.release()
+                host = _host(job.url)
+                wait = self.breaker.allow(host)
+                if wait > 0:
+                    self.scheduler.defer(job, wait + self.retry_policy.jitter())
+                    continue
+                if not self.host_slots.acquire(host, job):
+                    # Parked until another job of the host releases its slot
+                    continue
+                try:
+                    result = self.__run_job(job)
+                finally:
+                    parked = self.host_slots.release(host)
+                    if parked:
+                        self.__requeue(parked)
+                if result:
+                    self.__record(result)
+            finally:
+                self.__queue.task_done()
+
+    def __run_job(self, job: DownloadTask | _Segment) -> DownloadResult | None:
+        """
+        Runs a task or segment, converting unexpected errors into a failed result
+
+        Returns:
+            DownloadResult | None: result if a file finished, None if other
+                segments of the file are still outstanding or the job was deferred
+        """
+        try:
+            if isinstance(job, _Segment):
+                return self.fetch_segment(job)
+            return self.fetch(job)
+        except Exception as e:
+            self.breaker.release(_host(job.url))
+            return self.__fail(job, 0, repr(e))
+
+    def __fail(self, job: DownloadTask | _Segment, status: int, error: str) -> DownloadResult | None:
+        """
+        Fails a task, or the segment of a file
+
+        Returns:
+            DownloadResult | None: result of the file, None if other segments
+                of the file are still outstanding
+        """
+        if isinstance(job, _Segment):
+            return job.file.done(0, status, error)
+        return DownloadResult(job.url, job.path, status=status, error=error)
+
+    def __retry(self, job: DownloadTask | _Segment, response: http.client.HTTPResponse) -> DownloadResult | None:
+        """
+        Handles a response with a Config.HTTPS_CODES status. Pauses the host
+        and defers the job, or fails it once out of retries.
+
+        Args:
+            job (DownloadTask | _Segment): job the response belongs to
+            response (http.client.HTTPResponse): retryable response, body unread
+
+        Returns:
+            DownloadResult | None: failed result if out of retries, otherwise None
+        """
+        response.read()
+        host = _host(job.url)
+        retry_after = parse_retry_after(response.getheader("Retry-After"))
+        pause = self.breaker.failure(host, retry_after)
+        if self.max_retries is not None and job.attempts >= self.max_retries:
+            return self.__fail(job, response.status, "HTTP {status} after {n} retries".format(
+                status=response.status, n=job.attempts))
+        job.attempts += 1
+        self.metrics.inc("retries_total", code=response.status)
+        logging.info("HTTP {status} from {host}, retry {n} of {url} in {pause:.1f}s".format(
+            status=response.status, host=host, n=job.attempts, url=job.url, pause=pause))
+        self.scheduler.defer(job, pause + self.retry_policy.jitter())
+        return None
+
+    def __record(self, result: DownloadResult) -> None:
+        """
+        Logs and stores the result of a finished file
+        """
+        if result.error:
+            logging.warning("Failed to download {url}: {error}".format(url=result.url, error=result.error))
+        else:
+            logging.debug("Downloaded {url} -> {path}".format(url=result.url, path=result.path))
+            if self.store is not None and result.linked_from is None:
+                self.__index(result)
+        self.metrics.inc("files_total", outcome=result.outcome)
+        for listener in self.listeners:
+            listener(result)
+        if self.unzip is not None:
+            self.__extract(result)
+        with self.__results_lock:
+            self.__results.append(result)
+        with self.__pending_cond:
+            self.__pending -= 1
+            self.__pending_cond.notify_all()
+
+    def __index(self, result: DownloadResult) -> None:
+        """
+        Adds a downloaded file to the dedup store. Files that could not be
+        hashed while streaming are hashed from disk, while still cached.
+        """
+        try:
+            if result.sha256 is None:
+                result.sha256 = hash_file(result.path)
+            result.linked_from = self.store.add(result.path, result.url, result.etag, result.sha256)
+        except (OSError, ValueError) as e:
+            logging.warning("Could not index {path}: {error}".format(path=result.path, error=repr(e)))
+            return
+        if result.linked_from:
+            logging.info("{path} is identical to {known}, hardlinked".format(path=result.path, known=result.linked_from))
+
+    def __extract(self, result: DownloadResult) -> None:
+        """
+        Hands a finished file to the unzip stage. A file skipped because it
+        was already at its path was extracted by the run that downloaded it.
+        """
+        if not result.ok:
+            self.unzip.discard(result.path)
+        elif result.linked_from != result.path:
+            self.unzip.submit(result.path)
+
+    def __reuse(self, task: DownloadTask, known: str | None, status: int = 0) -> DownloadResult | None:
+        """
+        Satisfies a task with an indexed file instead of downloading it,
+        hardlinking the file to the task's path unless it is already there
+
+        Args:
+            task (DownloadTask): task to satisfy
+            known (str | None): indexed file with the task's content
+            status (int, optional): status of the response that identified
+                the file, 0 if no request was made. Defaults to 0.
+
+        Returns:
+            DownloadResult | None: result of the task, None if known is None
+                or cannot be linked so the task must be downloaded
+        """
+        if known is None or not self.store.reuse(known, task.path, task.url):
+            return None
+        logging.info("{url} already downloaded as {known}, skipped".format(url=task.url, known=known))
+        return DownloadResult(task.url, task.path, os.path.getsize(task.path), status, linked_from=known)
+
+    def fetch(self, task: DownloadTask) -> DownloadResult | None:
+        """
+        Downloads a task on the calling thread. A journaled partial file is
+        resumed when the server confirms through If-Range that the file has
+        not changed. Large files on servers supporting ranges are split, the
+        first segment is read from this response and the rest are queued
+        for other workers.
+
+        Args:
+            task (DownloadTask): task to download
+
+        Returns:
+            DownloadResult | None: outcome of the download, None if segments
+                of the file are still outstanding
+        """
+        if self.store is not None:
+            result = self.__reuse(task, self.store.find_url(task.url) or self.store.find_hash(url_sha256(task.url)))
+            if result:
+                # Nothing was requested, a probe of a paused host passes to the next job
+                self.breaker.release(_host(task.url))
+                return result
+        journal = Journal.load(task.path + PART_SUFFIX, task.url, self.checkpoint_sz)
+        headers = None
+        if journal:
+            first = journal.first_missing()
+            headers = {"Range": "bytes={first}-".format(first=first), "If-Range": journal.validator}
+        response, key = self.__request(task.url, headers)
+        try:
+            if response.status in self.retry_codes:
+                return self.__retry(task, response)
+            self.breaker.success(_host(task.url))
+            if journal and response.status == 206 and _range_start(response) == first:
+                return self.__resume(task, journal, response)
+            if journal and response.status in (200, 416):
+                # File changed on the server, partial file is useless
+                logging.info("{url} changed since it was journaled, restarting".format(url=task.url))
+                journal.remove()
+            if journal and response.status == 416:
+                # Range lies past the end of the changed file, ask for all of it
+                response.read()
+                self.pool.finish(response, key)
+                response, key = self.__request(task.url, None)
+                if response.status in self.retry_codes:
+                    return self.__retry(task, response)
+            if response.status != 200:
+                response.read()
+                return DownloadResult(task.url, task.path, status=response.status,
+                                      error="HTTP {status}".format(status=response.status))
+            if self.store is not None:
+                # Body is left unread, finish() closes the connection
+                known = self.store.find_etag(_host(task.url), response.getheader("ETag"), response.length)
+                result = self.__reuse(task, known, response.status)
+                if result:
+                    return result
+            return self.__begin(task, response)
+        finally:
+            self.pool.finish(response, key)
+
+    def fetch_segment(self, segment: _Segment) -> DownloadResult | None:
+        """
+        Downloads a single byte range segment into its place in the partial file
+
+        Args:
+            segment (_Segment): segment to download
+
+        Returns:
+            DownloadResult | None: result if this was the last outstanding
+                segment of the file, None otherwise
+        """
+        file = segment.file
+        headers = {"Range": "bytes={start}-{end}".format(start=segment.start, end=segment.end - 1)}
+        if file.journal:
+            headers["If-Range"] = file.journal.validator
+        response, key = self.__request(file.task.url, headers)
+        try:
+            if response.status in self.retry_codes:
+                return self.__retry(segment, response)
+            self.breaker.success(_host(file.task.url))
+            if response.status != 206 or _range_start(response) != segment.start:
+                return file.done(0, response.status, "Range {range} not honored, HTTP {status}".format(
+                    range=headers["Range"], status=response.status))
+            written = self.__write(segment, response)
+            return file.done(written, response.status, None)
+        finally:
+            self.pool.finish(response, key)
+
+    def __request(self, url: str, headers: dict | None) -> tuple[http.client.HTTPResponse, tuple]:
+        """
+        GETs url on a pooled connection, recording the time to first byte
+
+        Returns:
+            tuple[http.client.HTTPResponse, tuple]: see ConnectionPool.request
+        """
+        start = time.perf_counter()
+        response, key = self.pool.request("GET", url, headers)
+        self.metrics.observe("ttfb_seconds", time.perf_counter() - start, host=_host(url))
+        return response, key
+
+    def __segment_count(self, response: http.client.HTTPResponse) -> int:
+        """
+        Number of segments to split a response into, ranges are only used
+        when the server advertises them and the file spans several chunks
+
+        Args:
+            response (http.client.HTTPResponse): 200 response of the file
+
+        Returns:
+            int: segments to use, 1 to download in a single stream
+        """
+        length = response.length
+        limit = min(self.thread_count, self.host_conns or self.thread_count)
+        if limit < 2 or length is None or length <= self.chunk_sz:
+            return 1
+        if "bytes" not in (response.getheader("Accept-Ranges") or "").lower():
+            return 1
+        return min(limit, -(-length // self.chunk_sz))
+
+    def __begin(self, task: DownloadTask, response: http.client.HTTPResponse) -> DownloadResult | None:
+        """
+        Starts a fresh download of a 200 response. Preallocates the partial
+        file, journals it if the server sent a validator, queues every
+        segment but the first and streams the first from the response.
+
+        Args:
+            task (DownloadTask): task being downloaded
+            response (http.client.HTTPResponse): 200 response of the whole file
+
+        Returns:
+            DownloadResult | None: result if every segment is already done
+        """
+        length = response.length
+        count = self.__segment_count(response)
+        if length is None:
+            bounds = [(0, None)]
+        else:
+            segment_sz = max(-(-length // count), 1)
+            bounds = [(start, min(start + segment_sz, length)) for start in range(0, length, segment_sz)] or [(0, 0)]
+
+        validator = get_validator(response.getheader("ETag"), response.getheader("Last-Modified"))
+        part = task.path + PART_SUFFIX
+        journal = None
+        # A file read in a single chunk has nothing to resume from, every
+        # journal write would be wasted
+        if validator and length and (len(bounds) > 1 or length > self.chunk_sz):
+            journal = Journal(part, task.url, length, validator, bounds, self.checkpoint_sz)
+        file = _SegmentedFile(task, length, journal, len(bounds), self.writer.open(part, length),
+                              self.writer, self.__record)
+        etag = response.getheader("ETag")
+        file.etag = etag if etag and not etag.startswith("W/") else None
+        self.__verify(file)
+        if len(bounds) == 1:
+            if file.verifier is not None:
+                file.observers.append(file.verifier)
+            if self.store is not None:
+                if file.verifier is not None and file.verifier.hash_type == "sha256":
+                    # One sha256 serves both
+                    file.hasher = file.verifier.hasher
+                else:
+                    file.hasher = hashlib.sha256()
+                    file.observers.append(file.hasher)
+            extractor = self.unzip.stream(task.path) if self.unzip is not None else None
+            if extractor:
+                file.observers.append(extractor)
+        if journal:
+            journal.save()
+        for i, (start, end) in enumerate(bounds[1:], 1):
+            self.__put(self.__SEGMENT, _Segment(file, i, start, end))
+        if len(bounds) > 1:
+            logging.debug("Split {url} into {n} segments".format(url=task.url, n=len(bounds)))
+        return self.__first(_Segment(file, 0, *bounds[0]), response)
+
+    def __resume(self, task: DownloadTask, journal: Journal, response: http.client.HTTPResponse) -> DownloadResult | None:
+        """
+        Continues a journaled partial file. The 206 response starts at the
+        first missing byte and fills that segment, other incomplete
+        segments are queued.
+
+        Args:
+            task (DownloadTask): task being downloaded
+            journal (Journal): journal of the partial file
+            response (http.client.HTTPResponse): 206 response starting at
+                journal.first_missing()
+
+        Returns:
+            DownloadResult | None: result if every segment is already done
+        """
+        missing = journal.missing()
+        logging.info("Resuming {url} from byte {offset}".format(url=task.url, offset=missing[0][1]))
+        file = _SegmentedFile(task, journal.size, journal, len(missing),
+                              self.writer.open(journal.part, truncate=False), self.writer, self.__record)
+        self.__verify(file)
+        for index, start, end in missing[1:]:
+            self.__put(self.__SEGMENT, _Segment(file, index, start, end))
+        return self.__first(_Segment(file, *missing[0]), response)
+
+    def __verify(self, file: _SegmentedFile) -> None:
+        """
+        Sets up the checks of a file with Config.VERIFY_HASH, files failing
+        them are downloaded again
+        """
+        if self.verify is None:
+            return
+        file.verifier = Verifier.for_url(file.task.url, self.verify)
+        file.refetch = self.__refetch
+
+    def __refetch(self, task: DownloadTask, error: str) -> DownloadResult | None:
+        """
+        Defers a task whose file came out corrupt to download it again, up
+        to Config.HTTPS_RETRIES times or MAX_REFETCHES if retries are unlimited
+
+        Args:
+            task (DownloadTask): task whose partial file was removed
+            error (str): how the file was corrupt
+
+        Returns:
+            DownloadResult | None: failed result if out of attempts, otherwise None
+        """
+        limit = self.max_retries if self.max_retries is not None else MAX_REFETCHES
+        if task.attempts >= limit:
+            return DownloadResult(task.url, task.path, status=200, error="{error}, after {n} retries".format(
+                error=error, n=task.attempts))
+        task.attempts += 1
+        self.metrics.inc("retries_total", code="corrupt")
+        logging.warning("{url} is corrupt, downloading it again: {error}".format(url=task.url, error=error))
+        self.scheduler.defer(task, self.retry_policy.delay(task.attempts))
+        return None
+
+    def __first(self, segment: _Segment, response: http.client.HTTPResponse) -> DownloadResult | None:
+        """
+        Streams the first segment of a file from the response that started
+        the file. Rest of the body, if any, is left unread and the
+        connection is closed by finish().
+        """
+        try:
+            written = self.__write(segment, response)
+        except Exception as e:
+            return segment.file.done(0, response.status, repr(e))
+        return segment.file.done(written, response.status, None)
+
+    def __write(self, segment: _Segment, response: http.client.HTTPResponse) -> int:
+        """
+        Writes a segment of a response body into its partial file,
+        checkpointing the journal as it goes and once the segment ends
+
+        Args:
+            segment (_Segment): segment the response body holds
+            response (http.client.HTTPResponse): response positioned at the segment
+
+        Returns:
+            int: bytes written
+        """
+        journal = segment.file.journal
+        observers = segment.file.observers
+        limit = None if segment.end is None else segment.end - segment.start
+        part = segment.file.part
+        host = _host(segment.url)
+        if journal is None:
+            return self.__stream(response, part, segment.start, limit, observers=observers, host=host)
+        try:
+            return self.__stream(response, part, segment.start, limit, lambda n: journal.advance(segment.index, n),
+                                 observers, host)
+        finally:
+            journal.save()
+
+    def __stream(self, response: http.client.HTTPResponse, part: PartFile, offset: int, limit: int | None = None,
+                 checkpoint: Callable[[int], None] | None = None, observers: list | None = None,
+                 host: str = "") -> int:
+        """
+        Streams a response body into part in chunks of at most read_sz bytes
+        using a buffer reused across downloads on the same thread.
+
+        Args:
+            response (http.client.HTTPResponse): response positioned at its body
+            part (PartFile): partial file to write to
+            offset (int): position in part the body starts at
+            limit (int | None, optional): stop after this many bytes. Defaults to None.
+            checkpoint (Callable[[int], None] | None, optional): called with the
+                size of each chunk once it is written to the file. Defaults to None.
+            observers (list | None, optional): objects whose update() is called
+                with every chunk. Defaults to None.
+            host (str, optional): host the response came from, labels the
+                bytes recorded. Defaults to "".
+
+        Returns:
+            int: bytes written
+        """
+        length = response.length if limit is None else limit
+        read_sz = self.read_sz
+        if self.bucket:
+            # Smaller reads keep shaped traffic smooth instead of bursty
+            read_sz = min(read_sz, max(int(self.bucket.rate) // 10, 16 * 1024))
+        view = self.__buffer(read_sz if length is None else min(read_sz, max(length, 1)))
+        written = 0
+        metrics = self.metrics
+        while limit is None or written < limit:
+            want = view if limit is None else view[:min(len(view), limit - written)]
+            start = time.perf_counter()
+            n = response.readinto(want)
+            read = time.perf_counter()
+            metrics.inc("stage_seconds_total", read - start, stage="network")
+            if not n:
+                break
+            part.write(offset + written, want[:n])
+            wrote = time.perf_counter()
+            metrics.inc("stage_seconds_total", wrote - read, stage="disk")
+            if observers:
+                for observer in observers:
+                    observer.update(want[:n])
+                metrics.inc("stage_seconds_total", time.perf_counter() - wrote, stage="hash")
+            metrics.inc("bytes_total", n, host=host)
+            written += n
+            if self.bucket:
+                start = time.perf_counter()
+                self.bucket.consume(n)
+                metrics.inc("stage_seconds_total", time.perf_counter() - start, stage="throttle")
+            if checkpoint:
+                checkpoint(n)
+        return written
+
+    def __buffer(self, size: int) -> memoryview:
+        """
+        Returns a view of size bytes into this thread's chunk buffer, the
+        buffer only grows up to read_sz so small files stay cheap.
+
+        Args:
+            size (int): bytes required
+
+        Returns:
+            memoryview: writable view of exactly size bytes
+        """
+        buffer = getattr(self.__local, "buffer", None)
+        if buffer is None or len(buffer) < size:
+            buffer = bytearray(size)
+            self.__local.buffer = buffer
+        return memoryview(buffer)[:size]
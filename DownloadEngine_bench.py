@@ -0,0 +1,66 @@
+import sys
+import tempfile
+import time
+import PandoraArgInterpretor
+from DownloadEngine import DownloadEngine
+from MockServer import MockServer
+"""
+Benchmarks of the pooled download engine against a local MockServer.
+
+Run directly:
+    python DownloadEngine_bench.py pool [file count] [file size]
+    python DownloadEngine_bench.py segmented [file size] [bytes/sec per connection]
+"""
+
+
+def bench(count: int, size: int, threads: int) -> float:
+    """
+    Downloads count files of size bytes with the given thread count
+
+    Returns:
+        float: files per second
+    """
+    with MockServer() as server, tempfile.TemporaryDirectory() as folder:
+        urls = [server.add_generated("/f{i}".format(i=i), size, seed=i) for i in range(count)]
+        settings = PandoraArgInterpretor.interpret(['.py', '-d', folder, '-t', str(threads)])
+        start = time.perf_counter()
+        results = DownloadEngine(settings).download(urls)
+        elapsed = time.perf_counter() - start
+        assert all(r.ok for r in results)
+        print("threads={t:<3} files={c} size={s}B  {fps:8.1f} files/s  {mbs:8.1f} MB/s  connections={n}".format(
+            t=threads, c=count, s=size, fps=count / elapsed, mbs=count * size / elapsed / 1e6, n=server.connections))
+        return count / elapsed
+
+
+def bench_segmented(size: int, rate: int, threads: int, chunk_sz: int) -> float:
+    """
+    Downloads a single file of size bytes from a server capping each
+    connection at rate bytes/sec
+
+    Returns:
+        float: seconds taken
+    """
+    with MockServer(throttle=rate) as server, tempfile.TemporaryDirectory() as folder:
+        url = server.add_generated("/archive.bin", size)
+        settings = PandoraArgInterpretor.interpret(['.py', '-d', folder, '-t', str(threads), '-c', str(chunk_sz)])
+        start = time.perf_counter()
+        results = DownloadEngine(settings).download([url])
+        elapsed = time.perf_counter() - start
+        assert results[0].ok
+        print("threads={t:<3} size={s}B cap={r}B/s  {sec:6.2f}s  {mbs:8.2f} MB/s  requests={n}".format(
+            t=threads, s=size, r=rate, sec=elapsed, mbs=size / elapsed / 1e6, n=server.requests))
+        return elapsed
+
+
+if __name__ == '__main__':
+    mode = sys.argv[1] if len(sys.argv) > 1 else "pool"
+    if mode == "segmented":
+        size = int(sys.argv[2]) if len(sys.argv) > 2 else 16 * 1024 * 1024
+        rate = int(sys.argv[3]) if len(sys.argv) > 3 else 4 * 1024 * 1024
+        for threads in (1, 2, 4, 8):
+            bench_segmented(size, rate, threads, 1024 * 1024)
+    else:
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+        size = int(sys.argv[3]) if len(sys.argv) > 3 else 16 * 1024
+        for threads in (1, 2, 6, 12):
+            bench(count, size, threads)
@@ -0,0 +1,570 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from unittest import mock
+import PandoraArgInterpretor
+from DownloadEngine import DownloadEngine, get_file_name
+from Journal import Journal
+from MockServer import MockServer, pattern
+from RetryScheduler import RetryPolicy
+from UnzipStage_test import make_zip
+
+
+class DownloadEngineTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """
+        Starts a local server and creates a scratch download folder
+        """
+        logging.basicConfig(level=logging.INFO)
+        self.server = MockServer()
+        self.server.start()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        self.tmp.cleanup()
+
+    def settings(self, *args: str) -> dict:
+        """
+        Interprets args the same way the command line would, download
+        folder is always the scratch folder
+        """
+        return PandoraArgInterpretor.interpret(['.py', '-d', self.tmp.name] + list(args))
+
+    def read(self, fname: str) -> bytes:
+        with open(os.path.join(self.tmp.name, fname), 'rb') as fp:
+            return fp.read()
+
+    def test_many_files(self):
+        """
+        Downloads many small files over a handful of shared connections
+        """
+        urls = [self.server.add_generated("/f{i}.bin".format(i=i), 1000 + i, seed=i) for i in range(60)]
+        results = DownloadEngine(self.settings('-t', '4')).download(urls)
+
+        self.assertEqual(60, len(results))
+        self.assertTrue(all(r.ok for r in results))
+        for i in range(60):
+            self.assertEqual(pattern(1000 + i, i), self.read("f{i}.bin".format(i=i)))
+        # Keep-alive: never more connections than workers
+        self.assertLessEqual(self.server.connections, 4)
+
+    def test_sync_writes(self):
+        """
+        Synced files and segments land in place, small files leave no journal behind
+        """
+        urls = [self.server.add_generated("/f{i}.bin".format(i=i), 1000 + i, seed=i) for i in range(20)]
+        urls.append(self.server.add_generated("/huge.bin", 300001, seed=3))
+        engine = DownloadEngine(self.settings('-t', '4', '-c', '65536', '--fsync'))
+        results = engine.download(urls)
+
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(21, engine.writer.committed)
+        self.assertEqual(pattern(300001, 3), self.read("huge.bin"))
+        for i in range(20):
+            self.assertEqual(pattern(1000 + i, i), self.read("f{i}.bin".format(i=i)))
+        self.assertEqual(21, len(os.listdir(self.tmp.name)))
+
+    def test_memory_budget(self):
+        """
+        A memory budget shrinks read buffers and bounds synced bytes in flight
+        """
+        urls = [self.server.add_generated("/f{i}.bin".format(i=i), 200000, seed=i) for i in range(8)]
+        engine = DownloadEngine(self.settings('-t', '4', '-c', '1048576', '--fsync', '-m', '1000000'))
+        results = engine.download(urls)
+
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(100000, engine.read_sz)
+        self.assertEqual(200000, engine.writer.max_bytes)
+        for i in range(8):
+            self.assertEqual(pattern(200000, i), self.read("f{i}.bin".format(i=i)))
+
+    def test_chunked_stream(self):
+        """
+        File much larger than the chunk size is streamed correctly
+        """
+        url = self.server.add_generated("/big.bin", 300000, seed=7)
+        results = DownloadEngine(self.settings('-t', '1', '-c', '4096')).download([url])
+
+        self.assertEqual(300000, results[0].size)
+        self.assertEqual(pattern(300000, 7), self.read("big.bin"))
+
+    def test_segmented(self):
+        """
+        Large file on a range capable server is fetched as parallel segments
+        """
+        url = self.server.add_generated("/huge.bin", 1000003, seed=3)
+        results = DownloadEngine(self.settings('-t', '4', '-c', '65536')).download([url])
+
+        self.assertTrue(results[0].ok)
+        self.assertEqual(1000003, results[0].size)
+        self.assertEqual(pattern(1000003, 3), self.read("huge.bin"))
+        # One full request and three range requests
+        self.assertEqual(4, self.server.hits["/huge.bin"])
+
+    def test_no_ranges(self):
+        """
+        Large file on a server without ranges is streamed in one request
+        """
+        self.server.stop()
+        self.server = MockServer(ranges=False)
+        self.server.start()
+        url = self.server.add_generated("/huge.bin", 500000, seed=4)
+        results = DownloadEngine(self.settings('-t', '4', '-c', '65536')).download([url])
+
+        self.assertTrue(results[0].ok)
+        self.assertEqual(pattern(500000, 4), self.read("huge.bin"))
+        self.assertEqual(1, self.server.hits["/huge.bin"])
+
+    def test_small_file_not_split(self):
+        """
+        Files within a single chunk are not split
+        """
+        url = self.server.add_generated("/small.bin", 60000)
+        DownloadEngine(self.settings('-t', '4', '-c', '65536')).download([url])
+
+        self.assertEqual(1, self.server.hits["/small.bin"])
+
+    def test_resume_after_drop(self):
+        """
+        Interrupted download continues from the journal instead of from zero
+        """
+        url = self.server.add_generated("/flaky.bin", 200000, seed=5, cut_after=70000)
+        settings = self.settings('-t', '1', '-c', '8192')
+        results = DownloadEngine(settings).download([url])
+
+        self.assertFalse(results[0].ok)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "flaky.bin")))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, "flaky.bin.part.pandora")))
+
+        runs = 1
+        while not results[0].ok:
+            results = DownloadEngine(settings).download([url])
+            runs += 1
+        self.assertEqual(3, runs)
+        self.assertEqual(pattern(200000, 5), self.read("flaky.bin"))
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ["flaky.bin"])
+        ranges = [headers.get("Range") for _, _, headers in self.server.log]
+        self.assertEqual([None, "bytes=70000-", "bytes=140000-"], ranges)
+
+    def test_resume_segments(self):
+        """
+        Each interrupted segment resumes where it stopped
+        """
+        url = self.server.add_generated("/seg.bin", 400000, seed=6, cut_after=50000)
+        settings = self.settings('-t', '4', '-c', '16384')
+        self.assertFalse(DownloadEngine(settings).download([url])[0].ok)
+        results = DownloadEngine(settings).download([url])
+
+        self.assertTrue(results[0].ok)
+        self.assertEqual(pattern(400000, 6), self.read("seg.bin"))
+        self.assertEqual(8, self.server.hits["/seg.bin"])
+
+    def test_resume_changed_file(self):
+        """
+        Partial file of an entry that changed on the server is discarded
+        """
+        url = self.server.add_generated("/v.bin", 100000, seed=1, cut_after=30000)
+        settings = self.settings('-t', '1', '-c', '8192')
+        self.assertFalse(DownloadEngine(settings).download([url])[0].ok)
+
+        self.server.add_generated("/v.bin", 100000, seed=2)
+        results = DownloadEngine(settings).download([url])
+
+        self.assertTrue(results[0].ok)
+        self.assertEqual(pattern(100000, 2), self.read("v.bin"))
+        self.assertEqual("bytes=30000-", self.server.log[1][2].get("Range"))
+
+    def test_resume_range_not_satisfiable(self):
+        """
+        A journal past the end of a file that shrank is dropped and the file
+        downloaded again from the start
+        """
+        url = self.server.add_generated("/s.bin", 100000, seed=1, headers={"ETag": '"s"'}, cut_after=30000)
+        settings = self.settings('-t', '1', '-c', '8192')
+        self.assertFalse(DownloadEngine(settings).download([url])[0].ok)
+
+        self.server.add_generated("/s.bin", 20000, seed=2, headers={"ETag": '"s"'})
+        results = DownloadEngine(settings).download([url])
+
+        self.assertTrue(results[0].ok)
+        self.assertEqual(pattern(20000, 2), self.read("s.bin"))
+        self.assertEqual(["bytes=30000-", None], [headers.get("Range") for _, _, headers in self.server.log[1:]])
+        self.assertEqual(["s.bin"], os.listdir(self.tmp.name))
+
+    def test_journal_checkpoints(self):
+        """
+        Small reads do not rewrite the journal each time
+        """
+        url = self.server.add_generated("/cp.bin", 200000, seed=3, cut_after=70000)
+        settings = self.settings('-t', '1', '-c', '8192', '--checkpoint', '32768')
+        with mock.patch.object(Journal, "_Journal__save", autospec=True,
+                               side_effect=Journal._Journal__save) as save:
+            self.assertFalse(DownloadEngine(settings).download([url])[0].ok)
+
+        # Start, two checkpoints of 32768 bytes and the end of the stream
+        self.assertEqual(4, save.call_count)
+        self.assertEqual(70000, Journal.load(os.path.join(self.tmp.name, "cp.bin.part"), url).first_missing())
+
+    def test_no_validator(self):
+        """
+        Partial file without an ETag or Last-Modified cannot be resumed and is removed
+        """
+        url = self.server.add_generated("/nv.bin", 100000, headers={"ETag": ""}, cut_after=30000)
+        results = DownloadEngine(self.settings('-t', '1', '-c', '8192')).download([url])
+
+        self.assertFalse(results[0].ok)
+        self.assertEqual([], os.listdir(self.tmp.name))
+
+    def test_verify_refetch(self):
+        """
+        A file not matching the sha256 its url names is downloaded again
+        """
+        data = os.urandom(50000)
+        sha = hashlib.sha256(data).hexdigest()
+        url = self.server.add_file("/data/ab/cd/{sha}.bin".format(sha=sha), data, corrupt=1)
+        engine = DownloadEngine(self.settings('--verify', 'blake2b', '--dedup',
+                                              os.path.join(self.tmp.name, "index.db")), RetryPolicy(base=0.01))
+        results = engine.download([url])
+
+        self.assertTrue(results[0].ok)
+        self.assertEqual(data, self.read(sha + ".bin"))
+        self.assertEqual(("sha256:" + sha, sha), (results[0].digest, results[0].sha256))
+        self.assertEqual(2, self.server.hits["/data/ab/cd/{sha}.bin".format(sha=sha)])
+        self.assertEqual(1, engine.metrics.counter("retries_total", code="corrupt"))
+
+    def test_verify_segments(self):
+        """
+        Files downloaded in segments are verified once every segment is written
+        """
+        data = os.urandom(400000)
+        sha = hashlib.sha256(data).hexdigest()
+        url = self.server.add_file("/{sha}".format(sha=sha), data, corrupt=1)
+        results = DownloadEngine(self.settings('--verify', 'sha256', '-t', '4', '-c', '100000'),
+                                 RetryPolicy(base=0.01)).download([url])
+
+        self.assertTrue(results[0].ok)
+        self.assertEqual(data, self.read(sha))
+        self.assertEqual("sha256:" + sha, results[0].digest)
+        self.assertGreater(self.server.hits["/" + sha], 4)
+
+    def test_verify_gives_up(self):
+        data = b"never right" * 100
+        url = self.server.add_file("/data/{sha}.txt".format(sha=hashlib.sha256(data).hexdigest()), data, corrupt=100)
+        results = DownloadEngine(self.settings('--verify', 'sha256'), RetryPolicy(base=0.01)).download([url])
+
+        self.assertFalse(results[0].ok)
+        self.assertIn("does not match", results[0].error)
+        self.assertEqual(4, self.server.requests)
+        self.assertEqual([], os.listdir(self.tmp.name))
+        with self.assertRaises(ValueError):
+            DownloadEngine(self.settings('--verify', 'md5'))
+
+    def test_retry_codes(self):
+        """
+        Scripted 429 and 403 responses are retried until the file is served
+        """
+        url = self.server.add_generated("/r.bin", 5000)
+        self.server.script("/r.bin", [429, 403, (429, {"Retry-After": "0"})])
+        engine = DownloadEngine(self.settings(), RetryPolicy(base=0.01))
+        results = engine.download([url])
+
+        self.assertTrue(results[0].ok)
+        self.assertEqual(4, self.server.hits["/r.bin"])
+        self.assertEqual(pattern(5000), self.read("r.bin"))
+        self.assertEqual((2, 1), (engine.metrics.counter("retries_total", code=429),
+                                  engine.metrics.counter("retries_total", code=403)))
+
+    def test_metrics(self):
+        """
+        Bytes, files and time to first byte are recorded and dumped while running
+        """
+        urls = [self.server.add_generated("/f{i}.bin".format(i=i), 1000) for i in range(5)]
+        urls.append(self.server.url("/missing.bin"))
+        dump = os.path.join(self.tmp.name, "metrics.json")
+        engine = DownloadEngine(self.settings('-t', '2', '--metrics', dump))
+        engine.download(urls)
+
+        host = self.server.url("/").split("/")[2]
+        self.assertEqual(5000, engine.metrics.counter("bytes_total", host=host))
+        self.assertEqual((5, 1), (engine.metrics.counter("files_total", outcome="ok"),
+                                  engine.metrics.counter("files_total", outcome="failed")))
+        self.assertEqual(6, engine.metrics.histogram("ttfb_seconds", host=host).count)
+        with open(dump) as fp:
+            snapshot = json.load(fp)
+        self.assertIn({"name": "queue_depth", "labels": {"stage": "download"}, "value": 0}, snapshot["gauges"])
+
+    def test_retry_limit(self):
+        """
+        Retries stop at the configured maximum, codes outside the list are not retried
+        """
+        url = self.server.add_generated("/r.bin", 5000)
+        self.server.script("/r.bin", [429] * 5)
+        results = DownloadEngine(self.settings('-r', '2'), RetryPolicy(base=0.01)).download([url])
+
+        self.assertFalse(results[0].ok)
+        self.assertEqual(429, results[0].status)
+        self.assertEqual(3, self.server.hits["/r.bin"])
+
+        url = self.server.add_generated("/s.bin", 5000)
+        self.server.script("/s.bin", [503])
+        results = DownloadEngine(self.settings('-z', '429'), RetryPolicy(base=0.01)).download([url])
+        self.assertEqual(503, results[0].status)
+        self.assertEqual(1, self.server.hits["/s.bin"])
+
+    def test_retry_after(self):
+        """
+        Retry-After is honored and only pauses the host that sent it
+        """
+        other = MockServer()
+        other.start()
+        try:
+            slow = self.server.add_generated("/slow.bin", 1000)
+            self.server.script("/slow.bin", [(429, {"Retry-After": "1"})])
+            fast = [other.add_generated("/f{i}".format(i=i), 1000) for i in range(20)]
+            engine = DownloadEngine(self.settings('-t', '2'), RetryPolicy(base=0.01))
+            start = time.monotonic()
+            results = engine.download([slow] + fast)
+            elapsed = time.monotonic() - start
+        finally:
+            other.stop()
+
+        self.assertTrue(all(r.ok for r in results))
+        self.assertGreaterEqual(elapsed, 1.0)
+        # Every file of the healthy host finished while the other was paused
+        self.assertEqual(slow, results[-1].url)
+
+    def test_retry_segment(self):
+        """
+        Segment receiving a 429 is retried without restarting the file
+        """
+        url = self.server.add_generated("/seg.bin", 400000, seed=9)
+        # First request is the whole file, the second a segment
+        self.server.script("/seg.bin", [None, 429])
+        results = DownloadEngine(self.settings('-t', '2', '-c', '200000'), RetryPolicy(base=0.01)).download([url])
+
+        self.assertTrue(results[0].ok)
+        self.assertEqual(pattern(400000, 9), self.read("seg.bin"))
+        self.assertEqual(3, self.server.hits["/seg.bin"])
+
+    def test_host_conns(self):
+        """
+        Connections to a host never exceed --host_conns while other hosts use the rest
+        """
+        self.server.stop()
+        self.server = MockServer(throttle=2000000)
+        self.server.start()
+        other = MockServer(throttle=2000000)
+        other.start()
+        try:
+            urls = [self.server.add_generated("/a{i}".format(i=i), 20000) for i in range(8)]
+            urls += [other.add_generated("/b{i}".format(i=i), 20000) for i in range(8)]
+            results = DownloadEngine(self.settings('-t', '6', '--host_conns', '2')).download(urls)
+        finally:
+            other.stop()
+
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(2, self.server.max_active)
+        self.assertEqual(2, other.max_active)
+
+    def test_host_conns_segments(self):
+        """
+        Files are not split into more segments than --host_conns
+        """
+        url = self.server.add_generated("/huge.bin", 1000000)
+        results = DownloadEngine(self.settings('-t', '6', '-c', '65536', '--host_conns', '3')).download([url])
+
+        self.assertTrue(results[0].ok)
+        self.assertEqual(3, self.server.hits["/huge.bin"])
+
+    def test_rate_limit(self):
+        """
+        Total speed of all workers is capped by --rate_limit
+        """
+        urls = [self.server.add_generated("/f{i}".format(i=i), 100000) for i in range(3)]
+        start = time.monotonic()
+        results = DownloadEngine(self.settings('-t', '3', '--rate_limit', '200000')).download(urls)
+        elapsed = time.monotonic() - start
+
+        self.assertTrue(all(r.ok for r in results))
+        # First second worth is a free burst, the remaining 100000 bytes take 0.5s
+        self.assertGreaterEqual(elapsed, 0.4)
+
+    def test_http_error(self):
+        """
+        Missing file is reported, not written
+        """
+        results = DownloadEngine(self.settings()).download([self.server.url("/missing.bin")])
+
+        self.assertFalse(results[0].ok)
+        self.assertEqual(404, results[0].status)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "missing.bin")))
+
+    def test_run_bulk_file(self):
+        """
+        Links in a bulk file are all downloaded
+        """
+        bulk = os.path.join(self.tmp.name, "links.txt")
+        with open(bulk, 'w') as fp:
+            fp.write(self.server.add_file("/a.txt", b"a") + "\n\n")
+            fp.write(self.server.add_file("/b.txt", b"b") + "\n")
+        results = DownloadEngine(self.settings('-f', bulk)).run()
+
+        self.assertEqual(2, len(results))
+        self.assertEqual(b"a", self.read("a.txt"))
+        self.assertEqual(b"b", self.read("b.txt"))
+
+    def test_dedup_known_url(self):
+        """
+        Urls downloaded by an earlier run are not fetched again
+        """
+        db = os.path.join(self.tmp.name, "index.db")
+        url = self.server.add_generated("/a.bin", 5000, seed=1)
+        DownloadEngine(self.settings('--dedup', db)).download([url])
+        results = DownloadEngine(self.settings('--dedup', db)).download([url])
+
+        self.assertTrue(results[0].ok)
+        self.assertEqual(os.path.join(self.tmp.name, "a.bin"), results[0].linked_from)
+        self.assertEqual(1, self.server.hits["/a.bin"])
+        self.assertEqual(pattern(5000, 1), self.read("a.bin"))
+
+    def test_dedup_breaker_probe(self):
+        """
+        Indexed urls of a paused host do not hold on to the breaker's probe
+        """
+        db = os.path.join(self.tmp.name, "index.db")
+        known = [self.server.add_generated("/k{i}.bin".format(i=i), 1000, seed=i) for i in range(5)]
+        DownloadEngine(self.settings('--dedup', db)).download(known)
+        url = self.server.add_generated("/r.bin", 1000)
+        self.server.script("/r.bin", [429])
+        engine = DownloadEngine(self.settings('-t', '1', '--dedup', db), RetryPolicy(base=0.05))
+        results = list()
+        thread = threading.Thread(target=lambda: results.extend(engine.download([url] + known)), daemon=True)
+        thread.start()
+        thread.join(10)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(6, len(results))
+        self.assertTrue(all(result.ok for result in results))
+
+    def test_dedup_identical_content(self):
+        """
+        Identical files under different urls are hardlinked, whether they
+        were streamed or fetched as segments
+        """
+        db = os.path.join(self.tmp.name, "index.db")
+        for size, chunk in ((5000, '65536'), (300000, '65536')):
+            first = self.server.add_generated("/{n}/a.bin".format(n=size), size, seed=2, headers={"ETag": ""})
+            second = self.server.add_generated("/{n}/b.bin".format(n=size), size, seed=2, headers={"ETag": ""})
+            settings = self.settings('-t', '4', '-c', chunk, '--dedup', db)
+            DownloadEngine(settings).download([first])
+            results = DownloadEngine(settings).download([second])
+
+            self.assertEqual(os.path.join(self.tmp.name, "a.bin"), results[0].linked_from)
+            self.assertTrue(os.path.samefile(os.path.join(self.tmp.name, "a.bin"),
+                                             os.path.join(self.tmp.name, "b.bin")))
+            self.assertEqual(pattern(size, 2), self.read("b.bin"))
+            os.remove(os.path.join(self.tmp.name, "a.bin"))
+            os.remove(os.path.join(self.tmp.name, "b.bin"))
+
+    def test_dedup_etag(self):
+        """
+        New url of a host sending a known ETag and length is not read
+        """
+        db = os.path.join(self.tmp.name, "index.db")
+        data = pattern(200000, 3)
+        first = self.server.add_file("/a.bin", data, headers={"ETag": '"same"'})
+        second = self.server.add_file("/b.bin", data, headers={"ETag": '"same"'})
+        DownloadEngine(self.settings('--dedup', db)).download([first])
+        results = DownloadEngine(self.settings('--dedup', db)).download([second])
+
+        self.assertEqual(200, results[0].status)
+        self.assertEqual(os.path.join(self.tmp.name, "a.bin"), results[0].linked_from)
+        self.assertEqual(data, self.read("b.bin"))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "b.bin.part")))
+
+    def test_dedup_url_hash(self):
+        """
+        Url naming the sha256 of a known file is not fetched at all
+        """
+        db = os.path.join(self.tmp.name, "index.db")
+        data = pattern(4000, 4)
+        digest = hashlib.sha256(data).hexdigest()
+        first = self.server.add_file("/data/" + digest + ".png", data, headers={"ETag": ""})
+        repost = self.server.add_file("/repost/" + digest + ".png", data, headers={"ETag": ""})
+        DownloadEngine(self.settings('--dedup', db)).download([first + "?f=a.png"])
+        results = DownloadEngine(self.settings('--dedup', db)).download([repost + "?f=b.png"])
+
+        self.assertTrue(results[0].ok)
+        self.assertNotIn("/repost/" + digest + ".png", self.server.hits)
+        self.assertEqual(data, self.read("b.png"))
+
+    def test_unzip(self):
+        """
+        Zips are extracted, while streaming when fetched in one piece and
+        by the pool when fetched as segments, other files are left alone
+        """
+        members = {"a.txt": b"a" * 5000, "sub/b.txt": pattern(200000, 8)}
+        data = make_zip(zipfile.ZIP_STORED, members=members)
+        small = self.server.add_file("/small.zip", data)
+        segmented = self.server.add_file("/seg.zip", data)
+        plain = self.server.add_generated("/plain.bin", 5000)
+        engine = DownloadEngine(self.settings('-u', '-t', '4', '-c', '1048576'))
+        engine.download([self.server.url("/small.zip?x=1")])
+        # Chunk smaller than the file only for the second zip
+        engine.chunk_sz = 16384
+        engine.download([segmented, plain])
+        results = {os.path.basename(r.path): r for r in engine.unzip.results}
+
+        self.assertEqual({"small.zip", "seg.zip"}, set(results))
+        self.assertTrue(results["small.zip"].streamed)
+        self.assertFalse(results["seg.zip"].streamed)
+        for folder in ("small", "seg"):
+            self.assertEqual(members["sub/b.txt"], self.read(os.path.join(folder, "sub", "b.txt")))
+        self.assertGreater(self.server.hits["/seg.zip"], 1)
+        self.assertEqual(1, self.server.hits["/small.zip"])
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "plain")))
+
+    def test_missing_folder(self):
+        """
+        Engine refuses to start without a download folder
+        """
+        with self.assertRaises(ValueError):
+            DownloadEngine(PandoraArgInterpretor.interpret(['.py', '-t', '2']))
+
+    def test_get_file_name(self):
+        """
+        File names from path, Kemono query and hostile input
+        """
+        self.assertEqual("a.png", get_file_name("https://x.com/data/a.png"))
+        self.assertEqual("my file.png", get_file_name("https://x.com/data/ab/abc.png?f=my%20file.png"))
+        self.assertEqual("passwd", get_file_name("https://x.com/x?f=../../etc/passwd"))
+        self.assertEqual("index.html", get_file_name("https://x.com/"))
+
+    def test_same_file_name(self):
+        """
+        Urls of one run ending in the same name are saved side by side
+        """
+        urls = [self.server.add_generated("/{d}/image.jpg".format(d=d), 100000, seed=i)
+                for i, d in enumerate("abc")]
+        engine = DownloadEngine(self.settings('-t', '3', '-c', '16384'))
+        results = {result.url: result for result in engine.download(urls)}
+
+        self.assertTrue(all(result.ok for result in results.values()))
+        self.assertEqual(["image (2).jpg", "image (3).jpg", "image.jpg"], sorted(os.listdir(self.tmp.name)))
+        for i, url in enumerate(urls):
+            with open(results[url].path, 'rb') as fp:
+                self.assertEqual(pattern(100000, i), fp.read())
+        # Names are given out per run
+        self.assertEqual(os.path.join(self.tmp.name, "image.jpg"), engine.download(urls[1:2])[0].path)
+
+
+if __name__ == '__main__':
+    unittest.main()
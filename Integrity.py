@@ -0,0 +1,120 @@
+import hashlib
+from DedupStore import HASH_CHUNK_SZ, url_sha256
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+"""
+Verifies downloads as they stream, selected with Config.VERIFY_HASH.
+Every chunk written is also fed to a hash so a file is checked without
+reading it back. Files whose url names the sha256 of their content, as
+Kemono's '/data/ab/cd/<sha256>.ext' paths do, are hashed with sha256 and
+compared with it. Other files are hashed with the configured algorithm
+and the digest is reported with their result.
+
+sha256 and blake2b always work, xxh64, xxh3 and xxh128 need the xxhash
+package and are several times faster where no hash has to be matched.
+
+Usage:
+    verifier = Verifier.for_url(url, "blake2b")
+    for data in chunks:
+        part.write(offset, data)
+        verifier.update(data)
+    error = verifier.verify(part.path, written)
+"""
+
+DEFAULT_HASH_TYPE = "sha256"
+HASH_TYPES = {
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+}
+if xxhash is not None:
+    HASH_TYPES.update({"xxh64": xxhash.xxh64, "xxh3": xxhash.xxh3_64, "xxh128": xxhash.xxh3_128})
+
+
+def new_hasher(hash_type: str):
+    """
+    Args:
+        hash_type (str): name of a hash in HASH_TYPES
+
+    Raises:
+        ValueError: hash is unknown, or needs xxhash and it is not installed
+
+    Returns:
+        hasher with update(bytes) and hexdigest()
+    """
+    factory = HASH_TYPES.get(hash_type)
+    if factory is None:
+        if hash_type.startswith("xxh") and xxhash is None:
+            raise ValueError("{hash_type} needs the xxhash package".format(hash_type=hash_type))
+        raise ValueError("Unknown hash {hash_type}, use one of {types}".format(
+            hash_type=hash_type, types=", ".join(HASH_TYPES)))
+    return factory()
+
+
+class Verifier():
+    """
+    Hash of one file fed as it streams, checked against the hash the url
+    names if it names one
+    """
+
+    def __init__(self, hash_type: str = DEFAULT_HASH_TYPE, expected: str | None = None) -> None:
+        """
+        Args:
+            hash_type (str, optional): hash used when nothing is expected. Defaults to DEFAULT_HASH_TYPE.
+            expected (str | None, optional): hex sha256 the content must have. Defaults to None.
+
+        Raises:
+            ValueError: hash_type is unknown or unavailable
+        """
+        self.hash_type = "sha256" if expected else hash_type
+        self.expected = expected
+        self.hasher = new_hasher(self.hash_type)
+        # Bytes fed so far, a file not fed every byte in order is hashed from disk
+        self.fed = 0
+
+    @classmethod
+    def for_url(cls, url: str, hash_type: str = DEFAULT_HASH_TYPE) -> "Verifier":
+        """
+        Returns:
+            Verifier: verifier expecting the sha256 url names, if any
+        """
+        return cls(hash_type, url_sha256(url))
+
+    def update(self, data) -> None:
+        self.hasher.update(data)
+        self.fed += len(data)
+
+    def digest(self) -> str:
+        """
+        Returns:
+            str: '<hash type>:<hex digest>' of the content fed
+        """
+        return "{hash_type}:{hex}".format(hash_type=self.hash_type, hex=self.hasher.hexdigest())
+
+    def verify(self, path: str, size: int) -> str | None:
+        """
+        Checks the content against the expected hash. Content that was not
+        streamed through update() in one piece, a file downloaded in
+        segments or resumed, is hashed from path instead.
+
+        Args:
+            path (str): file holding the content
+            size (int): bytes of the content
+
+        Returns:
+            str | None: why the content is corrupt, None if it matches or
+                nothing is expected
+        """
+        if self.fed != size:
+            if not self.expected:
+                return None
+            self.hasher = new_hasher(self.hash_type)
+            self.fed = 0
+            with open(path, "rb") as fp:
+                for data in iter(lambda: fp.read(HASH_CHUNK_SZ), b""):
+                    self.update(data)
+        if self.expected and self.hasher.hexdigest() != self.expected:
+            return "sha256 {actual} does not match {expected} named by the url".format(
+                actual=self.hasher.hexdigest(), expected=self.expected)
+        return None
@@ -0,0 +1,83 @@
+import hashlib
+import logging
+import os
+import tempfile
+import unittest
+import Integrity
+from Integrity import Verifier, new_hasher
+
+
+class IntegrityTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """
+        Creates a scratch folder
+        """
+        logging.basicConfig(level=logging.INFO)
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def write(self, data: bytes) -> str:
+        path = os.path.join(self.tmp.name, "f.bin")
+        with open(path, "wb") as fp:
+            fp.write(data)
+        return path
+
+    def test_streamed(self):
+        """
+        Content fed in one piece is checked without reading the file
+        """
+        data = b"x" * 1000
+        sha = hashlib.sha256(data).hexdigest()
+        verifier = Verifier.for_url("http://h/data/ab/cd/{sha}.png".format(sha=sha), "blake2b")
+        verifier.update(data[:400])
+        verifier.update(data[400:])
+
+        self.assertEqual("sha256", verifier.hash_type)
+        self.assertIsNone(verifier.verify(os.path.join(self.tmp.name, "missing"), 1000))
+        self.assertEqual("sha256:" + sha, verifier.digest())
+
+    def test_mismatch(self):
+        verifier = Verifier(expected=hashlib.sha256(b"good").hexdigest())
+        verifier.update(b"bad!")
+
+        self.assertIn("does not match", verifier.verify(self.write(b"bad!"), 4))
+
+    def test_read_back(self):
+        """
+        Content not fed in one piece is hashed from disk when a hash is expected
+        """
+        data = os.urandom(3000)
+        verifier = Verifier(expected=hashlib.sha256(data).hexdigest())
+        verifier.update(data[1000:2000])
+        self.assertIsNone(verifier.verify(self.write(data), 3000))
+        self.assertEqual(3000, verifier.fed)
+
+        verifier = Verifier(expected=hashlib.sha256(data).hexdigest())
+        self.assertIsNotNone(verifier.verify(self.write(data[:-1] + b"?"), 3000))
+
+    def test_unexpected(self):
+        """
+        Urls naming no hash are hashed with the configured one and always pass
+        """
+        verifier = Verifier.for_url("http://h/file.bin", "blake2b")
+        verifier.update(b"abc")
+
+        self.assertIsNone(verifier.verify(self.write(b"abc"), 3))
+        self.assertEqual("blake2b:" + hashlib.blake2b(b"abc").hexdigest(), verifier.digest())
+
+    def test_new_hasher(self):
+        self.assertEqual(hashlib.sha256().hexdigest(), new_hasher("sha256").hexdigest())
+        with self.assertRaises(ValueError):
+            new_hasher("md5")
+        if Integrity.xxhash is None:
+            with self.assertRaisesRegex(ValueError, "xxhash"):
+                new_hasher("xxh64")
+        else:
+            self.assertEqual(16, len(new_hasher("xxh64").hexdigest()))
+
+
+if __name__ == '__main__':
+    unittest.main()
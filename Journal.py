@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+"""
+Sidecar journal of a partial download. Records the validator the server
+sent (ETag or Last-Modified) and how many bytes of each byte range segment
+have reached the partial file so an interrupted download resumes from
+the last completed chunk instead of from zero.
+
+Journal file is stored next to the partial file, for example
+'file.zip.part' is journaled in 'file.zip.part.pandora'. It is rewritten
+once checkpoint_sz bytes or CHECKPOINT_INTERVAL seconds of progress
+accumulate, small reads of a throttled or memory bound download would
+otherwise rewrite it every few KB. A crash loses at most that much
+progress, never data already counted as on disk.
+"""
+
+# Suffix of a file still being downloaded
+PART_SUFFIX = ".part"
+# Suffix of the journal of a partial file
+JOURNAL_SUFFIX = ".pandora"
+# Bytes of progress between journal checkpoints, Config.JOURNAL_CHECKPOINT
+DEFAULT_CHECKPOINT_SZ = 4 * 1024 * 1024
+# Seconds of progress between journal checkpoints
+CHECKPOINT_INTERVAL = 1.0
+
+
+def get_validator(etag: str | None, last_modified: str | None) -> str | None:
+    """
+    Picks the validator to send in If-Range. Weak ETags are not allowed
+    in If-Range so Last-Modified is used instead.
+
+    Args:
+        etag (str | None): ETag response header
+        last_modified (str | None): Last-Modified response header
+
+    Returns:
+        str | None: validator, None if the response cannot be resumed safely
+    """
+    if etag and not etag.startswith("W/"):
+        return etag
+    return last_modified or None
+
+
+class Journal():
+    """
+    Progress of a partial file. Each segment is [start, end, done] where
+    bytes [start, start + done) of the segment are on disk. Thread safe,
+    every worker writing a segment of the file shares one journal.
+    """
+
+    def __init__(self, part: str, url: str, size: int, validator: str, segments: list[tuple[int, int]],
+                 checkpoint_sz: int = DEFAULT_CHECKPOINT_SZ) -> None:
+        """
+        Args:
+            part (str): partial file the journal describes
+            url (str): url the file is downloaded from
+            size (int): full size of the file in bytes
+            validator (str): ETag or Last-Modified of the file
+            segments (list[tuple[int, int]]): [start, end) of each segment
+            checkpoint_sz (int, optional): bytes of progress between
+                checkpoints. Defaults to DEFAULT_CHECKPOINT_SZ.
+        """
+        self.part = part
+        self.path = part + JOURNAL_SUFFIX
+        self.url = url
+        self.size = size
+        self.validator = validator
+        self.segments = [[start, end, 0] for start, end in segments]
+        self.checkpoint_sz = checkpoint_sz
+        # Progress not persisted yet and when the journal was last persisted
+        self.__unsaved = 0
+        self.__saved = time.monotonic()
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def load(cls, part: str, url: str, checkpoint_sz: int = DEFAULT_CHECKPOINT_SZ) -> "Journal | None":
+        """
+        Loads the journal of a partial file if it can be resumed from
+
+        Args:
+            part (str): partial file
+            url (str): url the file is about to be downloaded from
+            checkpoint_sz (int, optional): bytes of progress between
+                checkpoints. Defaults to DEFAULT_CHECKPOINT_SZ.
+
+        Returns:
+            Journal | None: journal, None if there is none or it does not
+                match the partial file or url
+        """
+        try:
+            with open(part + JOURNAL_SUFFIX, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+            if data["url"] != url or os.path.getsize(part) != data["size"]:
+                return None
+            journal = cls(part, url, data["size"], data["validator"], [], checkpoint_sz)
+            journal.segments = [[int(s), int(e), int(d)] for s, e, d in data["segments"]]
+            return journal
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def first_missing(self) -> int:
+        """
+        Returns:
+            int: offset of the first byte not yet on disk
+        """
+        with self.__lock:
+            for start, end, done in self.segments:
+                if start + done < end:
+                    return start + done
+            return self.size
+
+    def missing(self) -> list[tuple[int, int, int]]:
+        """
+        Returns:
+            list[tuple[int, int, int]]: (segment index, first missing byte, end)
+                of every incomplete segment
+        """
+        with self.__lock:
+            return [(i, start + done, end) for i, (start, end, done) in enumerate(self.segments) if start + done < end]
+
+    def advance(self, index: int, n: int) -> None:
+        """
+        Records that n more bytes of a segment reached the partial file,
+        persisting the journal once checkpoint_sz bytes or
+        CHECKPOINT_INTERVAL seconds of progress accumulated. Data must be
+        flushed before calling, save() persists the rest.
+
+        Args:
+            index (int): segment index
+            n (int): bytes written
+        """
+        with self.__lock:
+            self.segments[index][2] += n
+            self.__unsaved += n
+            if self.__unsaved >= self.checkpoint_sz or time.monotonic() - self.__saved >= CHECKPOINT_INTERVAL:
+                self.__save()
+
+    def save(self) -> None:
+        """
+        Persists the journal
+        """
+        with self.__lock:
+            self.__save()
+
+    def remove(self) -> None:
+        """
+        Deletes the journal, done once the file is complete or discarded
+        """
+        with self.__lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __save(self) -> None:
+        """
+        Writes the journal atomically so a crash never leaves it half written
+        """
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fp:
+            json.dump({"url": self.url, "size": self.size, "validator": self.validator,
+                       "segments": self.segments}, fp)
+        os.replace(tmp, self.path)
+        self.__unsaved = 0
+        self.__saved = time.monotonic()
@@ -0,0 +1,84 @@
+import logging
+import os
+import tempfile
+import unittest
+from Journal import Journal, get_validator
+
+
+class JournalTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """
+        Creates a scratch partial file
+        """
+        logging.basicConfig(level=logging.INFO)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.part = os.path.join(self.tmp.name, "a.bin.part")
+        with open(self.part, 'wb') as fp:
+            fp.truncate(300)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        """
+        Progress survives a save and load
+        """
+        journal = Journal(self.part, "http://x/a.bin", 300, '"e"', [(0, 100), (100, 200), (200, 300)])
+        journal.advance(0, 100)
+        journal.advance(1, 40)
+        journal.save()
+        loaded = Journal.load(self.part, "http://x/a.bin")
+
+        self.assertEqual(140, loaded.first_missing())
+        self.assertEqual([(1, 140, 200), (2, 200, 300)], loaded.missing())
+        self.assertEqual('"e"', loaded.validator)
+
+    def test_checkpoint(self):
+        """
+        Progress is persisted once checkpoint_sz bytes accumulate, not every advance
+        """
+        journal = Journal(self.part, "http://x/a.bin", 300, '"e"', [(0, 300)], checkpoint_sz=100)
+        journal.save()
+        journal.advance(0, 60)
+        self.assertEqual(0, Journal.load(self.part, "http://x/a.bin").first_missing())
+        journal.advance(0, 60)
+        self.assertEqual(120, Journal.load(self.part, "http://x/a.bin").first_missing())
+        journal.advance(0, 30)
+        self.assertEqual(120, Journal.load(self.part, "http://x/a.bin", 100).first_missing())
+        journal.save()
+        self.assertEqual(150, Journal.load(self.part, "http://x/a.bin").first_missing())
+
+    def test_load_mismatch(self):
+        """
+        Journal of another url or a partial file of the wrong size is ignored
+        """
+        Journal(self.part, "http://x/a.bin", 300, '"e"', [(0, 300)]).save()
+        self.assertIsNone(Journal.load(self.part, "http://x/b.bin"))
+
+        with open(self.part, 'wb') as fp:
+            fp.truncate(10)
+        self.assertIsNone(Journal.load(self.part, "http://x/a.bin"))
+
+    def test_remove(self):
+        """
+        Removing deletes only the journal
+        """
+        journal = Journal(self.part, "http://x/a.bin", 300, '"e"', [(0, 300)])
+        journal.save()
+        journal.remove()
+        journal.remove()
+        self.assertEqual(["a.bin.part"], os.listdir(self.tmp.name))
+
+    def test_get_validator(self):
+        """
+        Weak ETags fall back to Last-Modified
+        """
+        self.assertEqual('"abc"', get_validator('"abc"', "Mon"))
+        self.assertEqual("Mon", get_validator('W/"abc"', "Mon"))
+        self.assertIsNone(get_validator('W/"abc"', None))
+        self.assertIsNone(get_validator(None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,271 @@
+import http.client
+import itertools
+import logging
+import re
+import time
+import urllib.parse
+from typing import Iterable, Iterator
+from DownloadEngine import ConnectionPool, DownloadEngine, DownloadResult
+from KemonoFilter import KemonoFilter
+from KemonoLayout import KemonoLayout
+from KemonoParser import FILE, LinkRecord, ParserStage
+from KemonoSync import CreatorListing, SyncStore
+from MemoryBudget import MemoryBudget
+from Metrics import Metrics
+from ResponseCache import DEFAULT_CACHE_SZ, ResponseCache
+from RetryScheduler import DEFAULT_HTTPS_CODES, DEFAULT_HTTPS_RETRIES, RetryPolicy, parse_retry_after
+from ServiceComponent import Attachment, Creator, ServiceComponent
+from Services import Config, Service, get_setting
+"""
+Downloads the posts of Kemono creators, the ServiceComponent of
+Service.KEMONO. Creator pages are listed through the Kemono API and
+parsed by a ParserStage, see KemonoParser.py. The files of each post not
+excluded by the Kemono excludes are handed to a DownloadEngine, saved
+where the KemonoLayout puts them. Links to other sites are kept in links.
+
+With Config.KEMONO_SYNC only posts newer than the last run are listed,
+see KemonoSync.py. With Config.RESPONSE_CACHE listing pages are
+revalidated instead of downloaded again, see ResponseCache.py.
+
+Usage:
+    component = KemonoComponent(settings)
+    results = component.download(["https://kemono.su/patreon/user/123"], engine)
+"""
+
+# 'https://kemono.su/patreon/user/123', the page a user copies
+CREATOR_URL = re.compile(r"^(https?://[^/]+)/([^/]+)/user/([^/?#]+)")
+
+
+def parse_creator_url(url: str) -> tuple[str, str, str] | None:
+    """
+    Returns:
+        tuple[str, str, str] | None: site, service and creator id of a
+            creator page url, None if url is not one
+    """
+    match = CREATOR_URL.match(url.strip())
+    if match is None or match.group(2) == "api":
+        return None
+    return match.group(1), match.group(2), match.group(3)
+
+
+class KemonoComponent(ServiceComponent):
+    """
+    Lists creators and collects the files of their posts. Listing requests
+    share one keep-alive connection pool and are retried on
+    Config.HTTPS_CODES like downloads are. Pages of posts are lists of
+    LinkRecord.
+    """
+    service = Service.KEMONO
+
+    def __init__(self, settings: dict, retry_policy: RetryPolicy | None = None, metrics: Metrics | None = None) -> None:
+        """
+        Args:
+            settings (dict): dict returned by PandoraArgInterpretor.interpret
+            retry_policy (RetryPolicy | None, optional): backoff used for retries.
+                Defaults to None for RetryPolicy().
+            metrics (Metrics | None, optional): records listing requests and
+                parsing, pass the engine's to report both together. Defaults
+                to None for a private Metrics.
+
+        Raises:
+            ValueError: Config.RESPONSE_CACHE_SZ is not positive or a Kemono
+                layout config is invalid
+        """
+        super().__init__(settings)
+        self.filter = KemonoFilter.from_settings(settings)
+        self.layout = KemonoLayout.from_settings(settings)
+        sync = get_setting(settings, Config.KEMONO_SYNC)
+        self.sync = SyncStore(sync) if sync else None
+        self.full_sync = get_setting(settings, Config.KEMONO_SYNC_FULL, False)
+        cache = get_setting(settings, Config.RESPONSE_CACHE)
+        cache_sz = get_setting(settings, Config.RESPONSE_CACHE_SZ, DEFAULT_CACHE_SZ)
+        if cache_sz < 1:
+            raise ValueError("response cache size must be positive")
+        self.cache = ResponseCache(cache, cache_sz) if cache else None
+        self.retry_codes = frozenset(get_setting(settings, Config.HTTPS_CODES, DEFAULT_HTTPS_CODES))
+        self.max_retries = get_setting(settings, Config.HTTPS_RETRIES, DEFAULT_HTTPS_RETRIES)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.pool = ConnectionPool(1)
+        budget = MemoryBudget.from_settings(settings)
+        self.parser = ParserStage(self.filter, budget.workers("parse"), metrics=self.metrics,
+                                  max_bytes=budget.limit("parse"))
+        # LINK records of every post listed, links to other sites
+        self.links = list()
+        # Listing of every creator being listed, until finished
+        self.__listings = dict()
+
+    def request(self, url: str, headers: dict) -> tuple[int, dict, bytes]:
+        """
+        GETs url through the response cache if there is one, waiting out
+        Config.HTTPS_CODES responses
+
+        Args:
+            url (str): url to request
+            headers (dict): request headers
+
+        Returns:
+            tuple[int, dict, bytes]: status, headers keyed in lowercase and body
+        """
+        if self.cache is not None:
+            return self.cache.fetch(self.__get, url, headers)
+        return self.__get(url, headers)
+
+    def __get(self, url: str, headers: dict) -> tuple[int, dict, bytes]:
+        """
+        GETs url, waiting out Config.HTTPS_CODES responses and connection
+        errors under the same retry limit
+
+        Raises:
+            OSError, http.client.HTTPException: request kept failing
+        """
+        failures = 0
+        host = urllib.parse.urlsplit(url).netloc
+        while True:
+            start = time.perf_counter()
+            try:
+                response, key = self.pool.request("GET", url, headers)
+                self.metrics.observe("ttfb_seconds", time.perf_counter() - start, host=host)
+                try:
+                    body = response.read()
+                finally:
+                    # Connection of a body cut short is closed, not reused
+                    self.pool.finish(response, key)
+            except (OSError, http.client.HTTPException) as e:
+                if self.max_retries is not None and 0 <= self.max_retries <= failures:
+                    raise
+                failures += 1
+                self.metrics.inc("retries_total", code="error")
+                delay = self.retry_policy.delay(failures)
+                logging.info("{error} listing {url}, retrying in {delay:.1f}s".format(
+                    error=repr(e), url=url, delay=delay))
+                time.sleep(delay)
+                continue
+            if response.status not in self.retry_codes or \
+                    (self.max_retries is not None and 0 <= self.max_retries <= failures):
+                return response.status, {k.lower(): v for k, v in response.getheaders()}, body
+            failures += 1
+            self.metrics.inc("retries_total", code=response.status)
+            delay = self.retry_policy.delay(failures, parse_retry_after(response.getheader("Retry-After")))
+            logging.info("HTTP {status} listing {url}, retrying in {delay:.1f}s".format(
+                status=response.status, url=url, delay=delay))
+            time.sleep(delay)
+
+    def listing(self, creator_url: str) -> CreatorListing:
+        """
+        Args:
+            creator_url (str): creator page url
+
+        Raises:
+            ValueError: creator_url is not a creator page
+
+        Returns:
+            CreatorListing: posts of the creator, only new ones with Config.KEMONO_SYNC
+        """
+        parsed = parse_creator_url(creator_url)
+        if parsed is None:
+            raise ValueError("{url} is not a Kemono creator url".format(url=creator_url))
+        site, service, creator = parsed
+        previous = self.sync.get(service, creator) if self.sync is not None else None
+        return CreatorListing(self.request, site, service, creator, previous, self.full_sync)
+
+    def creators(self, urls: Iterable[str]) -> list[Creator]:
+        """
+        Raises:
+            ValueError: a url is not a creator page
+
+        Returns:
+            list[Creator]: creator of every creator page url
+        """
+        creators = list()
+        for url in urls:
+            parsed = parse_creator_url(url)
+            if parsed is None:
+                raise ValueError("{url} is not a Kemono creator url".format(url=url))
+            creators.append(Creator(*parsed, url))
+        return creators
+
+    def posts(self, creator: Creator) -> Iterator[list[LinkRecord]]:
+        """
+        Lists the creator's pages and parses them in the ParserStage. Pages
+        are yielded as the parser returns them, so records of earlier pages
+        come back while later ones are listed.
+
+        Returns:
+            Iterator[list[LinkRecord]]: records of the parsed pages, only of
+                new posts with Config.KEMONO_SYNC
+        """
+        listing = self.listing(creator.url)
+        self.__listings[creator] = listing
+        for body, count in listing.pages():
+            self.parser.submit(creator.site, body, count)
+            page = list(self.parser.ready())
+            if page:
+                yield page
+        page = list(self.parser.drain())
+        if page:
+            yield page
+
+    def attachments(self, creator: Creator, page: list[LinkRecord]) -> list[Attachment]:
+        """
+        Places the files of a page where the KemonoLayout puts them and keeps
+        the links of the page. Records of a post are always in one page.
+
+        Returns:
+            list[Attachment]: files of the page not excluded
+        """
+        attachments = list()
+        for _, post in itertools.groupby(page, lambda record: record.post_id):
+            files = list()
+            for record in post:
+                if record.kind == FILE:
+                    files.append(record)
+                else:
+                    self.links.append(record)
+            for index, record in enumerate(files, 1):
+                fname = self.layout.place(creator.service, creator.id, record.post_id, record.title, index,
+                                          len(files), record.name)
+                attachments.append(Attachment(record.url, fname))
+        # Owners of the names are on disk before the files start downloading
+        self.layout.flush()
+        return attachments
+
+    def finish(self, creator: Creator, results: list[DownloadResult]) -> None:
+        """
+        Saves the sync state of the creator if every file downloaded
+        """
+        listing = self.__listings.pop(creator, None)
+        if listing is None:
+            return
+        logging.info("{url}: {pages} listing requests, {unchanged} unchanged, {files} files".format(
+            url=creator.url, pages=listing.pages_listed, unchanged=listing.unchanged, files=len(results)))
+        if self.sync is not None and all(result.ok for result in results):
+            self.sync.put(listing.state)
+
+    def download_creator(self, creator_url: str, engine: DownloadEngine) -> list[DownloadResult]:
+        """
+        Downloads the files of a creator's posts and waits for them. The sync
+        state is only saved if every file downloaded.
+
+        Args:
+            creator_url (str): creator page url
+            engine (DownloadEngine): engine to download with, joined before returning
+
+        Raises:
+            ValueError: creator_url is not a creator page
+
+        Returns:
+            list[DownloadResult]: result of every file
+        """
+        return self.download([creator_url], engine)
+
+    def close(self) -> None:
+        """
+        Closes pooled connections, the parser processes and the databases
+        """
+        self.pool.close()
+        self.parser.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.sync is not None:
+            self.sync.close()
@@ -0,0 +1,149 @@
+import logging
+import os
+import tempfile
+import unittest
+from unittest import mock
+import PandoraArgInterpretor
+from DownloadEngine import DownloadEngine
+from KemonoComponent import KemonoComponent, parse_creator_url
+from MockServer import MockServer
+from RetryScheduler import RetryPolicy
+
+
+class KemonoComponentTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """
+        Starts a local server and creates a scratch download folder
+        """
+        logging.basicConfig(level=logging.INFO)
+        self.server = MockServer()
+        self.server.start()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.posts = list()
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        self.tmp.cleanup()
+
+    def settings(self, *args: str) -> dict:
+        return PandoraArgInterpretor.interpret(['.py', '-d', self.tmp.name] + list(args))
+
+    def add_post(self, i: int, title: str = "", names: tuple = ("a.png",)) -> None:
+        """
+        Adds a post, newest first, with a file per name served by the mock
+        """
+        files = list()
+        for name in names:
+            path = "/{i:02x}/{name}".format(i=i, name=name)
+            self.server.add_file("/data" + path, "{i}/{name}".format(i=i, name=name).encode())
+            files.append({"name": "{i}-{name}".format(i=i, name=name), "path": path})
+        self.posts.insert(0, {"id": str(i), "title": title, "content": "", "published": "2024-01-{i:02d}".format(i=i),
+                              "file": files[0] if files else dict(), "attachments": files})
+
+    def download(self, component: KemonoComponent, url: str) -> list:
+        engine = DownloadEngine(self.settings(), RetryPolicy(base=0.01))
+        return component.download_creator(url, engine)
+
+    def test_parse_creator_url(self):
+        self.assertEqual(("https://kemono.su", "patreon", "123"),
+                         parse_creator_url("https://kemono.su/patreon/user/123/post/9"))
+        self.assertIsNone(parse_creator_url("https://kemono.su/patreon/post/9"))
+        self.assertIsNone(parse_creator_url("https://kemono.su/api/user/1"))
+
+    def test_download(self):
+        """
+        Files of every post are downloaded once, excluded ones are not
+        """
+        self.add_post(1, names=("a.png", "b.psd"))
+        self.add_post(2, title="WIP", names=("c.png",))
+        url = self.server.add_creator("patreon", "7", self.posts)
+        component = KemonoComponent(self.settings('--kxfile', 'psd', '--kxpost', 'wip'))
+        results = self.download(component, url)
+
+        self.assertEqual(["1-a.png"], [os.path.basename(r.path) for r in results])
+        self.assertTrue(results[0].ok)
+        self.assertEqual(1, self.server.hits["/data/01/a.png"])
+        component.close()
+
+    def test_sync(self):
+        """
+        Re-runs only download new posts and unchanged creators cost a 304
+        """
+        db = os.path.join(self.tmp.name, "sync.db")
+        for i in range(1, 4):
+            self.add_post(i)
+        url = self.server.add_creator("patreon", "7", self.posts)
+        component = KemonoComponent(self.settings('--ksync', db))
+        self.assertEqual(3, len(self.download(component, url)))
+
+        results = self.download(component, url)
+        self.assertEqual([], results)
+        self.assertEqual(2, self.server.hits["/api/v1/patreon/user/7"])
+        self.assertIsNotNone(self.server.log[-1][2].get("If-None-Match"))
+
+        self.add_post(4)
+        results = self.download(component, url)
+        self.assertEqual(["4-a.png"], [os.path.basename(r.path) for r in results])
+        self.assertEqual(1, self.server.hits["/data/03/a.png"])
+        component.close()
+
+    def test_cache(self):
+        """
+        Re-runs with other excludes revalidate the cached listing
+        """
+        db = os.path.join(self.tmp.name, "cache.db")
+        self.add_post(1)
+        self.add_post(2, title="Sketch")
+        url = self.server.add_creator("patreon", "7", self.posts)
+        component = KemonoComponent(self.settings('--cache', db))
+        self.assertEqual(2, len(self.download(component, url)))
+        component.close()
+
+        component = KemonoComponent(self.settings('--cache', db, '--kxpost', 'sketch'))
+        results = self.download(component, url)
+        self.assertEqual(["1-a.png"], [os.path.basename(r.path) for r in results])
+        self.assertEqual(1, component.cache.hits)
+        component.close()
+
+    def test_connection_error(self):
+        """
+        A listing request whose connection drops is retried
+        """
+        self.add_post(1)
+        url = self.server.add_creator("patreon", "7", self.posts)
+        component = KemonoComponent(self.settings(), RetryPolicy(base=0.01))
+        errors = [ConnectionResetError()]
+        request = component.pool.request
+
+        def drop_once(*args):
+            if errors:
+                raise errors.pop()
+            return request(*args)
+
+        with mock.patch.object(component.pool, "request", side_effect=drop_once):
+            results = self.download(component, url)
+
+        self.assertTrue(results[0].ok)
+        self.assertEqual(1, component.metrics.counter("retries_total", code="error"))
+        component.close()
+
+    def test_sync_failed(self):
+        """
+        Sync state is not saved when a download failed
+        """
+        db = os.path.join(self.tmp.name, "sync.db")
+        self.add_post(1)
+        self.server.script("/data/01/a.png", [404])
+        url = self.server.add_creator("patreon", "7", self.posts)
+        component = KemonoComponent(self.settings('--ksync', db))
+        self.assertFalse(self.download(component, url)[0].ok)
+
+        results = self.download(component, url)
+        self.assertTrue(results[0].ok)
+        self.assertIsNotNone(component.sync.get("patreon", "7"))
+        component.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
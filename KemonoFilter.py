@@ -0,0 +1,154 @@
+import re
+from typing import Iterable
+from Services import Config, get_setting
+"""
+Compiled matchers for the Kemono excludes. Config.KEMONO_EXCLUDE_FILE
+becomes a set of extensions and Config.KEMONO_EXCLUDE_POST and
+Config.KEMONO_EXCLUDE_LINK each become a single regex built from a trie
+of their keywords, so a post or link is checked in one pass over its
+text however many keywords there are.
+
+Usage:
+    kfilter = KemonoFilter.from_settings(settings)
+    if not kfilter.excludes_post(post_title + post_content):
+        ...
+"""
+
+
+def _trie_pattern(node: dict) -> str:
+    """
+    Regex source matching any keyword of a trie. Keywords sharing a
+    prefix share its branch, so the regex engine tests each character of
+    the text against one branch per distinct next character instead of
+    once per keyword.
+
+    Args:
+        node (dict): trie node, character -> child node, '' marks a keyword end
+
+    Returns:
+        str: regex source
+    """
+    prefix = list()
+    # Walk chains of single children iteratively, keywords can be long
+    while "" not in node and len(node) == 1:
+        char, node = next(iter(node.items()))
+        prefix.append(re.escape(char))
+    if "" in node:
+        # A keyword ends here, the rest of the subtree can never be needed
+        # since any match excludes
+        return "".join(prefix)
+    singles = list()
+    branches = list()
+    for char, child in sorted(node.items()):
+        if list(child) == [""]:
+            singles.append(re.escape(char))
+        else:
+            branches.append(re.escape(char) + _trie_pattern(child))
+    if len(singles) == 1:
+        branches.append(singles[0])
+    elif singles:
+        branches.append("[" + "".join(singles) + "]")
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    return "".join(prefix) + body
+
+
+def compile_keywords(keywords: Iterable[str]) -> re.Pattern | None:
+    """
+    Compiles keywords into one regex that finds any of them. Matching is
+    case insensitive when the text searched is lowercased first, as
+    keywords are lowercased here.
+
+    Args:
+        keywords (Iterable[str]): keywords, blanks are ignored
+
+    Returns:
+        re.Pattern | None: pattern, None if there are no keywords
+    """
+    root = dict()
+    for keyword in keywords:
+        keyword = keyword.strip().lower()
+        if not keyword:
+            continue
+        node = root
+        for char in keyword:
+            node = node.setdefault(char, dict())
+        node[""] = dict()
+    if not root:
+        return None
+    return re.compile(_trie_pattern(root))
+
+
+class KemonoFilter():
+    """
+    Decides which Kemono files, posts and links are excluded. Built once
+    per run and shared, read only, by every thread.
+    """
+
+    def __init__(self, extensions: Iterable[str] = (), post_keywords: Iterable[str] = (),
+                 link_keywords: Iterable[str] = ()) -> None:
+        """
+        Args:
+            extensions (Iterable[str], optional): excluded file extensions,
+                with or without a leading '.'. Defaults to ().
+            post_keywords (Iterable[str], optional): keywords of excluded posts. Defaults to ().
+            link_keywords (Iterable[str], optional): keywords of excluded links. Defaults to ().
+        """
+        self.extensions = frozenset(ext.strip().lower().lstrip(".") for ext in extensions) - {""}
+        # Compound extensions such as 'tar.gz' need that many extra dots checked
+        self.__ext_dots = max((ext.count(".") for ext in self.extensions), default=0) + 1
+        self.__post = compile_keywords(post_keywords)
+        self.__link = compile_keywords(link_keywords)
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> "KemonoFilter":
+        """
+        Args:
+            settings (dict): dict returned by PandoraArgInterpretor.interpret
+
+        Returns:
+            KemonoFilter: filter of the Kemono exclude configs in settings
+        """
+        return cls(get_setting(settings, Config.KEMONO_EXCLUDE_FILE, ()),
+                   get_setting(settings, Config.KEMONO_EXCLUDE_POST, ()),
+                   get_setting(settings, Config.KEMONO_EXCLUDE_LINK, ()))
+
+    def excludes_file(self, name: str) -> bool:
+        """
+        Args:
+            name (str): file name, not a url
+
+        Returns:
+            bool: True if the file's extension is excluded
+        """
+        if not self.extensions:
+            return False
+        name = name.lower()
+        end = len(name)
+        for _ in range(self.__ext_dots):
+            dot = name.rfind(".", 0, end)
+            if dot <= 0:
+                return False
+            if name[dot + 1:] in self.extensions:
+                return True
+            end = dot
+        return False
+
+    def excludes_post(self, text: str) -> bool:
+        """
+        Args:
+            text (str): post title and content
+
+        Returns:
+            bool: True if text contains an excluded post keyword
+        """
+        return self.__post is not None and self.__post.search(text.lower()) is not None
+
+    def excludes_link(self, text: str) -> bool:
+        """
+        Args:
+            text (str): plain text of a link, not its target
+
+        Returns:
+            bool: True if text contains an excluded link keyword
+        """
+        return self.__link is not None and self.__link.search(text.lower()) is not None
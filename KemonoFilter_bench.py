@@ -0,0 +1,84 @@
+import random
+import re
+import sys
+import time
+from KemonoFilter import KemonoFilter
+"""
+Compares the compiled Kemono post filter with checking every keyword in
+turn and with a plain alternation regex, on generated post text.
+
+Run directly: python KemonoFilter_bench.py [keyword count] [post count]
+"""
+
+WORDS = ("art", "commission", "sketch", "patreon", "reward", "pose", "color", "line", "wip", "final",
+         "version", "pack", "high", "resolution", "thanks", "supporters", "month", "set", "bonus", "preview")
+
+
+def make_keywords(count: int, rng: random.Random) -> list[str]:
+    """
+    Returns:
+        list[str]: count lowercase keywords of one or two made up words
+    """
+    keywords = set()
+    while len(keywords) < count:
+        word = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 9)))
+        keywords.add(word if rng.random() < 0.7 else word + " " + rng.choice(WORDS))
+    return sorted(keywords)
+
+
+def make_posts(count: int, rng: random.Random) -> list[str]:
+    """
+    Returns:
+        list[str]: count posts of 20 to 200 common words
+    """
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 200))) for _ in range(count)]
+
+
+def naive(keywords: list[str]):
+    def excludes(text: str) -> bool:
+        text = text.lower()
+        for keyword in keywords:
+            if keyword in text:
+                return True
+        return False
+    return excludes
+
+
+def alternation(keywords: list[str]):
+    pattern = re.compile("|".join(map(re.escape, keywords)))
+    return lambda text: pattern.search(text.lower()) is not None
+
+
+def bench(name: str, excludes, posts: list[str]) -> int:
+    """
+    Runs a matcher over every post
+
+    Returns:
+        int: posts excluded
+    """
+    start = time.perf_counter()
+    excluded = sum(1 for post in posts if excludes(post))
+    elapsed = time.perf_counter() - start
+    print("{name:<12} {pps:12.0f} posts/s  {excluded} excluded".format(
+        name=name, pps=len(posts) / elapsed, excluded=excluded))
+    return excluded
+
+
+if __name__ == '__main__':
+    keyword_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    post_count = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    rng = random.Random(0)
+    keywords = make_keywords(keyword_count, rng)
+    posts = make_posts(post_count, rng)
+    # A few posts that are excluded
+    for i in range(0, post_count, 100):
+        posts[i] += " " + rng.choice(keywords)
+
+    start = time.perf_counter()
+    kfilter = KemonoFilter(post_keywords=keywords)
+    print("compiled {n} keywords in {ms:.1f}ms".format(n=keyword_count, ms=(time.perf_counter() - start) * 1000))
+    expected = bench("naive", naive(keywords), posts)
+    if keyword_count <= 1000:
+        # Backtracks through every keyword at every position, hopeless beyond this
+        assert bench("alternation", alternation(keywords), posts) == expected
+    assert bench("trie regex", kfilter.excludes_post, posts) == expected
@@ -0,0 +1,80 @@
+import logging
+import random
+import unittest
+import PandoraArgInterpretor
+from KemonoFilter import KemonoFilter, compile_keywords
+
+
+class KemonoFilterTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.INFO)
+
+    def test_from_settings(self):
+        """
+        Excludes are read from the command line
+        """
+        settings = PandoraArgInterpretor.interpret(['.py', '-d', './', '--kxfile', 'PNG, zip',
+                                                    '--kxpost', 'Patreon only, WIP', '--kxlink', 'mega'])
+        kfilter = KemonoFilter.from_settings(settings)
+
+        self.assertEqual(frozenset({"png", "zip"}), kfilter.extensions)
+        self.assertTrue(kfilter.excludes_post("New WIP sketches"))
+        self.assertTrue(kfilter.excludes_post("patreon ONLY reward"))
+        self.assertFalse(kfilter.excludes_post("Patreon reward"))
+        self.assertTrue(kfilter.excludes_link("MEGA folder"))
+        self.assertFalse(kfilter.excludes_link("Google drive"))
+
+    def test_no_excludes(self):
+        """
+        Nothing is excluded when no excludes are given
+        """
+        kfilter = KemonoFilter.from_settings(PandoraArgInterpretor.interpret(['.py', '-d', './']))
+
+        self.assertFalse(kfilter.excludes_file("a.png"))
+        self.assertFalse(kfilter.excludes_post("anything"))
+        self.assertFalse(kfilter.excludes_link("anything"))
+        self.assertIsNone(compile_keywords(["", " "]))
+
+    def test_files(self):
+        """
+        Extensions match the end of the name only, compound extensions work
+        """
+        kfilter = KemonoFilter([".PSD", "gz", "tar.xz", " "])
+
+        self.assertTrue(kfilter.excludes_file("Art.psd"))
+        self.assertTrue(kfilter.excludes_file("a.tar.gz"))
+        self.assertTrue(kfilter.excludes_file("a.b.tar.xz"))
+        self.assertFalse(kfilter.excludes_file("a.xz"))
+        self.assertFalse(kfilter.excludes_file("a.psd.png"))
+        self.assertFalse(kfilter.excludes_file(".psd"))
+        self.assertFalse(kfilter.excludes_file("psd"))
+
+    def test_special_characters(self):
+        """
+        Regex metacharacters in keywords are matched literally
+        """
+        kfilter = KemonoFilter(post_keywords=["c++", "a.b", "[wip]", "^", "x-y", "\\"])
+
+        for text in ("learning C++", "a.b", "[WIP] pose", "^_^", "x-y", "back\\slash"):
+            self.assertTrue(kfilter.excludes_post(text), text)
+        for text in ("c+", "axb", "wip", "x y", "slash"):
+            self.assertFalse(kfilter.excludes_post(text), text)
+
+    def test_matches_naive(self):
+        """
+        Compiled matcher agrees with checking every keyword in turn
+        """
+        rng = random.Random(3)
+        alphabet = "abcde .-"
+        keywords = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 5))) for _ in range(300)]
+        keywords = [k for k in keywords if k.strip()]
+        kfilter = KemonoFilter(post_keywords=keywords)
+        stripped = [k.strip() for k in keywords]
+        for _ in range(2000):
+            text = "".join(rng.choice(alphabet + "xyz") for _ in range(rng.randint(0, 12)))
+            self.assertEqual(any(k in text for k in stripped), kfilter.excludes_post(text), text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,303 @@
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from Journal import JOURNAL_SUFFIX, PART_SUFFIX
+from Services import Config, get_setting
+"""
+Decides where Kemono files are saved. Config.KEMONO_FILE_STRUCTURE picks
+the folders and Config.KEMONO_FNAME_TYPE the file names:
+
+    packed (0)   <creator>/<file>
+    partial (1)  <creator>/<post>/<file> for posts of several files,
+                 <creator>/<file> for posts of one
+    unpacked (2) <creator>/<post>/<file>
+
+The name template is compiled once into a format string. Every folder is
+created and listed once per run and then tracked in memory, placing a
+file already placed costs no system call. A folder holding
+Config.KEMONO_SHARD_SZ files continues in 'folder (2)', 'folder (3)', ...
+beside it so packed creators with 100k+ files never end up in a single
+folder.
+
+Every creator folder, shared by the files of many posts, keeps a MANIFEST
+of the post each of its names was given to. A file on disk, or a partial
+file, is only placed again for the post that owns it so the post resumes
+or replaces its own file. Other posts, and files without an owner, get a
+' (n)' suffix instead of overwriting it. New names are appended to the
+manifests by flush(), call it before the files placed start downloading.
+Post folders hold the files of one post and need no manifest.
+
+Usage:
+    layout = KemonoLayout.from_settings(settings)
+    fname = layout.place("patreon", "123", post_id, title, index, count, name)
+    layout.flush()
+    engine.submit(url, fname)
+"""
+
+PACKED = 0
+PARTIAL = 1
+UNPACKED = 2
+DEFAULT_FNAME_TYPE = "[server]"
+DEFAULT_SHARD_SZ = 10000
+# Template tokens and the format fields they compile to
+TOKENS = {"[#]": "{index}", "[server]": "{server}"}
+TOKEN = re.compile("|".join(map(re.escape, TOKENS)))
+# Characters not allowed in file names on some platform, and control characters
+UNSAFE = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+MAX_NAME_LEN = 150
+# Names given out in a creator folder and their posts, a json [post id, name] per line
+MANIFEST = ".layout" + JOURNAL_SUFFIX
+
+
+def sanitize(name: str) -> str:
+    """
+    Returns:
+        str: name made safe to use as a file or folder name anywhere
+    """
+    if name and len(name) <= MAX_NAME_LEN and UNSAFE.search(name) is None and name.strip().rstrip(". ") == name:
+        # Already safe, most names are
+        return name
+    name = UNSAFE.sub("_", name).strip().rstrip(". ")
+    if len(name) > MAX_NAME_LEN:
+        stem, ext = os.path.splitext(name)
+        ext = ext if len(ext) <= 16 else ""
+        name = stem[:MAX_NAME_LEN - len(ext)].rstrip(". ") + ext
+    return name or "_"
+
+
+def compile_fname_type(fname_type: str) -> str:
+    """
+    Compiles a Config.KEMONO_FNAME_TYPE template into a format string with
+    the fields index and server
+
+    Args:
+        fname_type (str): template, '[#] - [server]' for example
+
+    Raises:
+        ValueError: template has no token, every file would get the same name
+
+    Returns:
+        str: format string
+    """
+    parts = TOKEN.split(fname_type)
+    if len(parts) == 1:
+        raise ValueError("{switch} needs [#] or [server]".format(switch=Config.KEMONO_FNAME_TYPE.value[0][0]))
+    escaped = [part.replace("{", "{{").replace("}", "}}") for part in parts]
+    tokens = [TOKENS[token] for token in TOKEN.findall(fname_type)]
+    return "".join(escaped[i] + tokens[i] for i in range(len(tokens))) + escaped[-1]
+
+
+@dataclass
+class _Shard:
+    """
+    One folder of a _Folder, path relative to the download folder, the
+    names of the files in it and the post owning each name
+    """
+    path: str
+    names: set = field(default_factory=set)
+    owners: dict = field(default_factory=dict)
+
+
+@dataclass
+class _Folder:
+    """
+    Logical folder of the layout split into shards, assigned holds the
+    names given out this run
+    """
+    shards: list
+    assigned: set = field(default_factory=set)
+
+
+class KemonoLayout():
+    """
+    Places files of Kemono posts relative to the download folder, creating
+    their folders. Thread safe.
+    """
+
+    def __init__(self, folder: str, structure: int = PACKED, fname_type: str = DEFAULT_FNAME_TYPE,
+                 shard_sz: int = DEFAULT_SHARD_SZ) -> None:
+        """
+        Args:
+            folder (str): download folder, paths are relative to it
+            structure (int, optional): PACKED, PARTIAL or UNPACKED. Defaults to PACKED.
+            fname_type (str, optional): file name template. Defaults to DEFAULT_FNAME_TYPE.
+            shard_sz (int, optional): files per folder before the next shard,
+                0 for no limit. Defaults to DEFAULT_SHARD_SZ.
+
+        Raises:
+            ValueError: structure is unknown or fname_type has no token
+        """
+        if structure not in (PACKED, PARTIAL, UNPACKED):
+            raise ValueError("{switch} must be 0, 1 or 2".format(switch=Config.KEMONO_FILE_STRUCTURE.value[0][0]))
+        self.folder = folder
+        self.structure = structure
+        self.fname_format = compile_fname_type(fname_type)
+        self.shard_sz = shard_sz
+        # Folders created this run, makedirs is never repeated
+        self.created = set()
+        self.__folders = dict()
+        # Files of a post are placed one after the other, its folder is kept
+        self.__post = (None, None, None)
+        # Manifest lines of every shard not written yet
+        self.__unwritten = dict()
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> "KemonoLayout":
+        """
+        Args:
+            settings (dict): dict returned by PandoraArgInterpretor.interpret
+
+        Returns:
+            KemonoLayout: layout of the Kemono configs in settings
+        """
+        return cls(get_setting(settings, Config.DOWNLOAD_FOLDER),
+                   get_setting(settings, Config.KEMONO_FILE_STRUCTURE, PACKED),
+                   get_setting(settings, Config.KEMONO_FNAME_TYPE, DEFAULT_FNAME_TYPE),
+                   get_setting(settings, Config.KEMONO_SHARD_SZ, DEFAULT_SHARD_SZ))
+
+    def fname(self, index: int, server: str) -> str:
+        """
+        Args:
+            index (int): 1 based index of the file in its post
+            server (str): name of the file on the server
+
+        Returns:
+            str: file name from the template, with the extension of the server
+                name if the template left it out
+        """
+        name = self.fname_format.format(index=index, server=server)
+        ext = os.path.splitext(server)[1]
+        if ext and not name.lower().endswith(ext.lower()):
+            name += ext
+        return sanitize(name)
+
+    def place(self, service: str, creator: str, post_id: str, title: str, index: int, count: int,
+              server: str) -> str:
+        """
+        Decides the path of a file of a post and creates its folder
+
+        Args:
+            service (str): service of the creator
+            creator (str): creator id
+            post_id (str): post id
+            title (str): post title
+            index (int): 1 based index of the file in the post
+            count (int): files in the post
+            server (str): name of the file on the server
+
+        Returns:
+            str: path relative to the download folder
+        """
+        key = (service, creator, post_id, title, count > 1)
+        name = self.fname(index, server)
+        with self.__lock:
+            last, folder, owner = self.__post
+            if last != key:
+                folder = sanitize("{service}_{creator}".format(service=service, creator=creator))
+                owner = post_id
+                if self.structure == UNPACKED or (self.structure == PARTIAL and count > 1):
+                    post = "{post_id} {title}".format(post_id=post_id, title=title) if title else post_id
+                    folder = os.path.join(folder, sanitize(post))
+                    owner = None
+                self.__post = (key, folder, owner)
+            return self.__place(folder, name, owner)
+
+    def __place(self, path: str, name: str, owner: str | None) -> str:
+        """
+        Places name for the post owner in the logical folder path, None for
+        a post folder, lock must be held
+        """
+        folder = self.__folders.get(path)
+        if folder is None:
+            folder = self.__folders[path] = _Folder(self.__scan(path, owner is not None))
+        stem, ext = os.path.splitext(name)
+        n = 1
+        while True:
+            # Taken by another file of this run, or on disk for another post
+            if name not in folder.assigned:
+                shard = next((shard for shard in folder.shards if name in shard.names), None)
+                if shard is None or owner is None or shard.owners.get(name) == owner:
+                    break
+            n += 1
+            name = "{stem} ({n}){ext}".format(stem=stem, n=n, ext=ext)
+        folder.assigned.add(name)
+        if shard is not None:
+            return os.path.join(shard.path, name)
+        shard = folder.shards[-1]
+        if self.shard_sz and len(shard.names) >= self.shard_sz:
+            shard = _Shard("{path} ({n})".format(path=path, n=len(folder.shards) + 1))
+            self.__makedirs(shard.path)
+            folder.shards.append(shard)
+        shard.names.add(name)
+        if owner is not None:
+            shard.owners[name] = owner
+            self.__unwritten.setdefault(shard.path, list()).append(json.dumps([owner, name]) + "\n")
+        return os.path.join(shard.path, name)
+
+    def flush(self) -> None:
+        """
+        Appends the names placed since the last flush to their manifests
+        """
+        with self.__lock:
+            unwritten = self.__unwritten
+            self.__unwritten = dict()
+        for path, lines in unwritten.items():
+            with open(os.path.join(self.folder, path, MANIFEST), "a", encoding="utf-8") as fp:
+                fp.write("".join(lines))
+
+    def __scan(self, path: str, shared: bool) -> list[_Shard]:
+        """
+        Lists the shards of a logical folder already on disk and, if the
+        folder is shared by posts, their manifests. Creates the first shard
+        if there are none. Partial downloads count as their file.
+        """
+        shards = list()
+        while True:
+            shard_path = path if not shards else "{path} ({n})".format(path=path, n=len(shards) + 1)
+            try:
+                entries = os.listdir(os.path.join(self.folder, shard_path))
+            except FileNotFoundError:
+                break
+            self.created.add(shard_path)
+            names = set()
+            for entry in entries:
+                if entry.endswith(JOURNAL_SUFFIX):
+                    continue
+                names.add(entry[:-len(PART_SUFFIX)] if entry.endswith(PART_SUFFIX) else entry)
+            shards.append(_Shard(shard_path, names, self.__owners(shard_path) if shared else dict()))
+        if not shards:
+            self.__makedirs(path)
+            shards.append(_Shard(path))
+        return shards
+
+    def __owners(self, path: str) -> dict:
+        """
+        Reads the manifest of a shard, later lines win
+
+        Returns:
+            dict: post owning each name of the shard
+        """
+        owners = dict()
+        try:
+            with open(os.path.join(self.folder, path, MANIFEST), "r", encoding="utf-8") as fp:
+                for line in fp:
+                    try:
+                        owner, name = json.loads(line)
+                    except (ValueError, TypeError):
+                        # Line cut short by a crash
+                        continue
+                    owners[name] = owner
+        except FileNotFoundError:
+            pass
+        return owners
+
+    def __makedirs(self, path: str) -> None:
+        """
+        Creates a folder relative to the download folder unless this run already did
+        """
+        if path not in self.created:
+            os.makedirs(os.path.join(self.folder, path), exist_ok=True)
+            self.created.add(path)
@@ -0,0 +1,47 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+from KemonoLayout import UNPACKED, KemonoLayout, sanitize
+"""
+Compares placing Kemono files with a KemonoLayout against substituting
+the name template and calling makedirs and exists for every file.
+
+Run directly: python KemonoLayout_bench.py [post count] [files per post]
+"""
+
+
+def naive(folder: str, posts: int, files: int) -> None:
+    for post in range(posts):
+        for index in range(1, files + 1):
+            name = "[#] - [server]".replace("[#]", str(index)).replace("[server]", "{i}.png".format(i=index))
+            path = os.path.join(folder, "patreon_7", sanitize("{post} title".format(post=post)))
+            os.makedirs(path, exist_ok=True)
+            os.path.exists(os.path.join(path, name))
+
+
+def layout(folder: str, posts: int, files: int) -> None:
+    placer = KemonoLayout(folder, UNPACKED, "[#] - [server]")
+    for post in range(posts):
+        for index in range(1, files + 1):
+            placer.place("patreon", "7", str(post), "title", index, files, "{i}.png".format(i=index))
+        placer.flush()
+
+
+def bench(name: str, place, posts: int, files: int) -> None:
+    folder = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        place(folder, posts, files)
+        elapsed = time.perf_counter() - start
+        print("{name:<8} {fps:10.0f} files/s".format(name=name, fps=posts * files / elapsed))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    posts = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    bench("naive", naive, posts, files)
+    bench("layout", layout, posts, files)
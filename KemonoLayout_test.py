@@ -0,0 +1,142 @@
+import logging
+import os
+import tempfile
+import unittest
+import PandoraArgInterpretor
+from KemonoLayout import PACKED, PARTIAL, UNPACKED, KemonoLayout, compile_fname_type, sanitize
+
+
+class KemonoLayoutTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """
+        Creates a scratch download folder
+        """
+        logging.basicConfig(level=logging.INFO)
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def touch(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.join(self.tmp.name, path)), exist_ok=True)
+        open(os.path.join(self.tmp.name, path), 'wb').close()
+
+    def test_fname_type(self):
+        """
+        Tokens are compiled once, literal braces survive
+        """
+        self.assertEqual("{index} - {server}", compile_fname_type("[#] - [server]"))
+        self.assertEqual("{{x}}{index}", compile_fname_type("{x}[#]"))
+        with self.assertRaises(ValueError):
+            compile_fname_type("static")
+
+        layout = KemonoLayout(self.tmp.name, fname_type="[#]")
+        self.assertEqual("3.png", layout.fname(3, "art.png"))
+        layout = KemonoLayout(self.tmp.name, fname_type="{[#]} [server]")
+        self.assertEqual("{3} art.png", layout.fname(3, "art.png"))
+
+    def test_sanitize(self):
+        self.assertEqual("a_b_c", sanitize('a/b:c'))
+        self.assertEqual("name", sanitize(" name. "))
+        self.assertEqual("_", sanitize(".."))
+        self.assertTrue(sanitize("x" * 300 + ".png").endswith("x.png"))
+        self.assertEqual(150, len(sanitize("x" * 300 + ".png")))
+
+    def test_structures(self):
+        """
+        Posts of several files get a folder when partially unpacked, every
+        post does when unpacked
+        """
+        expected = {PACKED: ("patreon_7/a.png", "patreon_7/b.png"),
+                    PARTIAL: ("patreon_7/a.png", os.path.join("patreon_7", "2 Title_2", "b.png")),
+                    UNPACKED: (os.path.join("patreon_7", "1", "a.png"), os.path.join("patreon_7", "2 Title_2", "b.png"))}
+        for structure, (single, several) in expected.items():
+            with tempfile.TemporaryDirectory() as tmp:
+                layout = KemonoLayout(tmp, structure)
+
+                self.assertEqual(single, layout.place("patreon", "7", "1", "", 1, 1, "a.png"))
+                self.assertEqual(several, layout.place("patreon", "7", "2", "Title/2", 1, 2, "b.png"))
+                self.assertTrue(os.path.isdir(os.path.join(tmp, os.path.dirname(several))))
+
+    def test_collisions(self):
+        """
+        Files of one run never share a path, files on disk of no post are never replaced
+        """
+        self.touch("patreon_7/a.png")
+        layout = KemonoLayout(self.tmp.name)
+        paths = [layout.place("patreon", "7", str(i), "", 1, 1, "a.png") for i in range(3)]
+
+        self.assertEqual(["patreon_7/a (2).png", "patreon_7/a (3).png", "patreon_7/a (4).png"], paths)
+
+    def test_collisions_across_runs(self):
+        """
+        A later run places a post's files where it did before and never over
+        the file of another post
+        """
+        first = KemonoLayout(self.tmp.name)
+        self.assertEqual("patreon_7/1.png", first.place("patreon", "7", "100", "", 1, 2, "1.png"))
+        self.assertEqual("patreon_7/1 (2).png", first.place("patreon", "7", "100", "", 1, 2, "1.png"))
+        first.flush()
+        self.touch("patreon_7/1.png")
+        self.touch("patreon_7/1 (2).png.part")
+
+        second = KemonoLayout(self.tmp.name)
+        self.assertEqual("patreon_7/1 (3).png", second.place("patreon", "7", "200", "", 1, 1, "1.png"))
+        self.assertEqual("patreon_7/1.png", second.place("patreon", "7", "100", "", 1, 2, "1.png"))
+        # Resumes its partial file
+        self.assertEqual("patreon_7/1 (2).png", second.place("patreon", "7", "100", "", 1, 2, "1.png"))
+        second.flush()
+        self.touch("patreon_7/1 (3).png")
+
+        third = KemonoLayout(self.tmp.name)
+        self.assertEqual("patreon_7/1 (3).png", third.place("patreon", "7", "200", "", 1, 1, "1.png"))
+        self.assertEqual("patreon_7/1 (4).png", third.place("patreon", "7", "300", "", 1, 1, "1.png"))
+
+    def test_sharding(self):
+        """
+        Full folders continue beside themselves, across runs too
+        """
+        layout = KemonoLayout(self.tmp.name, shard_sz=3)
+        paths = [layout.place("patreon", "7", str(i), "", 1, 1, "{i}.png".format(i=i)) for i in range(7)]
+        self.assertEqual(["patreon_7", "patreon_7", "patreon_7", "patreon_7 (2)", "patreon_7 (2)", "patreon_7 (2)",
+                          "patreon_7 (3)"], [os.path.dirname(path) for path in paths])
+        for path in paths:
+            self.touch(path)
+        layout.flush()
+
+        layout = KemonoLayout(self.tmp.name, shard_sz=3)
+        # Known files stay, new ones fill the last shard
+        self.assertEqual("patreon_7 (2)/4.png", layout.place("patreon", "7", "4", "", 1, 1, "4.png"))
+        self.assertEqual("patreon_7 (3)/7.png", layout.place("patreon", "7", "7", "", 1, 1, "7.png"))
+        self.assertEqual("patreon_7 (3)/8.png", layout.place("patreon", "7", "8", "", 1, 1, "8.png"))
+        layout.flush()
+        self.touch("patreon_7 (3)/7.png")
+        self.touch("patreon_7 (3)/8.png.part")
+
+        layout = KemonoLayout(self.tmp.name, shard_sz=3)
+        self.assertEqual("patreon_7 (3)/8.png", layout.place("patreon", "7", "8", "", 1, 1, "8.png"))
+        self.assertEqual("patreon_7 (4)/9.png", layout.place("patreon", "7", "9", "", 1, 1, "9.png"))
+
+    def test_dir_cache(self):
+        """
+        Each folder is created once per run
+        """
+        layout = KemonoLayout(self.tmp.name, UNPACKED)
+        for i in range(10):
+            layout.place("patreon", "7", "1", "", i, 10, "{i}.png".format(i=i))
+
+        self.assertEqual({os.path.join("patreon_7", "1")}, layout.created)
+
+    def test_from_settings(self):
+        settings = PandoraArgInterpretor.interpret(['.py', '-d', self.tmp.name, '--kfstructure', '2',
+                                                    '--kxftype', '[#] - [server]', '--kshard', '0'])
+        layout = KemonoLayout.from_settings(settings)
+
+        self.assertEqual((UNPACKED, "{index} - {server}", 0), (layout.structure, layout.fname_format, layout.shard_sz))
+        with self.assertRaises(ValueError):
+            KemonoLayout(self.tmp.name, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,337 @@
+import collections
+import concurrent.futures
+import html.parser
+import json
+import multiprocessing
+import threading
+import time
+import urllib.parse
+from typing import Iterator, NamedTuple
+from KemonoFilter import KemonoFilter
+from Metrics import Metrics
+"""
+Turns Kemono listing pages into the links of their posts. Post content is
+HTML and parsing it in pure Python holds the GIL, so a ParserStage runs
+it in worker processes in batches of pages while the calling thread and
+the download threads only do I/O.
+
+Every post yields its files (the post file, attachments and images
+embedded in its content) and the links of its content, with the Kemono
+excludes applied.
+
+Usage:
+    parser = ParserStage(KemonoFilter.from_settings(settings))
+    for body, count in listing.pages():
+        parser.submit(site, body, count)
+        for record in parser.ready():
+            ...
+    for record in parser.drain():
+        ...
+"""
+
+# Pages sent to a worker process at a time, amortizes the IPC per page
+BATCH_SZ = 8
+FILE = "file"
+LINK = "link"
+# Filter of a worker process, set once when the worker starts
+_worker_filter = None
+
+
+class LinkRecord(NamedTuple):
+    """
+    A file or link of a post. A plain tuple so batches of them pickle
+    small and fast on their way back from the workers.
+
+    post_id: id of the post
+    kind: FILE for files on the site to download, LINK for any other link
+    url: absolute url
+    name: file name for FILE, link text for LINK
+    title: title of the post
+    """
+    post_id: str
+    kind: str
+    url: str
+    name: str
+    title: str = ""
+
+
+class _ContentParser(html.parser.HTMLParser):
+    """
+    Collects the '<a>' targets with their text and the '<img>' sources of post content
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        # (url, text) of every link and image in order, images have no text
+        self.links = list()
+        self.__href = None
+        self.__text = list()
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if tag == "a":
+            self.__end_link()
+            self.__href = dict(attrs).get("href")
+        elif tag == "img":
+            src = dict(attrs).get("src")
+            if src:
+                self.links.append((src, ""))
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "a":
+            self.__end_link()
+
+    def handle_data(self, data: str) -> None:
+        if self.__href is not None:
+            self.__text.append(data)
+
+    def close(self) -> None:
+        super().close()
+        self.__end_link()
+
+    def __end_link(self) -> None:
+        if self.__href:
+            self.links.append((self.__href, " ".join("".join(self.__text).split())))
+        self.__href = None
+        self.__text.clear()
+
+
+def file_url(site: str, path: str, name: str) -> str:
+    """
+    Args:
+        site (str): scheme and host
+        path (str): path of the file, starting with '/data/'
+        name (str): name to save the file as
+
+    Returns:
+        str: url of a Kemono data file saved as name
+    """
+    return "{site}{path}?f={name}".format(site=site, path=path, name=urllib.parse.quote(name))
+
+
+def parse_post(site: str, post: dict, kfilter: KemonoFilter) -> list[LinkRecord]:
+    """
+    Args:
+        site (str): scheme and host the post was listed on
+        post (dict): post of a listing page
+        kfilter (KemonoFilter): excludes to apply
+
+    Returns:
+        list[LinkRecord]: files and links of post, nothing if the post is excluded
+    """
+    title = post.get("title") or ""
+    content = post.get("content") or ""
+    if kfilter.excludes_post(title + "\n" + content):
+        return list()
+    post_id = str(post.get("id"))
+    records = list()
+    seen = set()
+    host = urllib.parse.urlsplit(site).netloc
+
+    def add_file(path: str, name: str) -> None:
+        # Post JSON leaves out the '/data' content links have
+        if not path.startswith("/data/"):
+            path = "/data" + path
+        if path in seen:
+            return
+        seen.add(path)
+        name = name or path.rsplit("/", 1)[-1]
+        if not kfilter.excludes_file(name):
+            records.append(LinkRecord(post_id, FILE, file_url(site, path, name), name, title))
+
+    # The post file is usually also its first attachment
+    for file in [post.get("file")] + list(post.get("attachments") or ()):
+        if file and file.get("path"):
+            add_file(file["path"], file.get("name") or "")
+
+    if "<" in content:
+        parser = _ContentParser()
+        parser.feed(content)
+        parser.close()
+        for href, text in parser.links:
+            url = urllib.parse.urljoin(site + "/", href)
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme not in ("http", "https"):
+                continue
+            if parts.path.startswith("/data/") and (parts.netloc == host or parts.netloc.endswith("." + host)):
+                query = urllib.parse.parse_qs(parts.query)
+                add_file(parts.path, query.get("f", [""])[0])
+            elif text and url not in seen and not kfilter.excludes_link(text):
+                seen.add(url)
+                records.append(LinkRecord(post_id, LINK, url, text, title))
+    return records
+
+
+def parse_pages(kfilter: KemonoFilter, pages: list[tuple[str, bytes, int]]) -> list[LinkRecord]:
+    """
+    Parses a batch of listing pages. Runs in the stage's worker processes.
+
+    Args:
+        kfilter (KemonoFilter): excludes to apply
+        pages (list[tuple[str, bytes, int]]): site, body and count of new
+            posts of every page, see CreatorListing.pages
+
+    Returns:
+        list[LinkRecord]: records of every new post, in listing order
+    """
+    records = list()
+    for site, body, count in pages:
+        for post in json.loads(body)[:count]:
+            records.extend(parse_post(site, post, kfilter))
+    return records
+
+
+def _init_worker(kfilter: KemonoFilter) -> None:
+    global _worker_filter
+    _worker_filter = kfilter
+
+
+def _parse_batch(pages: list[tuple[str, bytes, int]],
+                 kfilter: KemonoFilter | None = None) -> tuple[float, list[LinkRecord]]:
+    """
+    Returns:
+        tuple[float, list[LinkRecord]]: seconds spent parsing and records of
+            the pages, with the worker's filter unless kfilter is given
+    """
+    start = time.perf_counter()
+    records = parse_pages(_worker_filter if kfilter is None else kfilter, pages)
+    return time.perf_counter() - start, records
+
+
+class ParserStage():
+    """
+    Parses listing pages in a pool of worker processes, BATCH_SZ pages at
+    a time. The pool is started with the first full batch, so a run
+    listing a handful of pages parses them in process instead of paying
+    for the workers' start up. Records come back in submission order.
+    submit() blocks while max_bytes of pages wait in the pool. Thread safe.
+    """
+
+    def __init__(self, kfilter: KemonoFilter, workers: int | None = None, batch_sz: int = BATCH_SZ,
+                 metrics: Metrics | None = None, max_bytes: int | None = None) -> None:
+        """
+        Args:
+            kfilter (KemonoFilter): excludes to apply, sent once to every worker
+            workers (int | None, optional): parser processes, 0 to parse in the
+                calling thread. Defaults to None for one per CPU.
+            batch_sz (int, optional): pages per batch. Defaults to BATCH_SZ.
+            metrics (Metrics | None, optional): records parse times and the
+                batches waiting. Defaults to None for a private Metrics.
+            max_bytes (int | None, optional): bytes of pages in the pool before
+                submit blocks, None for no limit. Defaults to None.
+        """
+        self.filter = kfilter
+        self.workers = workers
+        self.batch_sz = batch_sz
+        self.max_bytes = max_bytes
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.__executor = None
+        self.__batch = list()
+        # Futures, or (seconds, records) parsed in process, in submission order
+        self.__pending = collections.deque()
+        # Futures of the pool and the bytes of their pages, until parsed
+        self.__parsing = dict()
+        self.__lock = threading.Lock()
+        self.metrics.gauge("queue_depth", self.__len__, stage="parse")
+
+    def __len__(self) -> int:
+        """
+        Returns:
+            int: batches submitted and not returned yet
+        """
+        with self.__lock:
+            return len(self.__pending) + (1 if self.__batch else 0)
+
+    def submit(self, site: str, body: bytes, count: int | None = None) -> None:
+        """
+        Queues a listing page for parsing
+
+        Args:
+            site (str): scheme and host the page was listed on
+            body (bytes): page body, a JSON list of posts
+            count (int | None, optional): leading posts to parse. Defaults to None for all.
+        """
+        with self.__lock:
+            self.__batch.append((site, body, count))
+            if len(self.__batch) >= self.batch_sz:
+                self.__flush(pool=True)
+        if self.max_bytes is not None:
+            self.__wait_room()
+
+    def ready(self) -> Iterator[LinkRecord]:
+        """
+        Yields the records of the batches already parsed, without waiting
+        """
+        while True:
+            with self.__lock:
+                if not self.__pending or not (isinstance(self.__pending[0], tuple) or self.__pending[0].done()):
+                    return
+                batch = self.__pending.popleft()
+            yield from self.__records(batch)
+
+    def drain(self) -> Iterator[LinkRecord]:
+        """
+        Parses the pages still queued and yields every record not yet
+        returned by ready(), waiting for the workers
+        """
+        with self.__lock:
+            self.__flush(pool=False)
+        while True:
+            with self.__lock:
+                if not self.__pending:
+                    return
+                batch = self.__pending.popleft()
+            yield from self.__records(batch)
+
+    def close(self) -> None:
+        """
+        Stops the worker processes
+        """
+        with self.__lock:
+            executor = self.__executor
+            self.__executor = None
+        if executor:
+            executor.shutdown(wait=True)
+
+    def __records(self, batch: tuple | concurrent.futures.Future) -> list[LinkRecord]:
+        """
+        Records of a parsed batch, waiting for it if it is still in the pool
+        """
+        seconds, records = batch if isinstance(batch, tuple) else batch.result()
+        self.metrics.observe("parse_seconds", seconds)
+        self.metrics.inc("stage_seconds_total", seconds, stage="parse")
+        return records
+
+    def __flush(self, pool: bool) -> None:
+        """
+        Sends the current batch to the pool, or parses it in process when the
+        pool is not running and not wanted, lock must be held
+        """
+        if not self.__batch:
+            return
+        batch = self.__batch
+        self.__batch = list()
+        if self.workers == 0 or (not pool and self.__executor is None):
+            self.__pending.append(_parse_batch(batch, self.filter))
+            return
+        if self.__executor is None:
+            # Download threads are running, fork could copy a held lock
+            self.__executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker, initargs=(self.filter,))
+        future = self.__executor.submit(_parse_batch, batch)
+        self.__parsing[future] = sum(len(body) for _, body, _ in batch)
+        self.__pending.append(future)
+
+    def __wait_room(self) -> None:
+        """
+        Waits for the pool to parse pages until at most max_bytes wait in it,
+        the batch of a lone oversized page is let through
+        """
+        while True:
+            with self.__lock:
+                for future in [future for future in self.__parsing if future.done()]:
+                    del self.__parsing[future]
+                if len(self.__parsing) < 2 or sum(self.__parsing.values()) <= self.max_bytes:
+                    return
+                parsing = list(self.__parsing)
+            concurrent.futures.wait(parsing, return_when=concurrent.futures.FIRST_COMPLETED)
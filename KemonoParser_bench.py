@@ -0,0 +1,73 @@
+import json
+import os
+import random
+import sys
+import time
+from KemonoFilter import KemonoFilter
+from KemonoFilter_bench import WORDS, make_keywords
+from KemonoParser import ParserStage, parse_pages
+"""
+Compares parsing Kemono listing pages in the calling thread with a
+ParserStage pool, on generated pages of HTML heavy posts.
+
+Run directly: python KemonoParser_bench.py [page count] [workers]
+"""
+
+
+def make_page(rng: random.Random, first: int) -> bytes:
+    """
+    Returns:
+        bytes: listing page of 50 posts with a few paragraphs, links and images each
+    """
+    posts = list()
+    for i in range(first, first + 50):
+        paragraphs = list()
+        for _ in range(rng.randint(5, 30)):
+            words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 60)))
+            if rng.random() < 0.2:
+                words += ' <a href="https://mega.nz/{n}">{w} link</a>'.format(n=rng.random(), w=rng.choice(WORDS))
+            if rng.random() < 0.2:
+                words += ' <img src="/data/aa/bb/{n:064x}.jpg">'.format(n=rng.getrandbits(256))
+            paragraphs.append("<p>" + words + "</p>")
+        file = {"name": "{i}.png".format(i=i), "path": "/cc/dd/{n:064x}.png".format(n=rng.getrandbits(256))}
+        posts.append({"id": str(i), "title": "post {i}".format(i=i), "content": "".join(paragraphs),
+                      "file": file, "attachments": [file]})
+    return json.dumps(posts).encode()
+
+
+def bench(name: str, parse, pages: list[bytes]) -> int:
+    """
+    Returns:
+        int: records parsed
+    """
+    start = time.perf_counter()
+    records = parse(pages)
+    elapsed = time.perf_counter() - start
+    print("{name:<12} {pps:10.1f} pages/s  {n} records".format(name=name, pps=len(pages) / elapsed, n=records))
+    return records
+
+
+def pooled(kfilter: KemonoFilter, workers: int):
+    def parse(pages: list[bytes]) -> int:
+        stage = ParserStage(kfilter, workers)
+        records = 0
+        for body in pages:
+            stage.submit("https://kemono.su", body)
+            records += sum(1 for _ in stage.ready())
+        records += sum(1 for _ in stage.drain())
+        stage.close()
+        return records
+    return parse
+
+
+if __name__ == '__main__':
+    page_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    rng = random.Random(0)
+    pages = [make_page(rng, i * 50) for i in range(page_count)]
+    kfilter = KemonoFilter(["psd"], make_keywords(200, rng), ["patreon"])
+
+    expected = bench("in thread", lambda p: len(parse_pages(kfilter, [("https://kemono.su", b, None) for b in p])),
+                     pages)
+    # Includes starting the workers
+    assert bench("{n} workers".format(n=workers), pooled(kfilter, workers), pages) == expected
@@ -0,0 +1,102 @@
+import json
+import logging
+import unittest
+from KemonoFilter import KemonoFilter
+from KemonoParser import FILE, LINK, LinkRecord, ParserStage, parse_pages, parse_post
+
+SITE = "https://kemono.su"
+
+
+def make_post(i: int, content: str = "", title: str = "") -> dict:
+    file = {"name": "{i}.png".format(i=i), "path": "/ab/cd/{i:064x}.png".format(i=i)}
+    return {"id": str(i), "title": title, "content": content, "file": file,
+            "attachments": [file, {"name": "{i}.zip".format(i=i), "path": "/ef/01/{i:064x}.zip".format(i=i)}]}
+
+
+class KemonoParserTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.INFO)
+
+    def test_files(self):
+        """
+        Post file and attachments are files, the duplicate post file once
+        """
+        records = parse_post(SITE, make_post(1), KemonoFilter())
+
+        self.assertEqual([LinkRecord("1", FILE, SITE + "/data/ab/cd/{h:064x}.png?f=1.png".format(h=1), "1.png"),
+                          LinkRecord("1", FILE, SITE + "/data/ef/01/{h:064x}.zip?f=1.zip".format(h=1), "1.zip")],
+                         records)
+
+    def test_content(self):
+        """
+        Content links are links, content images on the site are files
+        """
+        content = ('<p><a href="https://mega.nz/x">MEGA <b>folder</b></a></p>'
+                   '<p><a href="https://drive.google.com/y">Drive</a> <a href="https://mega.nz/x">again</a></p>'
+                   '<img src="/data/12/34/inline.jpg?f=Inline%20art.jpg"><img src="https://other.com/a.jpg">'
+                   '<a href="javascript:void(0)">js</a><a href="/data/ab/cd/{h:064x}.png">same file</a>'
+                   ).format(h=1)
+        records = parse_post(SITE, make_post(1, content), KemonoFilter(link_keywords=["drive"]))
+
+        self.assertEqual([(FILE, "1.png"), (FILE, "1.zip"), (LINK, "MEGA folder"), (FILE, "Inline art.jpg")],
+                         [(r.kind, r.name) for r in records])
+        self.assertEqual(SITE + "/data/12/34/inline.jpg?f=Inline%20art.jpg", records[3].url)
+
+    def test_excludes(self):
+        """
+        Excluded posts yield nothing, excluded extensions are dropped
+        """
+        kfilter = KemonoFilter(extensions=["zip"], post_keywords=["wip"])
+
+        self.assertEqual([], parse_post(SITE, make_post(1, title="WIP"), kfilter))
+        self.assertEqual(["1.png"], [r.name for r in parse_post(SITE, make_post(1), kfilter)])
+
+    def test_pages(self):
+        """
+        Only the leading new posts of a page are parsed
+        """
+        body = json.dumps([make_post(3), make_post(2), make_post(1)]).encode()
+
+        self.assertEqual(["3", "3", "2", "2"], [r.post_id for r in parse_pages(KemonoFilter(), [(SITE, body, 2)])])
+
+    def test_stage(self):
+        """
+        Pool parses batches and returns records in submission order
+        """
+        pages = [json.dumps([make_post(i * 2 + 1), make_post(i * 2)]).encode() for i in range(5)]
+        expected = parse_pages(KemonoFilter(["zip"]), [(SITE, body, None) for body in pages])
+        for workers in (0, 2):
+            stage = ParserStage(KemonoFilter(["zip"]), workers, batch_sz=2)
+            records = list()
+            for body in pages:
+                stage.submit(SITE, body)
+                records.extend(stage.ready())
+            records.extend(stage.drain())
+            stage.close()
+
+            self.assertEqual(expected, records)
+            self.assertEqual([], list(stage.drain()))
+            # Batches of 2, 2 and 1 page
+            self.assertEqual(3, stage.metrics.histogram("parse_seconds").count)
+            self.assertEqual(0, len(stage))
+
+    def test_stage_max_bytes(self):
+        """
+        Submit blocks until the pool parsed all but max_bytes of the pages
+        """
+        pages = [json.dumps([make_post(i)]).encode() for i in range(6)]
+        stage = ParserStage(KemonoFilter(), 1, batch_sz=1, max_bytes=len(pages[0]))
+        records = list()
+        for body in pages:
+            stage.submit(SITE, body)
+            self.assertLessEqual(len(stage), 2)
+            records.extend(stage.ready())
+        records.extend(stage.drain())
+        stage.close()
+
+        self.assertEqual(parse_pages(KemonoFilter(), [(SITE, body, None) for body in pages]), records)
+
+
+if __name__ == '__main__':
+    unittest.main()
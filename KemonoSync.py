@@ -0,0 +1,215 @@
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterator
+"""
+Incremental listing of Kemono creators. The sqlite database given by
+Config.KEMONO_SYNC keeps, per creator, the newest post seen and the ETag
+of every listing page. A re-run asks for the first page with
+'If-None-Match' and stops paginating at the first post it already knows,
+so an unchanged creator costs a single 304.
+
+The new state of a creator is only saved once its posts were handled,
+see KemonoComponent.finish, so a failed run lists the same posts again.
+
+Usage:
+    store = SyncStore("kemono.db")
+    listing = CreatorListing(request, site, service, creator, store.get(service, creator))
+    for post in listing:
+        ...
+    store.put(listing.state)
+"""
+
+# Posts per listing page, the '?o=' offset steps by this
+PAGE_SZ = 50
+
+
+@dataclass
+class CreatorState:
+    """
+    What a creator had posted when last synced
+
+    service: service the creator is on, 'patreon' for example
+    creator: creator id
+    last_id: id of the newest post, None if the creator had no posts
+    last_published: publish time of the newest post, ISO 8601
+    etags: listing page offset -> ETag the page was served with
+    """
+    service: str
+    creator: str
+    last_id: str | None = None
+    last_published: str | None = None
+    etags: dict[int, str] = field(default_factory=dict)
+
+    def knows(self, post: dict) -> bool:
+        """
+        Args:
+            post (dict): post of a listing page
+
+        Returns:
+            bool: True if post is the newest post seen or older than it
+        """
+        if self.last_id is not None and str(post.get("id")) == self.last_id:
+            return True
+        published = get_published(post)
+        return bool(published and self.last_published and published < self.last_published)
+
+
+def get_published(post: dict) -> str | None:
+    """
+    Returns:
+        str | None: publish time of post, when it was imported if it has
+            none. ISO 8601 strings so they compare in time order.
+    """
+    return post.get("published") or post.get("added")
+
+
+class SyncStore():
+    """
+    Thread safe sqlite store of CreatorState, one row per creator
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+            path (str): database file, created if it does not exist
+        """
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        with self.__lock, self.__db:
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__db.execute("CREATE TABLE IF NOT EXISTS creators (service TEXT, creator TEXT, last_id TEXT, "
+                              "last_published TEXT, etags TEXT, stamp REAL, PRIMARY KEY (service, creator))")
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return self.__db.execute("SELECT COUNT(*) FROM creators").fetchone()[0]
+
+    def get(self, service: str, creator: str) -> CreatorState | None:
+        """
+        Returns:
+            CreatorState | None: state of the creator, None if never synced
+        """
+        with self.__lock:
+            row = self.__db.execute("SELECT last_id, last_published, etags FROM creators "
+                                    "WHERE service = ? AND creator = ?", (service, creator)).fetchone()
+        if row is None:
+            return None
+        etags = {int(offset): etag for offset, etag in json.loads(row[2] or "{}").items()}
+        return CreatorState(service, creator, row[0], row[1], etags)
+
+    def put(self, state: CreatorState) -> None:
+        """
+        Saves the state of a creator, replacing the previous one
+        """
+        with self.__lock, self.__db:
+            self.__db.execute("INSERT OR REPLACE INTO creators VALUES (?, ?, ?, ?, ?, ?)",
+                              (state.service, state.creator, state.last_id, state.last_published,
+                               json.dumps(state.etags), time.time()))
+
+    def close(self) -> None:
+        """
+        Closes the database
+        """
+        with self.__lock:
+            self.__db.close()
+
+
+# request(url, headers) -> (status, response headers, body)
+Request = Callable[[str, dict], tuple[int, dict, bytes]]
+
+
+class CreatorListing():
+    """
+    Iterates the posts of a creator newest first, only the posts not seen
+    by the previous sync unless full is set. Once iterated, state is what
+    to save for the next sync.
+    """
+
+    def __init__(self, request: Request, site: str, service: str, creator: str,
+                 previous: CreatorState | None = None, full: bool = False) -> None:
+        """
+        Args:
+            request (Request): sends a GET, response headers keyed in lowercase
+            site (str): scheme and host, 'https://kemono.su' for example
+            service (str): service the creator is on
+            creator (str): creator id
+            previous (CreatorState | None, optional): state of the previous
+                sync. Defaults to None to list every post.
+            full (bool, optional): list every page, pages whose ETag did not
+                change are skipped. Defaults to False.
+        """
+        self.request = request
+        self.url = "{site}/api/v1/{service}/user/{creator}".format(site=site, service=service, creator=creator)
+        self.previous = previous
+        self.full = full
+        self.state = CreatorState(service, creator)
+        if previous is not None:
+            self.state.last_id = previous.last_id
+            self.state.last_published = previous.last_published
+            self.state.etags = dict(previous.etags)
+        # Requests made and pages the server answered with 304
+        self.pages_listed = 0
+        self.unchanged = 0
+
+    def __iter__(self) -> Iterator[dict]:
+        for body, count in self.pages():
+            yield from json.loads(body)[:count]
+
+    def pages(self) -> Iterator[tuple[bytes, int]]:
+        """
+        Iterates the listing pages that hold new posts, the posts are left
+        for the caller to decode again so parsing them can happen elsewhere,
+        see KemonoParser.py.
+
+        Raises:
+            ConnectionError: a listing request failed
+
+        Yields:
+            tuple[bytes, int]: page body, a JSON list of posts, and how many
+                of its leading posts are new
+        """
+        etags = self.previous.etags if self.previous is not None else dict()
+        last_offset = max(etags, default=0)
+        offset = 0
+        while True:
+            headers = {"Accept": "application/json"}
+            if offset in etags:
+                headers["If-None-Match"] = etags[offset]
+            status, response_headers, body = self.request("{url}?o={o}".format(url=self.url, o=offset), headers)
+            self.pages_listed += 1
+            if status == 304:
+                self.unchanged += 1
+                # An unchanged first page means nothing was posted since
+                if not self.full or offset >= last_offset:
+                    return
+                offset += PAGE_SZ
+                continue
+            if status != 200:
+                raise ConnectionError("HTTP {status} listing {url}".format(status=status, url=self.url))
+
+            posts = json.loads(body)
+            etag = response_headers.get("etag")
+            if etag:
+                self.state.etags[offset] = etag
+            else:
+                self.state.etags.pop(offset, None)
+            if offset == 0 and posts:
+                self.state.last_id = str(posts[0].get("id"))
+                self.state.last_published = get_published(posts[0])
+            count = len(posts)
+            if not self.full and self.previous is not None:
+                count = next((i for i, post in enumerate(posts) if self.previous.knows(post)), count)
+            if count:
+                yield body, count
+            if count < len(posts):
+                return
+            if len(posts) < PAGE_SZ:
+                # Pages past the end from an earlier sync are gone
+                for stale in [o for o in self.state.etags if o > offset]:
+                    del self.state.etags[stale]
+                return
+            offset += PAGE_SZ
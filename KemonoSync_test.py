@@ -0,0 +1,146 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import unittest
+from KemonoSync import PAGE_SZ, CreatorListing, CreatorState, SyncStore
+
+
+def make_posts(first: int, last: int) -> list[dict]:
+    """
+    Returns:
+        list[dict]: posts with ids last down to first, newest first
+    """
+    return [{"id": str(i), "title": "post {i}".format(i=i), "published": "2024-01-01T00:{i:05d}".format(i=i)}
+            for i in range(last, first - 1, -1)]
+
+
+class _Listing():
+    """
+    Serves the listing pages of one creator the way the Kemono API does
+    """
+
+    def __init__(self, posts: list[dict]) -> None:
+        self.posts = posts
+        # (offset, If-None-Match) of every request
+        self.requests = list()
+
+    def __call__(self, url: str, headers: dict) -> tuple[int, dict, bytes]:
+        offset = int(url.rsplit("?o=", 1)[1])
+        self.requests.append((offset, headers.get("If-None-Match")))
+        body = json.dumps(self.posts[offset:offset + PAGE_SZ]).encode()
+        etag = '"{digest}"'.format(digest=hashlib.md5(body).hexdigest())
+        if headers.get("If-None-Match") == etag:
+            return 304, {"etag": etag}, b""
+        return 200, {"etag": etag}, body
+
+
+class KemonoSyncTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.INFO)
+
+    def walk(self, request: _Listing, previous: CreatorState | None = None,
+             full: bool = False) -> tuple[list[str], CreatorListing]:
+        listing = CreatorListing(request, "http://k", "patreon", "1", previous, full)
+        return [post["id"] for post in listing], listing
+
+    def test_first_sync(self):
+        """
+        Every page is listed and remembered when a creator was never synced
+        """
+        request = _Listing(make_posts(1, 120))
+        ids, listing = self.walk(request)
+
+        self.assertEqual([str(i) for i in range(120, 0, -1)], ids)
+        self.assertEqual([(0, None), (50, None), (100, None)], request.requests)
+        self.assertEqual("120", listing.state.last_id)
+        self.assertEqual({0, 50, 100}, set(listing.state.etags))
+
+    def test_unchanged(self):
+        """
+        An unchanged creator costs one conditional request
+        """
+        request = _Listing(make_posts(1, 120))
+        _, first = self.walk(request)
+        request.requests.clear()
+        ids, listing = self.walk(request, first.state)
+
+        self.assertEqual([], ids)
+        self.assertEqual([(0, first.state.etags[0])], request.requests)
+        self.assertEqual(1, listing.unchanged)
+        self.assertEqual(first.state, listing.state)
+
+    def test_new_posts(self):
+        """
+        Pagination stops at the newest post already seen
+        """
+        posts = make_posts(1, 120)
+        request = _Listing(posts)
+        _, first = self.walk(request)
+        posts[:0] = make_posts(121, 180)
+        request.requests.clear()
+        ids, listing = self.walk(request, first.state)
+
+        self.assertEqual([str(i) for i in range(180, 120, -1)], ids)
+        self.assertEqual([0, 50], [offset for offset, _ in request.requests])
+        self.assertEqual("180", listing.state.last_id)
+
+    def test_deleted_newest(self):
+        """
+        Posts older than the newest one seen are known even if it was deleted
+        """
+        posts = make_posts(1, 20)
+        request = _Listing(posts)
+        _, first = self.walk(request)
+        del posts[0]
+        posts.insert(0, make_posts(21, 21)[0])
+        ids, _ = self.walk(request, first.state)
+
+        self.assertEqual(["21"], ids)
+
+    def test_full(self):
+        """
+        Full sync lists every changed page, unchanged pages are 304s
+        """
+        posts = make_posts(1, 120)
+        request = _Listing(posts)
+        _, first = self.walk(request)
+        posts[60]["title"] = "edited"
+        request.requests.clear()
+        ids, listing = self.walk(request, first.state, full=True)
+
+        self.assertEqual([str(i) for i in range(70, 20, -1)], ids)
+        self.assertEqual(3, len(request.requests))
+        self.assertEqual(2, listing.unchanged)
+
+    def test_error(self):
+        """
+        Failed listings raise instead of ending the listing early
+        """
+        listing = CreatorListing(lambda url, headers: (500, dict(), b""), "http://k", "patreon", "1")
+
+        with self.assertRaises(ConnectionError):
+            list(listing)
+
+    def test_store(self):
+        """
+        States survive reopening the store
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "sync.db")
+            store = SyncStore(path)
+            state = CreatorState("patreon", "1", "5", "2024-01-01T00:00:05", {0: '"a"', 50: '"b"'})
+            store.put(state)
+            store.close()
+            store = SyncStore(path)
+
+            self.assertEqual(state, store.get("patreon", "1"))
+            self.assertIsNone(store.get("fanbox", "1"))
+            self.assertEqual(1, len(store))
+            store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+from Services import Config, get_setting
+"""
+Splits the memory budget of Config.MEMORY_BUDGET between the stages of
+the pipeline so a fast stage blocks instead of buffering without limit:
+
+    download  read buffers, Config.DOWNLOAD_CHUNK_SZ is capped so every
+              transfer's buffer fits in the share
+    write     with Config.SYNC_WRITES, bytes of files waiting for their
+              flush, dirty in the page cache
+    parse     Kemono listing pages waiting for a parser and the parser
+              processes themselves
+    unzip     extraction processes, the archives queued for them are
+              bounded in count
+
+Half of the share of a stage run by a process pool sizes the pool at
+WORKER_MEMORY per process, the other half bounds the work queued for it.
+Urls are already handed over through bounded queues counted in items,
+see DownloadEngine.submit, so ingestion needs no share.
+
+Without a budget every stage keeps its defaults and only the item
+bounds apply.
+
+Usage:
+    budget = MemoryBudget.from_settings(settings)
+    read_sz = budget.read_sz(chunk_sz, thread_count)
+    parser = ParserStage(kfilter, budget.workers("parse"), max_bytes=budget.limit("parse"))
+"""
+
+# Fraction of the budget of every stage
+SHARES = {"download": 0.4, "write": 0.2, "parse": 0.2, "unzip": 0.2}
+# Rough resident memory of a spawned worker process with its imports
+WORKER_MEMORY = 48 * 1024 * 1024
+# Smallest read buffer, smaller reads cost more in calls than they save
+MIN_READ_SZ = 64 * 1024
+# Archives queued per extraction process
+PENDING_PER_WORKER = 2
+
+
+class MemoryBudget():
+    """
+    Memory budget in bytes and the share of every stage, None everywhere
+    when there is no budget
+    """
+
+    def __init__(self, total: int | None = None) -> None:
+        """
+        Args:
+            total (int | None, optional): bytes the pipeline may hold, None
+                for no budget. Defaults to None.
+
+        Raises:
+            ValueError: total is not positive
+        """
+        if total is not None and total < 1:
+            raise ValueError("{switch} must be positive".format(switch=Config.MEMORY_BUDGET.value[0][0]))
+        self.total = total
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> "MemoryBudget":
+        """
+        Args:
+            settings (dict): dict returned by PandoraArgInterpretor.interpret
+
+        Returns:
+            MemoryBudget: budget of Config.MEMORY_BUDGET, without one if not set
+        """
+        return cls(get_setting(settings, Config.MEMORY_BUDGET))
+
+    def share(self, stage: str) -> int | None:
+        """
+        Args:
+            stage (str): key of SHARES
+
+        Returns:
+            int | None: bytes the stage may hold, None without a budget
+        """
+        if self.total is None:
+            return None
+        return int(self.total * SHARES[stage])
+
+    def limit(self, stage: str) -> int | None:
+        """
+        Returns:
+            int | None: bytes of work a pool stage may queue, None without a budget
+        """
+        share = self.share(stage)
+        return None if share is None else share // 2
+
+    def workers(self, stage: str) -> int | None:
+        """
+        Returns:
+            int | None: processes of a pool stage, at least 1 and at most
+                one per CPU, None without a budget for one per CPU
+        """
+        share = self.share(stage)
+        if share is None:
+            return None
+        return max(1, min(os.cpu_count() or 1, share // 2 // WORKER_MEMORY))
+
+    def pending(self, stage: str) -> int | None:
+        """
+        Returns:
+            int | None: jobs a pool stage may queue, None without a budget
+        """
+        workers = self.workers(stage)
+        return None if workers is None else workers * PENDING_PER_WORKER
+
+    def read_sz(self, chunk_sz: int, transfers: int) -> int:
+        """
+        Args:
+            chunk_sz (int): Config.DOWNLOAD_CHUNK_SZ
+            transfers (int): transfers running at once, each with a buffer
+
+        Returns:
+            int: bytes read at a time by a transfer, chunk_sz without a budget
+        """
+        share = self.share("download")
+        if share is None:
+            return chunk_sz
+        return max(MIN_READ_SZ, min(chunk_sz, share // transfers))
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+import MemoryBudget as budget_module
+import PandoraArgInterpretor
+from MemoryBudget import MemoryBudget
+
+MB = 1024 * 1024
+
+
+class MemoryBudgetTestCase(unittest.TestCase):
+
+    def test_no_budget(self):
+        budget = MemoryBudget()
+
+        self.assertIsNone(budget.share("write"))
+        self.assertIsNone(budget.limit("parse"))
+        self.assertIsNone(budget.workers("unzip"))
+        self.assertIsNone(budget.pending("unzip"))
+        self.assertEqual(1 * MB, budget.read_sz(1 * MB, 100))
+
+    def test_shares(self):
+        budget = MemoryBudget(1000 * MB)
+
+        self.assertEqual(400 * MB, budget.share("download"))
+        self.assertEqual(100 * MB, budget.limit("parse"))
+        self.assertLessEqual(sum(budget.share(stage) for stage in budget_module.SHARES), 1000 * MB)
+
+    def test_read_sz(self):
+        """
+        Read buffers shrink to fit the download share, never below MIN_READ_SZ
+        """
+        budget = MemoryBudget(10 * MB)
+
+        self.assertEqual(1 * MB, budget.read_sz(1 * MB, 2))
+        self.assertEqual(4 * MB // 10, budget.read_sz(1 * MB, 10))
+        self.assertEqual(budget_module.MIN_READ_SZ, budget.read_sz(1 * MB, 1000))
+
+    def test_workers(self):
+        """
+        Pools get a worker per WORKER_MEMORY of half their share, one at least
+        """
+        self.assertEqual(1, MemoryBudget(1 * MB).workers("unzip"))
+        self.assertEqual(budget_module.PENDING_PER_WORKER, MemoryBudget(1 * MB).pending("unzip"))
+        large = MemoryBudget(budget_module.WORKER_MEMORY * 10000)
+        self.assertEqual(os.cpu_count() or 1, large.workers("parse"))
+
+    def test_from_settings(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            settings = lambda *args: PandoraArgInterpretor.interpret(['.py', '-d', tmp] + list(args))
+
+            self.assertIsNone(MemoryBudget.from_settings(settings()).total)
+            self.assertEqual(5000000, MemoryBudget.from_settings(settings('-m', '5000000')).total)
+            with self.assertRaises(ValueError):
+                MemoryBudget.from_settings(settings('--memory', '0'))
+
+
+if __name__ == '__main__':
+    unittest.main()
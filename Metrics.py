@@ -0,0 +1,402 @@
+import bisect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Callable, TextIO
+from Services import Config, get_setting
+"""
+Counters, histograms and queue depth gauges of a download run, so a slow
+unattended run shows whether it is waiting on the network, the disk or
+retries. Every stage records into one Metrics:
+
+    bytes_total{host}             body bytes downloaded
+    files_total{outcome}          files finished: ok, failed or linked
+    retries_total{code}           Config.HTTPS_CODES responses retried, corrupt
+                                  files fetched again and listing requests
+                                  retried after a connection error
+    stage_seconds_total{stage}    time spent in network reads, disk writes,
+                                  hash (hashing and streamed unzip),
+                                  throttle (Config.RATE_LIMIT), fsync,
+                                  parse and unzip
+    ttfb_seconds{host}            request sent to response headers
+    parse_seconds                 Kemono listing batches
+    unzip_seconds                 archives extracted by the pool
+    fsync_seconds                 DiskWriter batches
+    queue_depth{stage}            jobs waiting in download, retry, disk,
+                                  unzip and parse, sampled
+
+A Reporter dumps them to Config.METRICS_FILE every
+Config.METRICS_INTERVAL seconds, as Prometheus text if the file ends in
+'.prom' and JSON otherwise, and prints a progress line whose detail
+follows Config.VERBOSE:
+
+    1  files, MB/s and queue depths
+    2  also where the time goes, mean time to first byte and retries
+       by HTTP code
+    3  also MB/s of every host
+
+Usage:
+    metrics = Metrics()
+    metrics.inc("retries_total", code=429)
+    reporter = Reporter.from_settings(settings, metrics)
+"""
+
+# Upper bounds, in seconds, of histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DEFAULT_INTERVAL = 10
+# Prefix of Prometheus metric names
+PREFIX = "pandora_"
+
+
+class Histogram():
+    """
+    Counts of observations per bucket with their sum, not thread safe on
+    its own, Metrics holds its lock around observe()
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        """
+        Args:
+            buckets (tuple[float, ...], optional): sorted upper bounds. Defaults to DEFAULT_BUCKETS.
+        """
+        self.buckets = buckets
+        # Last count is of observations above every bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics():
+    """
+    Registry of counters, histograms and gauges keyed by name and labels.
+    Thread safe. Gauges are functions sampled when a snapshot is taken, so
+    queues are not instrumented on every put.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.__counters = dict()
+        self.__histograms = dict()
+        self.__gauges = dict()
+        self.__lock = threading.Lock()
+
+    def inc(self, name: str, n: float = 1, **labels) -> None:
+        """
+        Adds n to a counter
+
+        Args:
+            name (str): counter name, '_total' suffixed by convention
+            n (float, optional): amount to add. Defaults to 1.
+            **labels: label values distinguishing series of the counter
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + n
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        Records an observation, in seconds, in a histogram
+
+        Args:
+            name (str): histogram name, '_seconds' suffixed by convention
+            value (float): observation
+            **labels: label values distinguishing series of the histogram
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name: str, sample: Callable[[], float], **labels) -> None:
+        """
+        Registers a gauge, replacing any with the same name and labels
+
+        Args:
+            name (str): gauge name
+            sample (Callable[[], float]): returns the current value, called
+                without the registry's lock held
+            **labels: label values distinguishing series of the gauge
+        """
+        with self.__lock:
+            self.__gauges[(name, tuple(sorted(labels.items())))] = sample
+
+    def counter(self, name: str, **labels) -> float:
+        """
+        Returns:
+            float: value of a counter, 0 if it was never incremented
+        """
+        with self.__lock:
+            return self.__counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram(self, name: str, **labels) -> Histogram | None:
+        """
+        Returns:
+            Histogram | None: histogram of name and labels, None if nothing
+                was observed. Read it only once observations stop.
+        """
+        with self.__lock:
+            return self.__histograms.get((name, tuple(sorted(labels.items()))))
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: every series, JSON serializable. counters, gauges and
+                histograms are lists of dicts with name, labels and value,
+                or count, sum and cumulative counts per bucket bound.
+        """
+        with self.__lock:
+            counters = list(self.__counters.items())
+            histograms = [(key, list(h.buckets), list(h.counts), h.sum, h.count)
+                          for key, h in self.__histograms.items()]
+            gauges = list(self.__gauges.items())
+        sampled = list()
+        for (name, labels), sample in gauges:
+            try:
+                value = sample()
+            except Exception as e:
+                logging.debug("Gauge {name} failed: {error}".format(name=name, error=repr(e)))
+                continue
+            sampled.append({"name": name, "labels": dict(labels), "value": value})
+        snapshot = {"time": time.time(), "started": self.started,
+                    "counters": [{"name": name, "labels": dict(labels), "value": value}
+                                 for (name, labels), value in sorted(counters)],
+                    "gauges": sorted(sampled, key=lambda g: (g["name"], sorted(g["labels"].items()))),
+                    "histograms": list()}
+        for (name, labels), buckets, counts, total, count in sorted(histograms, key=lambda h: h[0]):
+            cumulative = list()
+            seen = 0
+            for bound, n in zip(buckets, counts):
+                seen += n
+                cumulative.append([bound, seen])
+            snapshot["histograms"].append({"name": name, "labels": dict(labels), "count": count, "sum": total,
+                                           "buckets": cumulative})
+        return snapshot
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=1)
+
+    def to_prometheus(self) -> str:
+        return format_prometheus(self.snapshot())
+
+
+def format_prometheus(snapshot: dict) -> str:
+    """
+    Args:
+        snapshot (dict): snapshot returned by Metrics.snapshot
+
+    Returns:
+        str: every series in the Prometheus text exposition format
+    """
+    lines = list()
+    typed = set()
+
+    def head(name: str, kind: str) -> None:
+        if name not in typed:
+            typed.add(name)
+            lines.append("# TYPE {prefix}{name} {kind}".format(prefix=PREFIX, name=name, kind=kind))
+
+    for series in snapshot["counters"]:
+        head(series["name"], "counter")
+        lines.append(_sample(series["name"], series["labels"], series["value"]))
+    for series in snapshot["gauges"]:
+        head(series["name"], "gauge")
+        lines.append(_sample(series["name"], series["labels"], series["value"]))
+    for series in snapshot["histograms"]:
+        name, labels = series["name"], series["labels"]
+        head(name, "histogram")
+        for bound, count in series["buckets"]:
+            lines.append(_sample(name + "_bucket", dict(labels, le=repr(float(bound))), count))
+        lines.append(_sample(name + "_bucket", dict(labels, le="+Inf"), series["count"]))
+        lines.append(_sample(name + "_sum", labels, series["sum"]))
+        lines.append(_sample(name + "_count", labels, series["count"]))
+    return "\n".join(lines) + "\n"
+
+
+def _sample(name: str, labels: dict, value: float) -> str:
+    """
+    Returns:
+        str: one Prometheus sample line
+    """
+    if not labels:
+        return "{prefix}{name} {value}".format(prefix=PREFIX, name=name, value=value)
+    pairs = ",".join('{k}="{v}"'.format(k=k, v=str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                     for k, v in sorted(labels.items()))
+    return "{prefix}{name}{{{pairs}}} {value}".format(prefix=PREFIX, name=name, pairs=pairs, value=value)
+
+
+def progress_line(snapshot: dict, previous: dict | None = None, verbose: int = 1) -> str:
+    """
+    Summarizes a snapshot in one line, rates are averaged since previous
+
+    Args:
+        snapshot (dict): snapshot to summarize
+        previous (dict | None, optional): earlier snapshot, None to average
+            since the run started. Defaults to None.
+        verbose (int, optional): Config.VERBOSE level, see module docs. Defaults to 1.
+
+    Returns:
+        str: progress line
+    """
+    def values(snap: dict | None, name: str) -> dict:
+        if snap is None:
+            return dict()
+        return {tuple(sorted(s["labels"].items())): s["value"] for s in snap["counters"] if s["name"] == name}
+
+    elapsed = snapshot["time"] - (previous["time"] if previous else snapshot["started"])
+    since = max(elapsed, 1e-9)
+    files = values(snapshot, "files_total")
+    done = sum(files.values())
+    failed = files.get((("outcome", "failed"),), 0)
+    hosts = values(snapshot, "bytes_total")
+    before = values(previous, "bytes_total")
+    rate = (sum(hosts.values()) - sum(before.values())) / since
+    clock = int(snapshot["time"] - snapshot["started"])
+    line = "[{h:02d}:{m:02d}:{s:02d}] {done} files ({failed} failed) {rate:.1f} MB/s".format(
+        h=clock // 3600, m=clock // 60 % 60, s=clock % 60, done=int(done), failed=int(failed), rate=rate / 1e6)
+    queues = {g["labels"].get("stage"): g["value"] for g in snapshot["gauges"] if g["name"] == "queue_depth"}
+    if queues:
+        line += " | queued " + ", ".join("{stage} {n}".format(stage=stage, n=int(n)) for stage, n in sorted(queues.items()))
+    if verbose >= 2:
+        stages = values(snapshot, "stage_seconds_total")
+        busy = sum(stages.values()) - sum(values(previous, "stage_seconds_total").values())
+        if busy > 0:
+            earlier = values(previous, "stage_seconds_total")
+            line += " | time " + ", ".join("{stage} {pct:.0f}%".format(
+                stage=dict(key)["stage"], pct=(seconds - earlier.get(key, 0)) * 100 / busy)
+                for key, seconds in sorted(stages.items()))
+        ttfb = [h for h in snapshot["histograms"] if h["name"] == "ttfb_seconds"]
+        if ttfb and sum(h["count"] for h in ttfb):
+            line += " | ttfb {mean:.2f}s".format(mean=sum(h["sum"] for h in ttfb) / sum(h["count"] for h in ttfb))
+        retries = values(snapshot, "retries_total")
+        if retries:
+            line += " | retries " + ", ".join("{code}: {n}".format(code=dict(key)["code"], n=int(n))
+                                              for key, n in sorted(retries.items()))
+    if verbose >= 3 and hosts:
+        line += " | " + ", ".join("{host} {rate:.1f} MB/s".format(
+            host=dict(key)["host"], rate=(n - before.get(key, 0)) / since / 1e6) for key, n in sorted(hosts.items()))
+    return line
+
+
+class Reporter():
+    """
+    Thread dumping a Metrics to a file and printing progress lines every
+    interval, and once more when stopped
+    """
+
+    def __init__(self, metrics: Metrics, path: str | None = None, interval: float = DEFAULT_INTERVAL,
+                 verbose: int = 0, stream: TextIO | None = None) -> None:
+        """
+        Args:
+            metrics (Metrics): metrics to report
+            path (str | None, optional): file to dump to, Prometheus text if it
+                ends in '.prom', JSON otherwise. Defaults to None for no dump.
+            interval (float, optional): seconds between reports. Defaults to DEFAULT_INTERVAL.
+            verbose (int, optional): Config.VERBOSE, 0 for no progress line. Defaults to 0.
+            stream (TextIO | None, optional): where progress lines go. Defaults to None for stderr.
+        """
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.verbose = verbose
+        self.stream = stream or sys.stderr
+        self.__previous = None
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings: dict, metrics: Metrics) -> "Reporter | None":
+        """
+        Args:
+            settings (dict): dict returned by PandoraArgInterpretor.interpret
+            metrics (Metrics): metrics to report
+
+        Raises:
+            ValueError: Config.METRICS_INTERVAL is not positive
+
+        Returns:
+            Reporter | None: reporter of Config.METRICS_FILE, Config.METRICS_INTERVAL
+                and Config.VERBOSE, None if neither a dump nor progress was asked for
+        """
+        path = get_setting(settings, Config.METRICS_FILE)
+        verbose = get_setting(settings, Config.VERBOSE, 0)
+        interval = get_setting(settings, Config.METRICS_INTERVAL, DEFAULT_INTERVAL)
+        if interval < 1:
+            raise ValueError("{switch} must be positive".format(switch=Config.METRICS_INTERVAL.value[0][0]))
+        if not path and verbose < 1:
+            return None
+        return cls(metrics, path, interval, verbose)
+
+    def start(self) -> None:
+        """
+        Starts reporting, does nothing if already started
+        """
+        with self.__lock:
+            if self.__thread is not None:
+                return
+            self.__stop.clear()
+            self.__thread = threading.Thread(target=self.__run, name="pandora-metrics", daemon=True)
+            self.__thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops reporting after a last report, does nothing if not started
+        """
+        with self.__lock:
+            thread = self.__thread
+            self.__thread = None
+        if thread is None:
+            return
+        self.__stop.set()
+        thread.join()
+        self.report(final=True)
+
+    def report(self, final: bool = False) -> None:
+        """
+        Dumps the metrics and prints a progress line now
+
+        Args:
+            final (bool, optional): last report, ends the progress line. Defaults to False.
+        """
+        snapshot = self.metrics.snapshot()
+        if self.path:
+            try:
+                self.__dump(snapshot)
+            except OSError as e:
+                logging.warning("Could not write metrics to {path}: {error}".format(path=self.path, error=repr(e)))
+        if self.verbose >= 1:
+            line = progress_line(snapshot, None if final else self.__previous, self.verbose)
+            if self.stream.isatty() and not final:
+                # Redrawn in place, cleared to the end of the terminal line
+                self.stream.write("\r" + line + "\x1b[K")
+            else:
+                self.stream.write(("\r" if self.stream.isatty() else "") + line + "\n")
+            self.stream.flush()
+        self.__previous = snapshot
+
+    def __run(self) -> None:
+        while not self.__stop.wait(self.interval):
+            self.report()
+
+    def __dump(self, snapshot: dict) -> None:
+        """
+        Replaces the dump file so readers never see half of one
+        """
+        if self.path.endswith(".prom"):
+            text = format_prometheus(snapshot)
+        else:
+            text = json.dumps(snapshot, indent=1)
+        temp = self.path + ".tmp"
+        with open(temp, "w") as fp:
+            fp.write(text)
+        os.replace(temp, self.path)
@@ -0,0 +1,152 @@
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import unittest
+import PandoraArgInterpretor
+from Metrics import Metrics, Reporter, format_prometheus, progress_line
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """
+        Creates a scratch folder
+        """
+        logging.basicConfig(level=logging.INFO)
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_counters(self):
+        """
+        Series are kept per label set, increments from many threads add up
+        """
+        metrics = Metrics()
+        threads = [threading.Thread(target=lambda: [metrics.inc("bytes_total", 10, host="a") for _ in range(1000)])
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        metrics.inc("bytes_total", 5, host="b")
+
+        self.assertEqual(40000, metrics.counter("bytes_total", host="a"))
+        self.assertEqual(5, metrics.counter("bytes_total", host="b"))
+        self.assertEqual(0, metrics.counter("bytes_total", host="c"))
+
+    def test_histogram(self):
+        metrics = Metrics()
+        for value in (0.001, 0.02, 0.02, 100):
+            metrics.observe("ttfb_seconds", value)
+        histogram = metrics.histogram("ttfb_seconds")
+
+        self.assertEqual(4, histogram.count)
+        self.assertAlmostEqual(100.041, histogram.sum)
+        snapshot = metrics.snapshot()["histograms"][0]
+        buckets = dict(snapshot["buckets"])
+        self.assertEqual((1, 3, 3), (buckets[0.005], buckets[0.025], buckets[60.0]))
+
+    def test_gauges(self):
+        """
+        Gauges are sampled when snapshotted, failing ones are left out
+        """
+        metrics = Metrics()
+        depth = [3]
+        metrics.gauge("queue_depth", lambda: depth[0], stage="download")
+        metrics.gauge("queue_depth", lambda: 1 / 0, stage="broken")
+        depth[0] = 7
+
+        self.assertEqual([{"name": "queue_depth", "labels": {"stage": "download"}, "value": 7}],
+                         metrics.snapshot()["gauges"])
+
+    def test_prometheus(self):
+        metrics = Metrics()
+        metrics.inc("retries_total", code=429)
+        metrics.inc("retries_total", code=429)
+        metrics.inc("bytes_total", 3, host='we"ird')
+        metrics.observe("parse_seconds", 0.3)
+        text = format_prometheus(metrics.snapshot())
+
+        self.assertIn('pandora_retries_total{code="429"} 2\n', text)
+        self.assertIn('pandora_bytes_total{host="we\\"ird"} 3\n', text)
+        self.assertEqual(1, text.count("# TYPE pandora_retries_total counter"))
+        self.assertIn('pandora_parse_seconds_bucket{le="0.25"} 0\n', text)
+        self.assertIn('pandora_parse_seconds_bucket{le="0.5"} 1\n', text)
+        self.assertIn('pandora_parse_seconds_bucket{le="+Inf"} 1\n', text)
+        self.assertIn("pandora_parse_seconds_count 1\n", text)
+
+    def test_progress_line(self):
+        """
+        Detail grows with the verbose level, rates are taken between snapshots
+        """
+        metrics = Metrics()
+        metrics.gauge("queue_depth", lambda: 4, stage="download")
+        metrics.inc("files_total", 9, outcome="ok")
+        metrics.inc("files_total", outcome="failed")
+        metrics.inc("retries_total", 2, code=429)
+        metrics.inc("stage_seconds_total", 3, stage="network")
+        metrics.inc("stage_seconds_total", 1, stage="disk")
+        previous = metrics.snapshot()
+        metrics.inc("bytes_total", 2e6, host="a")
+        snapshot = metrics.snapshot()
+        snapshot["time"] = previous["time"] + 1
+
+        line = progress_line(snapshot, previous, 1)
+        self.assertIn("10 files (1 failed) 2.0 MB/s | queued download 4", line)
+        self.assertNotIn("retries", line)
+        line = progress_line(metrics.snapshot(), verbose=2)
+        self.assertIn("time disk 25%, network 75%", line)
+        self.assertIn("retries 429: 2", line)
+        self.assertIn("a 2.0 MB/s", progress_line(snapshot, previous, 3))
+
+    def test_reporter(self):
+        """
+        Dumps are replaced every interval and once more on stop
+        """
+        metrics = Metrics()
+        metrics.inc("files_total", outcome="ok")
+        stream = io.StringIO()
+        path = os.path.join(self.tmp.name, "metrics.prom")
+        reporter = Reporter(metrics, path, interval=0.01, verbose=1, stream=stream)
+        reporter.start()
+        reporter.stop()
+        reporter.stop()
+
+        with open(path) as fp:
+            self.assertIn('pandora_files_total{outcome="ok"} 1', fp.read())
+        self.assertTrue(stream.getvalue().endswith("\n"))
+        self.assertIn("1 files (0 failed)", stream.getvalue().splitlines()[-1])
+        self.assertEqual([], [f for f in os.listdir(self.tmp.name) if f.endswith(".tmp")])
+
+    def test_from_settings(self):
+        """
+        Reporters only exist when a dump or progress was asked for
+        """
+        settings = lambda *args: PandoraArgInterpretor.interpret(['.py', '-d', self.tmp.name] + list(args))
+        self.assertIsNone(Reporter.from_settings(settings(), Metrics()))
+        self.assertIsNone(Reporter.from_settings(settings('-v', '0'), Metrics()))
+        reporter = Reporter.from_settings(settings('-v', '2', '--metrics_interval', '5'), Metrics())
+        self.assertEqual((None, 2, 5), (reporter.path, reporter.verbose, reporter.interval))
+        reporter = Reporter.from_settings(settings('--metrics', 'm.json'), Metrics())
+        self.assertEqual((os.path.abspath("m.json"), 0), (reporter.path, reporter.verbose))
+        with self.assertRaises(ValueError):
+            Reporter.from_settings(settings('-v', '1', '--metrics_interval', '0'), Metrics())
+
+    def test_json_dump(self):
+        metrics = Metrics()
+        metrics.inc("retries_total", code=403)
+        path = os.path.join(self.tmp.name, "metrics.json")
+        reporter = Reporter(metrics, path)
+        reporter.report()
+
+        with open(path) as fp:
+            snapshot = json.load(fp)
+        self.assertEqual([{"name": "retries_total", "labels": {"code": 403}, "value": 1}], snapshot["counters"])
+
+
+if __name__ == '__main__':
+    unittest.main()
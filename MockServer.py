@@ -0,0 +1,678 @@
+import collections
+import json
+import multiprocessing
+import socket
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+"""
+Local HTTP/1.1 stand-in server used by the tests and benchmarks.
+Serves registered in-memory files or deterministically generated
+payloads over keep-alive connections so the download engine can be
+exercised without touching the network.
+
+Example:
+    with MockServer() as server:
+        server.add_generated("/a.bin", 1024)
+        url = server.url("/a.bin")
+
+Generated payloads and Kemono creators need no registration, see
+gen_path and gen_creator, so MockServerProcess serves them too.
+"""
+
+# Size of the block generated payloads are built from
+BLOCK_SZ = 64 * 1024
+# Posts per Kemono listing page
+KEMONO_PAGE_SZ = 50
+
+
+def pattern(size: int, seed: int = 0) -> bytes:
+    """
+    Generates the deterministic payload served for a generated file
+
+    Args:
+        size (int): number of bytes to generate
+        seed (int, optional): seed to vary content between files. Defaults to 0.
+
+    Returns:
+        bytes: payload of length size
+    """
+    return pattern_slice(seed, 0, size)
+
+
+def pattern_slice(seed: int, start: int, end: int) -> bytes:
+    """
+    Returns bytes [start, end) of a generated payload without
+    generating the bytes before start.
+
+    Args:
+        seed (int): seed of the payload
+        start (int): first byte, inclusive
+        end (int): last byte, exclusive
+
+    Returns:
+        bytes: requested slice of the payload
+    """
+    block = __block(seed)
+    out = bytearray()
+    pos = start
+    while pos < end:
+        offset = pos % BLOCK_SZ
+        take = min(BLOCK_SZ - offset, end - pos)
+        out += block[offset:offset + take]
+        pos += take
+    return bytes(out)
+
+
+__base_block = bytes(((i * 31) + (i >> 8)) & 0xFF for i in range(BLOCK_SZ))
+
+
+def __block(seed: int) -> bytes:
+    """
+    Returns the BLOCK_SZ block a generated payload repeats, seeds rotate
+    a shared base block so each seed costs a single copy
+
+    Args:
+        seed (int): seed of the payload
+
+    Returns:
+        bytes: block of BLOCK_SZ bytes
+    """
+    shift = (seed * 7919) % BLOCK_SZ
+    return __base_block[shift:] + __base_block[:shift]
+
+
+class _Entry():
+    """
+    A file served by MockServer, either in-memory data or a generated
+    payload of a given size
+    """
+
+    def __init__(self, data: bytes | None, size: int, seed: int, headers: dict | None,
+                 cut_after: int | None = None, chunked: bool = False, corrupt: int = 0) -> None:
+        self.data = data
+        self.size = size
+        self.seed = seed
+        self.headers = dict(headers or dict())
+        # Strong validator unique to the content, a falsy ETag header disables it
+        self.etag = self.headers.pop("ETag", '"{seed}-{size}-{crc}"'.format(
+            seed=seed, size=size, crc=zlib.crc32(data) if data is not None else 0))
+        self.cut_after = cut_after
+        self.chunked = chunked
+        # Responses left whose first body byte is flipped
+        self.corrupt = corrupt
+
+    def read(self, start: int, end: int) -> bytes:
+        """
+        Returns bytes [start, end) of the entry
+        """
+        if self.data is not None:
+            return self.data[start:end]
+        return pattern_slice(self.seed, start, end)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Request handler for MockServer, speaks HTTP/1.1 so clients can reuse
+    connections
+    """
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes, avoid Nagle stalling the body
+    disable_nagle_algorithm = True
+    # Size of each socket write when sending a body
+    write_sz = 256 * 1024
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.mock.count_connection()
+
+    def log_message(self, format: str, *args) -> None:
+        # Silence default stderr logging
+        pass
+
+    def do_HEAD(self) -> None:
+        self.server.mock.track_active(1)
+        try:
+            self.__respond(False)
+        finally:
+            self.server.mock.track_active(-1)
+
+    def do_GET(self) -> None:
+        self.server.mock.track_active(1)
+        try:
+            self.__respond(True)
+        finally:
+            self.server.mock.track_active(-1)
+
+    def __respond(self, send_body: bool) -> None:
+        """
+        Sends the entry registered for the request path or a 404
+
+        Args:
+            send_body (bool): True to send the body, False for HEAD requests
+        """
+        mock = self.server.mock
+        path, _, query = self.path.partition("?")
+        mock.count_request(path, self.command, self.headers, self.path)
+        scripted = mock.next_scripted(path)
+        if scripted is None and path.startswith(("/gen/", "/data/gen/")):
+            scripted = mock.next_burst()
+        if scripted and scripted[0] is not None:
+            status, headers = scripted
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            return
+        entry = mock.get_entry(path, query)
+        if entry is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if entry.etag and self.headers.get("If-None-Match") == entry.etag:
+            self.send_response(304)
+            self.send_header("ETag", entry.etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start, end = 0, entry.size
+        byte_range = self.headers.get("Range") if mock.ranges else None
+        if_range = self.headers.get("If-Range")
+        if byte_range and if_range is not None and if_range != entry.etag:
+            # Entry changed since the client's copy, send all of it
+            byte_range = None
+        if byte_range:
+            parsed = parse_range(byte_range, entry.size)
+            if parsed is None:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{size}".format(size=entry.size))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            start, end = parsed
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {start}-{last}/{size}".format(
+                start=start, last=end - 1, size=entry.size))
+        else:
+            self.send_response(200)
+        chunked = entry.chunked and not byte_range
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-Length", str(end - start))
+        if mock.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if entry.etag:
+            self.send_header("ETag", entry.etag)
+        for k, v in entry.headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        if send_body:
+            flip = mock.next_corrupt(entry)
+            if entry.cut_after is not None and end - start > entry.cut_after:
+                # Simulate a flaky upstream dropping the connection mid body
+                self.__send_body(entry, start, start + entry.cut_after, chunked, last=False)
+                self.close_connection = True
+                self.wfile.flush()
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return
+            self.__send_body(entry, start, end, chunked, flip)
+
+    def __send_body(self, entry: _Entry, start: int, end: int, chunked: bool = False, flip: bool = False,
+                    last: bool = True) -> None:
+        """
+        Writes bytes [start, end) of entry to the client in pieces, pacing
+        the writes when the server is throttled
+
+        Args:
+            entry (_Entry): entry to send
+            start (int): first byte, inclusive
+            end (int): last byte, exclusive
+            chunked (bool, optional): send each piece as a chunk of a chunked
+                transfer encoding. Defaults to False.
+            flip (bool, optional): corrupt the first byte. Defaults to False.
+            last (bool, optional): end a chunked body with its last chunk,
+                False for a body cut short. Defaults to True.
+        """
+        throttle = self.server.mock.throttle
+        # Throttled connections send ~20 pieces a second
+        write_sz = max(1, min(self.write_sz, throttle // 20)) if throttle else self.write_sz
+        began = time.monotonic()
+        pos = start
+        while pos < end:
+            piece = min(write_sz, end - pos)
+            data = entry.read(pos, pos + piece)
+            if flip and pos == start:
+                data = bytes([data[0] ^ 0xFF]) + data[1:]
+            if chunked:
+                data = b"%x\r\n%b\r\n" % (len(data), data)
+            self.wfile.write(data)
+            pos += piece
+            if throttle:
+                ahead = (pos - start) / throttle - (time.monotonic() - began)
+                if ahead > 0:
+                    time.sleep(ahead)
+        if chunked and last:
+            self.wfile.write(b"0\r\n\r\n")
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Parses a single 'bytes=' Range header
+
+    Args:
+        header (str): Range header value
+        size (int): size of the file the range applies to
+
+    Returns:
+        tuple[int, int] | None: [start, end) of the range, None if unsatisfiable
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            # Suffix range, last n bytes
+            start, end = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    if start >= size or start >= end:
+        return None
+    return start, end
+
+
+class _Server(ThreadingHTTPServer):
+    """
+    ThreadingHTTPServer that stays quiet when clients hang up mid response,
+    which clients splitting a file into segments do on purpose
+    """
+    daemon_threads = True
+
+    def handle_error(self, request, client_address) -> None:
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockServer():
+    """
+    Threaded local HTTP server serving registered files. Tracks the
+    number of accepted connections and requests so tests can verify
+    connection reuse.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, ranges: bool = True,
+                 throttle: int | None = None, bursts: tuple[int, int] | None = None) -> None:
+        """
+        Args:
+            host (str, optional): address to bind. Defaults to "127.0.0.1".
+            port (int, optional): port to bind, 0 picks a free port. Defaults to 0.
+            ranges (bool, optional): advertise and honor byte Range requests. Defaults to True.
+            throttle (int | None, optional): cap of bytes/sec per connection, None
+                for no cap. Defaults to None.
+            bursts (tuple[int, int] | None, optional): (every, length), after every
+                'every' requests of generated payloads the next 'length' are
+                answered 429 and 403 alternately. Defaults to None for no bursts.
+        """
+        self.ranges = ranges
+        self.throttle = throttle
+        self.bursts = bursts
+        self.__burst_seq = 0
+        self.__entries = dict()
+        self.__scripts = dict()
+        self.__creators = dict()
+        self.__lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.hits = dict()
+        # Requests being served right now and the most served at once
+        self.active = 0
+        self.max_active = 0
+        # (method, path with query, request headers) of every request received
+        self.log = list()
+        self.__httpd = _Server((host, port), _Handler)
+        self.__httpd.mock = self
+        self.__thread = None
+
+    def __enter__(self) -> "MockServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """
+        Starts serving on a background thread
+        """
+        self.__thread = threading.Thread(target=self.__httpd.serve_forever, args=(0.05,), daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops serving and closes the listening socket
+        """
+        self.__httpd.shutdown()
+        self.__httpd.server_close()
+        if self.__thread:
+            self.__thread.join()
+
+    def url(self, path: str) -> str:
+        """
+        Returns an absolute url for path on this server
+
+        Args:
+            path (str): path starting with '/'
+
+        Returns:
+            str: url pointing to path
+        """
+        host, port = self.__httpd.server_address[:2]
+        return "http://{host}:{port}{path}".format(host=host, port=port, path=path)
+
+    def add_file(self, path: str, data: bytes, headers: dict | None = None, cut_after: int | None = None,
+                 chunked: bool = False, corrupt: int = 0) -> str:
+        """
+        Registers in-memory data to be served at path
+
+        Args:
+            path (str): path starting with '/'
+            data (bytes): body to serve
+            headers (dict | None, optional): extra response headers, an empty
+                ETag disables the generated ETag. Defaults to None.
+            cut_after (int | None, optional): drop the connection after sending
+                this many body bytes of any response. Defaults to None.
+            chunked (bool, optional): send full responses with chunked transfer
+                encoding instead of a Content-Length. Defaults to False.
+            corrupt (int, optional): flip a byte of the body of this many
+                responses first. Defaults to 0.
+
+        Returns:
+            str: url of the file
+        """
+        with self.__lock:
+            self.__entries[path] = _Entry(data, len(data), 0, headers, cut_after, chunked, corrupt)
+        return self.url(path)
+
+    def add_generated(self, path: str, size: int, seed: int = 0, headers: dict | None = None,
+                      cut_after: int | None = None) -> str:
+        """
+        Registers a generated payload of size bytes to be served at path
+        without holding it in memory. Content is equal to pattern(size, seed).
+
+        Args:
+            path (str): path starting with '/'
+            size (int): size of the payload in bytes
+            seed (int, optional): seed of the payload. Defaults to 0.
+            headers (dict | None, optional): extra response headers, an empty
+                ETag disables the generated ETag. Defaults to None.
+            cut_after (int | None, optional): drop the connection after sending
+                this many body bytes of any response. Defaults to None.
+
+        Returns:
+            str: url of the file
+        """
+        with self.__lock:
+            self.__entries[path] = _Entry(None, size, seed, headers, cut_after)
+        return self.url(path)
+
+    def add_creator(self, service: str, creator: str, posts: list[dict]) -> str:
+        """
+        Registers a Kemono creator whose posts are listed newest first at
+        '/api/v1/<service>/user/<creator>?o=<offset>' in pages of
+        KEMONO_PAGE_SZ, each page with an ETag of its content. The list is
+        shared, not copied, so tests can add posts between runs.
+
+        Args:
+            service (str): service the creator is on, 'patreon' for example
+            creator (str): creator id
+            posts (list[dict]): posts in Kemono API form, newest first
+
+        Returns:
+            str: url of the creator's page, as a user would copy it
+        """
+        with self.__lock:
+            self.__creators[(service, creator)] = posts
+        return self.url("/{service}/user/{creator}".format(service=service, creator=creator))
+
+    def script(self, path: str, responses: list[int | tuple[int, dict] | None]) -> None:
+        """
+        Queues canned bodiless responses for path, each request to path
+        consumes one before the path is served normally again. Used to
+        replay 429/403 storms.
+
+        Args:
+            path (str): path starting with '/'
+            responses (list[int | tuple[int, dict] | None]): status codes, status
+                codes with response headers such as Retry-After, or None to
+                serve the path normally for that request
+        """
+        with self.__lock:
+            pending = self.__scripts.setdefault(path, collections.deque())
+            for response in responses:
+                pending.append(response if isinstance(response, tuple) else (response, dict()))
+
+    def next_scripted(self, path: str) -> tuple[int | None, dict] | None:
+        """
+        Returns the next canned response for path, None if there is none
+        """
+        with self.__lock:
+            pending = self.__scripts.get(path)
+            return pending.popleft() if pending else None
+
+    def next_corrupt(self, entry: _Entry) -> bool:
+        """
+        Returns:
+            bool: True if the body about to be sent for entry must be corrupted
+        """
+        with self.__lock:
+            if entry.corrupt <= 0:
+                return False
+            entry.corrupt -= 1
+            return True
+
+    def next_burst(self) -> tuple[int, dict] | None:
+        """
+        Returns the canned response of the next generated payload request
+        if it falls in a burst, None if it is served normally
+        """
+        if not self.bursts:
+            return None
+        every, length = self.bursts
+        with self.__lock:
+            position = self.__burst_seq % (every + length)
+            self.__burst_seq += 1
+        if position < every:
+            return None
+        return (429 if (position - every) % 2 == 0 else 403), dict()
+
+    def get_entry(self, path: str, query: str = "") -> _Entry | None:
+        """
+        Returns the entry registered at path, None if there is none.
+        Unregistered '/gen/<size>/<seed>/<name>' paths, also under '/data',
+        are generated payloads and '/api/v1/<service>/user/<creator>' paths
+        are listing pages.
+        """
+        with self.__lock:
+            entry = self.__entries.get(path)
+        if entry is None and path.startswith("/api/v1/"):
+            return self.__listing(path, query)
+        if entry is None and path.startswith("/data/gen/"):
+            # Kemono data files of generated creators
+            path = path[len("/data"):]
+        if entry is None and path.startswith("/gen/"):
+            try:
+                _, _, size, seed, _ = path.split("/", 4)
+                entry = _Entry(None, int(size), int(seed), None)
+            except ValueError:
+                return None
+        return entry
+
+    def __listing(self, path: str, query: str) -> _Entry | None:
+        """
+        Returns the listing page of a creator at the '?o=' offset of query
+        """
+        parts = path.split("/")
+        if len(parts) != 6 or parts[4] != "user":
+            return None
+        offset = 0
+        for param in query.split("&"):
+            if param.startswith("o=") and param[2:].isdigit():
+                offset = int(param[2:])
+        if parts[3] == "gen":
+            try:
+                posts, files, size = map(int, parts[5].split("-"))
+            except ValueError:
+                return None
+            data = json.dumps(gen_posts(posts, files, size, offset, KEMONO_PAGE_SZ)).encode()
+            return _Entry(data, len(data), 0, {"Content-Type": "application/json"})
+        with self.__lock:
+            posts = self.__creators.get((parts[3], parts[5]))
+            if posts is None:
+                return None
+            data = json.dumps(posts[offset:offset + KEMONO_PAGE_SZ]).encode()
+        return _Entry(data, len(data), 0, {"Content-Type": "application/json"})
+
+    def track_active(self, delta: int) -> None:
+        """
+        Records a request starting (1) or finishing (-1)
+        """
+        with self.__lock:
+            self.active += delta
+            self.max_active = max(self.max_active, self.active)
+
+    def count_connection(self) -> None:
+        """
+        Records a newly accepted connection
+        """
+        with self.__lock:
+            self.connections += 1
+
+    def count_request(self, path: str, method: str = "GET", headers: dict | None = None,
+                      target: str | None = None) -> None:
+        """
+        Records a request made to path, target is the path with its query
+        """
+        with self.__lock:
+            self.log.append((method, target or path, dict(headers or dict())))
+            self.requests += 1
+            self.hits[path] = self.hits.get(path, 0) + 1
+
+
+def gen_path(size: int, seed: int = 0, name: str = "file.bin") -> str:
+    """
+    Returns a path every MockServer serves pattern(size, seed) at without
+    registration, usable with MockServerProcess
+
+    Args:
+        size (int): size of the payload
+        seed (int, optional): seed of the payload. Defaults to 0.
+        name (str, optional): file name at the end of the path. Defaults to "file.bin".
+
+    Returns:
+        str: path starting with '/gen/'
+    """
+    return "/gen/{size}/{seed}/{name}".format(size=size, seed=seed, name=name)
+
+
+def gen_creator(posts: int, files: int, size: int) -> str:
+    """
+    Returns the page path of a Kemono creator every MockServer lists
+    without registration, see gen_posts
+
+    Args:
+        posts (int): posts of the creator
+        files (int): files of every post
+        size (int): size of every file
+
+    Returns:
+        str: path of the creator's page, '/gen/user/<posts>-<files>-<size>'
+    """
+    return "/gen/user/{posts}-{files}-{size}".format(posts=posts, files=files, size=size)
+
+
+def gen_posts(posts: int, files: int, size: int, offset: int = 0, count: int | None = None) -> list[dict]:
+    """
+    Generates posts of a gen_creator creator in Kemono API form, newest
+    first. Post n has id n and files generated payloads of size bytes.
+
+    Args:
+        posts (int): posts of the creator
+        files (int): files of every post
+        size (int): size of every file
+        offset (int, optional): newest posts to skip. Defaults to 0.
+        count (int | None, optional): posts to return. Defaults to None for all.
+
+    Returns:
+        list[dict]: posts from offset on
+    """
+    end = posts - offset
+    start = max(end - count, 0) if count is not None else 0
+    listed = list()
+    for post in range(end, start, -1):
+        attachments = [{"name": "{post}-{k}.bin".format(post=post, k=k),
+                        "path": gen_path(size, post * files + k, "{post}-{k}.bin".format(post=post, k=k))}
+                       for k in range(files)]
+        listed.append({"id": str(post), "title": "Post {post}".format(post=post), "content": "",
+                       "published": "2023-01-01T00:00:00", "file": attachments[0] if attachments else dict(),
+                       "attachments": attachments})
+    return listed
+
+
+def _serve(conn, kwargs: dict) -> None:
+    """
+    Child process entry point of MockServerProcess
+    """
+    server = MockServer(**kwargs)
+    server.start()
+    conn.send(server.url(""))
+    conn.recv()
+    server.stop()
+    conn.send({"connections": server.connections, "requests": server.requests, "max_active": server.max_active})
+
+
+class MockServerProcess():
+    """
+    MockServer running in a child process so benchmarks do not share the
+    GIL with the server. Only '/gen/' paths are served, see gen_path.
+
+    Example:
+        with MockServerProcess(throttle=1000000) as server:
+            url = server.url(gen_path(1024))
+    """
+
+    def __init__(self, **kwargs) -> None:
+        """
+        Args:
+            kwargs: arguments of MockServer
+        """
+        self.__kwargs = kwargs
+        self.__base = None
+        self.stats = dict()
+
+    def __enter__(self) -> "MockServerProcess":
+        self.__conn, child = multiprocessing.Pipe()
+        self.__process = multiprocessing.Process(target=_serve, args=(child, self.__kwargs), daemon=True)
+        self.__process.start()
+        self.__base = self.__conn.recv()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.__conn.send("stop")
+        self.stats = self.__conn.recv()
+        self.__process.join()
+
+    def url(self, path: str) -> str:
+        """
+        Returns an absolute url for path on the server
+        """
+        return self.__base + path
@@ -105,7 +105,8 @@ def interpret(args:list[str])->dict[Service, dict]:
             
 def process_file_path(fpath:str)->str:
     """
-    Prepares a file path to be processable by python
+    Prepares a file path to be processable by python, urls and '-' (stdin)
+    are left untouched
 
     Args:
         fpath (str): unprocessed file path
@@ -113,6 +114,8 @@ def process_file_path(fpath:str)->str:
     Returns:
         str: processed and ready to use file path
     """
+    if fpath == '-' or fpath.lower().startswith(('http://', 'https://')):
+        return fpath
     return os.path.abspath(fpath)
 
 def process_dir_path(dirpath:str)->str:
@@ -128,7 +131,7 @@ def process_dir_path(dirpath:str)->str:
     folder = os.path.abspath(dirpath)
 
     if folder[len(folder) - 1] == '\"':
-        folder = folder[:len(folder) - 1] + '\\'
-    elif not folder[len(folder) - 1] == '\\':
-        folder += '\\'
+        folder = folder[:len(folder) - 1] + os.sep
+    elif folder[len(folder) - 1] not in ('\\', '/'):
+        folder += os.sep
     return folder
@@ -0,0 +1,29 @@
+import sys
+import time
+import PandoraArgInterpretor
+import Services
+"""
+Compares interpreting a command line with the switch table built once
+against rebuilding it on every call, as a script launching Pandora per
+job did.
+
+Run directly: python PandoraArgInterpretor_bench.py [calls]
+"""
+
+ARGS = ['.py', '-d', '.', '-t', '12', '-z', '429,403,503', '--kxfile', 'zip,psd', '--kfstructure', '1']
+
+
+def bench(name: str, calls: int, rebuild: bool) -> None:
+    start = time.perf_counter()
+    for _ in range(calls):
+        if rebuild:
+            Services.get_switch_to_config_table.cache_clear()
+        PandoraArgInterpretor.interpret(ARGS)
+    elapsed = time.perf_counter() - start
+    print("{name:<8} {cps:10.0f} calls/s".format(name=name, cps=calls / elapsed))
+
+
+if __name__ == '__main__':
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bench("rebuilt", calls, True)
+    bench("cached", calls, False)
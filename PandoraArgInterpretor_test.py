@@ -1,3 +1,4 @@
+import os
 import unittest
 import PandoraArgInterpretor
 import logging
@@ -111,34 +112,45 @@ class PandoraArgInterpretorTestCase(unittest.TestCase):
         # Nonstandard windows
         
         # ./
+        self.assertEqual(os.path.abspath('./links.txt'), PandoraArgInterpretor.process_file_path('./links.txt'))
         
         # ../
+        self.assertEqual(os.path.abspath('../links.txt'), PandoraArgInterpretor.process_file_path('../links.txt'))
         
         # ../somedir/something
+        self.assertEqual(os.path.abspath('../somedir/links.txt'), PandoraArgInterpretor.process_file_path('../somedir/links.txt'))
+        
+        # stdin and urls are not paths
+        self.assertEqual('-', PandoraArgInterpretor.process_file_path('-'))
+        self.assertEqual('https://site.com/a.zip', PandoraArgInterpretor.process_file_path('https://site.com/a.zip'))
+        args = PandoraArgInterpretor.interpret(['.py', '-f', 'HTTP://site.com/a.zip'])
+        self.assertEqual('HTTP://site.com/a.zip', args[Services.Service.BASIC][Services.Config.DOWNLOAD_URL.value])
         
     def test_folder_path(self):
         """
-        Test folder path processing
+        Test folder path processing, every folder ends in exactly one separator
         """
-        # Standard windows
-        
-        # Nonstandard windows
-        
+        cwd = os.getcwd()
+        parent = os.path.dirname(cwd)
+        # Absolute with and without a trailing separator
+        folder = os.path.join(cwd, "somedir")
+        self.assertEqual(folder + os.sep, PandoraArgInterpretor.process_dir_path(folder))
+        self.assertEqual(folder + os.sep, PandoraArgInterpretor.process_dir_path(folder + os.sep))
+        # Quoted path ending in a separator, as a shell passes "C:\somedir\"
+        self.assertEqual(folder + os.sep, PandoraArgInterpretor.process_dir_path(folder + '"'))
         # ./
-        
+        self.assertEqual(cwd + os.sep, PandoraArgInterpretor.process_dir_path("." + os.sep))
         # ../
-        
+        self.assertEqual(parent + os.sep, PandoraArgInterpretor.process_dir_path(".." + os.sep))
         # ../somedir/
-        
-        # Standard window missing \\
-        
-        # Nonstandard windows missing /
-        
+        self.assertEqual(os.path.join(parent, "somedir") + os.sep,
+                         PandoraArgInterpretor.process_dir_path(os.path.join("..", "somedir") + os.sep))
+        # somedir missing the separator
+        self.assertEqual(folder + os.sep, PandoraArgInterpretor.process_dir_path("somedir"))
         # .
-        
+        self.assertEqual(cwd + os.sep, PandoraArgInterpretor.process_dir_path("."))
         # ..
-        
-        # ../somedir
+        self.assertEqual(parent + os.sep, PandoraArgInterpretor.process_dir_path(".."))
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
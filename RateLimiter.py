@@ -0,0 +1,126 @@
+import collections
+import threading
+import time
+"""
+Limits shared by every download worker. HostSlots caps concurrent
+connections per host (Config.HOST_CONNS) and TokenBucket caps total
+bytes/sec (Config.RATE_LIMIT).
+"""
+
+
+class TokenBucket():
+    """
+    Token bucket refilled at rate tokens (bytes) per second up to capacity.
+    Consumers may go into debt, so a chunk larger than the bucket still
+    passes and the consumers after it wait for the debt to be repaid.
+    Thread safe.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        """
+        Args:
+            rate (float): tokens added per second
+            capacity (float | None, optional): burst size, defaults to one
+                second worth of tokens
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self.__tokens = self.capacity
+        self.__stamp = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def reserve(self, n: int) -> float:
+        """
+        Takes n tokens without waiting
+
+        Args:
+            n (int): tokens to take
+
+        Returns:
+            float: seconds the caller must wait before using them
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.capacity, self.__tokens + (now - self.__stamp) * self.rate)
+            self.__stamp = now
+            self.__tokens -= n
+            if self.__tokens >= 0:
+                return 0.0
+            return -self.__tokens / self.rate
+
+    def consume(self, n: int) -> None:
+        """
+        Takes n tokens, sleeping until they are available
+        """
+        wait = self.reserve(n)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class HostSlots():
+    """
+    Caps the number of jobs running against each host. A job that cannot
+    get a slot is parked instead of blocking its worker, releasing a slot
+    hands back the oldest parked job of that host. Thread safe.
+    """
+
+    def __init__(self, limit: int | None) -> None:
+        """
+        Args:
+            limit (int | None): slots per host, None for no limit
+        """
+        self.limit = limit
+        self.__active = collections.Counter()
+        self.__parked = dict()
+        self.__lock = threading.Lock()
+
+    def acquire(self, host: str, job: object) -> bool:
+        """
+        Takes a slot of host for job, parking job if none are free
+
+        Args:
+            host (str): host job connects to
+            job (object): job wanting the slot
+
+        Returns:
+            bool: True if a slot was taken, False if job was parked
+        """
+        with self.__lock:
+            if self.limit is None or self.__active[host] < self.limit:
+                self.__active[host] += 1
+                return True
+            self.__parked.setdefault(host, collections.deque()).append(job)
+            return False
+
+    def release(self, host: str) -> object | None:
+        """
+        Frees a slot of host
+
+        Args:
+            host (str): host the slot was taken for
+
+        Returns:
+            object | None: parked job that should be queued again, None if
+                no job of host is waiting
+        """
+        with self.__lock:
+            self.__active[host] -= 1
+            if self.__active[host] <= 0:
+                del self.__active[host]
+            parked = self.__parked.get(host)
+            if not parked:
+                return None
+            job = parked.popleft()
+            if not parked:
+                del self.__parked[host]
+            return job
+
+    def active(self, host: str) -> int:
+        """
+        Returns:
+            int: slots of host currently taken
+        """
+        with self.__lock:
+            return self.__active[host]
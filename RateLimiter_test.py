@@ -0,0 +1,64 @@
+import logging
+import time
+import unittest
+from RateLimiter import HostSlots, TokenBucket
+
+
+class RateLimiterTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """
+        Nothing to set up except logging type
+        """
+        logging.basicConfig(level=logging.INFO)
+
+    def test_bucket_burst_and_debt(self):
+        """
+        Burst up to capacity is free, beyond it waits are proportional to debt
+        """
+        bucket = TokenBucket(1000, 500)
+        self.assertEqual(0.0, bucket.reserve(500))
+        self.assertAlmostEqual(0.25, bucket.reserve(250), delta=0.01)
+        # Debt accumulates across consumers
+        self.assertAlmostEqual(0.5, bucket.reserve(250), delta=0.01)
+
+    def test_bucket_consume(self):
+        """
+        Consuming beyond the burst sleeps
+        """
+        bucket = TokenBucket(10000)
+        start = time.monotonic()
+        bucket.consume(10000)
+        bucket.consume(2000)
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+    def test_bucket_invalid(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(0)
+
+    def test_host_slots(self):
+        """
+        Jobs beyond the limit are parked and handed back in order on release
+        """
+        slots = HostSlots(2)
+        self.assertTrue(slots.acquire("a", 1))
+        self.assertTrue(slots.acquire("a", 2))
+        self.assertFalse(slots.acquire("a", 3))
+        self.assertFalse(slots.acquire("a", 4))
+        # Other hosts have their own slots
+        self.assertTrue(slots.acquire("b", 5))
+
+        self.assertEqual(3, slots.release("a"))
+        self.assertEqual(1, slots.active("a"))
+        self.assertEqual(4, slots.release("a"))
+        self.assertIsNone(slots.release("a"))
+        self.assertIsNone(slots.release("b"))
+        self.assertEqual(0, slots.active("a"))
+
+    def test_host_slots_unlimited(self):
+        slots = HostSlots(None)
+        self.assertTrue(all(slots.acquire("a", i) for i in range(100)))
+
+
+if __name__ == '__main__':
+    unittest.main()
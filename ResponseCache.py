@@ -0,0 +1,168 @@
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Callable
+"""
+Cache of listing and metadata responses kept across runs in the sqlite
+database given by Config.RESPONSE_CACHE. Never used for downloaded files.
+
+A cached url is requested again with 'If-None-Match' and
+'If-Modified-Since' built from the validators the server sent, a 304
+answer is served from the cache. Bodies are stored zlib compressed and
+the least recently used entries are evicted once the stored bytes
+exceed Config.RESPONSE_CACHE_SZ.
+
+Usage:
+    cache = ResponseCache("responses.db")
+    status, headers, body = cache.fetch(request, url, headers)
+"""
+
+DEFAULT_CACHE_SZ = 256 * 1024 * 1024
+# Response headers kept with an entry, lowercase
+KEPT_HEADERS = ("etag", "last-modified", "content-type")
+
+# request(url, headers) -> (status, response headers keyed in lowercase, body)
+Request = Callable[[str, dict], tuple[int, dict, bytes]]
+
+
+class ResponseCache():
+    """
+    Thread safe sqlite cache of 200 responses, keyed by url
+    """
+
+    def __init__(self, path: str, max_size: int = DEFAULT_CACHE_SZ) -> None:
+        """
+        Args:
+            path (str): database file, created if it does not exist
+            max_size (int, optional): stored bytes kept before least recently
+                used entries are evicted. Defaults to DEFAULT_CACHE_SZ.
+        """
+        self.path = path
+        self.max_size = max_size
+        # Requests answered from the cache after a 304, and requests made
+        self.hits = 0
+        self.requests = 0
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        with self.__lock, self.__db:
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__db.execute("PRAGMA synchronous=NORMAL")
+            self.__db.execute("CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, etag TEXT, "
+                              "last_modified TEXT, content_type TEXT, body BLOB, size INTEGER, used REAL)")
+            self.__db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+            self.__size = self.__db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return self.__db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @property
+    def size(self) -> int:
+        """
+        Returns:
+            int: bytes stored, compressed bodies
+        """
+        with self.__lock:
+            return self.__size
+
+    def get(self, url: str) -> tuple[dict, bytes] | None:
+        """
+        Returns:
+            tuple[dict, bytes] | None: headers and body cached for url, None
+                if url is not cached
+        """
+        with self.__lock:
+            row = self.__db.execute("SELECT etag, last_modified, content_type, body FROM responses WHERE url = ?",
+                                    (url,)).fetchone()
+        if row is None:
+            return None
+        headers = {name: value for name, value in zip(KEPT_HEADERS, row[:3]) if value is not None}
+        return headers, zlib.decompress(row[3])
+
+    def put(self, url: str, headers: dict, body: bytes) -> None:
+        """
+        Caches a 200 response, responses without a validator are not cached
+        since they cannot be revalidated
+
+        Args:
+            url (str): url requested
+            headers (dict): response headers keyed in lowercase
+            body (bytes): response body
+        """
+        if not headers.get("etag") and not headers.get("last-modified"):
+            return
+        data = zlib.compress(body, 1)
+        if len(data) > self.max_size:
+            return
+        with self.__lock, self.__db:
+            old = self.__db.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            self.__db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (url, headers.get("etag"), headers.get("last-modified"), headers.get("content-type"),
+                               data, len(data), time.time()))
+            self.__size += len(data) - (old[0] if old else 0)
+            self.__evict()
+
+    def fetch(self, request: Request, url: str, headers: dict | None = None) -> tuple[int, dict, bytes]:
+        """
+        Requests url through the cache. Requests the caller made conditional
+        itself are passed through so the caller still sees its own 304s.
+
+        Args:
+            request (Request): sends a GET
+            url (str): url to request
+            headers (dict | None, optional): request headers. Defaults to None.
+
+        Returns:
+            tuple[int, dict, bytes]: status, headers keyed in lowercase and body
+        """
+        headers = dict(headers or dict())
+        own = "If-None-Match" in headers or "If-Modified-Since" in headers
+        cached = None if own else self.get(url)
+        if cached is not None:
+            if "etag" in cached[0]:
+                headers["If-None-Match"] = cached[0]["etag"]
+            if "last-modified" in cached[0]:
+                headers["If-Modified-Since"] = cached[0]["last-modified"]
+        status, response_headers, body = request(url, headers)
+        with self.__lock:
+            self.requests += 1
+        if status == 304 and cached is not None:
+            self.__touch(url)
+            with self.__lock:
+                self.hits += 1
+            return 200, dict(cached[0], **response_headers), cached[1]
+        if status == 200:
+            self.put(url, response_headers, body)
+        elif status == 304:
+            self.__touch(url)
+        return status, response_headers, body
+
+    def close(self) -> None:
+        """
+        Closes the database
+        """
+        with self.__lock:
+            self.__db.close()
+
+    def __touch(self, url: str) -> None:
+        """
+        Marks url as just used
+        """
+        with self.__lock, self.__db:
+            self.__db.execute("UPDATE responses SET used = ? WHERE url = ?", (time.time(), url))
+
+    def __evict(self) -> None:
+        """
+        Deletes least recently used entries until the cache fits, lock must be held
+        """
+        while self.__size > self.max_size:
+            rows = self.__db.execute("SELECT url, size FROM responses ORDER BY used LIMIT 64").fetchall()
+            if not rows:
+                self.__size = 0
+                return
+            for url, size in rows:
+                self.__db.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self.__size -= size
+                if self.__size <= self.max_size:
+                    return
@@ -0,0 +1,115 @@
+import logging
+import os
+import tempfile
+import unittest
+from ResponseCache import ResponseCache
+
+
+class _Server():
+    """
+    Answers every url with its body, honoring If-None-Match
+    """
+
+    def __init__(self) -> None:
+        self.bodies = dict()
+        # Request headers of every request
+        self.requests = list()
+
+    def __call__(self, url: str, headers: dict) -> tuple[int, dict, bytes]:
+        self.requests.append(headers)
+        body = self.bodies[url]
+        etag = '"{n}"'.format(n=hash(body))
+        if headers.get("If-None-Match") == etag:
+            return 304, {"etag": etag}, b""
+        return 200, {"etag": etag, "content-type": "application/json"}, body
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.INFO)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cache.db")
+        self.server = _Server()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_revalidate(self):
+        """
+        Cached responses are revalidated and served on 304
+        """
+        cache = ResponseCache(self.path)
+        self.server.bodies["u"] = b"[1, 2]"
+        self.assertEqual((200, b"[1, 2]"), cache.fetch(self.server, "u")[::2])
+        status, headers, body = cache.fetch(self.server, "u")
+
+        self.assertEqual((200, b"[1, 2]"), (status, body))
+        self.assertEqual("application/json", headers["content-type"])
+        self.assertIsNotNone(self.server.requests[1].get("If-None-Match"))
+        self.assertEqual(1, cache.hits)
+
+        self.server.bodies["u"] = b"[3]"
+        self.assertEqual(b"[3]", cache.fetch(self.server, "u")[2])
+        self.assertEqual(b"[3]", cache.get("u")[1])
+        cache.close()
+
+    def test_own_conditional(self):
+        """
+        Requests made conditional by the caller see their own 304
+        """
+        cache = ResponseCache(self.path)
+        self.server.bodies["u"] = b"x"
+        etag = cache.fetch(self.server, "u")[1]["etag"]
+
+        self.assertEqual(304, cache.fetch(self.server, "u", {"If-None-Match": etag})[0])
+        cache.close()
+
+    def test_no_validator(self):
+        """
+        Responses that cannot be revalidated are not cached
+        """
+        cache = ResponseCache(self.path)
+        cache.put("u", dict(), b"x")
+
+        self.assertIsNone(cache.get("u"))
+        self.assertEqual(0, len(cache))
+        cache.close()
+
+    def test_evict(self):
+        """
+        Least recently used entries are evicted beyond the size cap
+        """
+        cache = ResponseCache(self.path, max_size=120)
+        for i in range(3):
+            cache.put(str(i), {"etag": '"{i}"'.format(i=i)}, os.urandom(40))
+        self.assertIsNone(cache.get("0"))
+        self.assertLessEqual(cache.size, 120)
+
+        self.server.bodies["1"] = b"1"
+        # Revalidating marks an entry used, the oldest is evicted next
+        cache.put("1", {"etag": '"{n}"'.format(n=hash(b"1"))}, b"1")
+        cache.fetch(self.server, "1")
+        cache.put("3", {"etag": '"3"'}, os.urandom(40))
+        cache.put("4", {"etag": '"4"'}, os.urandom(40))
+        self.assertIsNotNone(cache.get("1"))
+        self.assertIsNone(cache.get("2"))
+        cache.close()
+
+    def test_persists(self):
+        """
+        Entries and their size survive reopening
+        """
+        cache = ResponseCache(self.path)
+        cache.put("u", {"last-modified": "Mon, 01 Jan 2024 00:00:00 GMT"}, b"x" * 1000)
+        size = cache.size
+        cache.close()
+        cache = ResponseCache(self.path)
+
+        self.assertEqual(size, cache.size)
+        self.assertEqual(({"last-modified": "Mon, 01 Jan 2024 00:00:00 GMT"}, b"x" * 1000), cache.get("u"))
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,253 @@
+import email.utils
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Callable
+"""
+Retry handling for Config.HTTPS_CODES and Config.HTTPS_RETRIES. Failed
+jobs are handed to a RetryScheduler which puts them back on the work
+queue once their backoff expires, so no worker sleeps or spins while
+waiting. A CircuitBreaker per host pauses only the host that is
+rate limiting, jobs of other hosts keep flowing.
+"""
+
+# Defaults for configs not provided by the user, see Config descriptions
+DEFAULT_HTTPS_CODES = (429, 403)
+# None for unlimited retries
+DEFAULT_HTTPS_RETRIES = None
+
+
+def parse_retry_after(value: str | None, now: float | None = None) -> float | None:
+    """
+    Parses a Retry-After header, either delay seconds or an HTTP date
+
+    Args:
+        value (str | None): header value
+        now (float | None, optional): current unix time, defaults to time.time()
+
+    Returns:
+        float | None: seconds to wait, None if the header is missing or invalid
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when is None:
+        return None
+    return max(when.timestamp() - (time.time() if now is None else now), 0.0)
+
+
+class RetryPolicy():
+    """
+    Exponential backoff with jitter. The n-th consecutive failure waits
+    between half and all of min(max_delay, base * 2^n) seconds so retries
+    of many jobs spread out instead of arriving together.
+    """
+
+    def __init__(self, base: float = 1.0, max_delay: float = 120.0, rng: random.Random | None = None) -> None:
+        """
+        Args:
+            base (float, optional): backoff of the first retry in seconds. Defaults to 1.0.
+            max_delay (float, optional): cap of the exponential backoff in seconds. Defaults to 120.0.
+            rng (random.Random | None, optional): source of jitter. Defaults to None.
+        """
+        self.base = base
+        self.max_delay = max_delay
+        self.__rng = rng or random.Random()
+
+    def delay(self, failures: int, retry_after: float | None = None) -> float:
+        """
+        Seconds to wait before the next attempt
+
+        Args:
+            failures (int): consecutive failures so far, at least 1
+            retry_after (float | None, optional): server requested delay, honored
+                as a lower bound. Defaults to None.
+
+        Returns:
+            float: seconds to wait
+        """
+        ceiling = min(self.max_delay, self.base * (2 ** max(failures - 1, 0)))
+        backoff = ceiling / 2 + self.__rng.uniform(0, ceiling / 2)
+        if retry_after is not None:
+            # Server knows best, only add a little jitter on top
+            return retry_after + self.__rng.uniform(0, self.base / 2)
+        return backoff
+
+    def jitter(self) -> float:
+        """
+        Returns:
+            float: small random delay used to spread jobs released together
+        """
+        return self.__rng.uniform(0, self.base / 2)
+
+
+class CircuitBreaker():
+    """
+    Per host breaker. A retryable response opens the breaker for the host
+    for the backoff period. Once it expires a single probe job is let
+    through (half open); its success closes the breaker, its failure
+    reopens it with a longer backoff. Thread safe.
+    """
+
+    def __init__(self, policy: RetryPolicy) -> None:
+        """
+        Args:
+            policy (RetryPolicy): policy deciding how long a host stays open
+        """
+        self.__policy = policy
+        # host -> [consecutive failures, open until, probe in flight]
+        self.__hosts = dict()
+        self.__lock = threading.Lock()
+
+    def allow(self, host: str, now: float | None = None) -> float:
+        """
+        Checks whether a job for host may run now
+
+        Args:
+            host (str): host of the job
+            now (float | None, optional): monotonic time, defaults to time.monotonic()
+
+        Returns:
+            float: 0 if the job may run, otherwise seconds to defer it by
+        """
+        now = time.monotonic() if now is None else now
+        with self.__lock:
+            state = self.__hosts.get(host)
+            if state is None:
+                return 0.0
+            if now < state[1]:
+                return state[1] - now
+            if state[2]:
+                # Wait for the probe's verdict
+                return self.__policy.base
+            state[2] = True
+            return 0.0
+
+    def failure(self, host: str, retry_after: float | None = None, now: float | None = None) -> float:
+        """
+        Records a retryable response and opens the breaker
+
+        Args:
+            host (str): host that responded
+            retry_after (float | None, optional): Retry-After of the response. Defaults to None.
+            now (float | None, optional): monotonic time, defaults to time.monotonic()
+
+        Returns:
+            float: seconds the host is paused for
+        """
+        now = time.monotonic() if now is None else now
+        with self.__lock:
+            state = self.__hosts.setdefault(host, [0, 0.0, False])
+            state[0] += 1
+            pause = self.__policy.delay(state[0], retry_after)
+            state[1] = max(state[1], now + pause)
+            state[2] = False
+            return state[1] - now
+
+    def success(self, host: str) -> None:
+        """
+        Records a non retryable response, closing the breaker
+        """
+        with self.__lock:
+            self.__hosts.pop(host, None)
+
+    def release(self, host: str) -> None:
+        """
+        Frees the probe slot of a host without a verdict, used when the
+        probe failed for reasons unrelated to the host rate limiting
+        """
+        with self.__lock:
+            state = self.__hosts.get(host)
+            if state:
+                state[2] = False
+
+    def is_open(self, host: str) -> bool:
+        """
+        Returns:
+            bool: True if jobs for host are currently being held back
+        """
+        with self.__lock:
+            return host in self.__hosts
+
+
+class RetryScheduler():
+    """
+    Holds deferred jobs and hands each back through submit once its delay
+    has passed. Runs a single timer thread that sleeps until the next job
+    is due.
+    """
+
+    def __init__(self, submit: Callable[[object], None]) -> None:
+        """
+        Args:
+            submit (Callable[[object], None]): called with each job once due,
+                on the scheduler's thread
+        """
+        self.__submit = submit
+        self.__heap = list()
+        self.__seq = itertools.count()
+        self.__cond = threading.Condition()
+        self.__thread = None
+        self.__stopped = False
+
+    def __len__(self) -> int:
+        with self.__cond:
+            return len(self.__heap)
+
+    def start(self) -> None:
+        """
+        Starts the timer thread, does nothing if already started
+        """
+        with self.__cond:
+            if self.__thread:
+                return
+            self.__stopped = False
+            self.__thread = threading.Thread(target=self.__run, name="pandora-retry", daemon=True)
+            self.__thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the timer thread, jobs still deferred are dropped
+        """
+        with self.__cond:
+            self.__stopped = True
+            self.__heap.clear()
+            thread = self.__thread
+            self.__thread = None
+            self.__cond.notify()
+        if thread:
+            thread.join()
+
+    def defer(self, job: object, delay: float) -> None:
+        """
+        Schedules job to be submitted after delay seconds
+
+        Args:
+            job (object): job to hand back
+            delay (float): seconds to hold the job
+        """
+        with self.__cond:
+            heapq.heappush(self.__heap, (time.monotonic() + delay, next(self.__seq), job))
+            self.__cond.notify()
+        self.start()
+
+    def __run(self) -> None:
+        """
+        Timer loop, submits due jobs in due order
+        """
+        while True:
+            with self.__cond:
+                while not self.__stopped and (not self.__heap or self.__heap[0][0] > time.monotonic()):
+                    self.__cond.wait(self.__heap[0][0] - time.monotonic() if self.__heap else None)
+                if self.__stopped:
+                    return
+                _, _, job = heapq.heappop(self.__heap)
+            self.__submit(job)
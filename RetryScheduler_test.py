@@ -0,0 +1,98 @@
+import logging
+import random
+import threading
+import time
+import unittest
+from RetryScheduler import CircuitBreaker, RetryPolicy, RetryScheduler, parse_retry_after
+
+
+class RetrySchedulerTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """
+        Nothing to set up except logging type
+        """
+        logging.basicConfig(level=logging.INFO)
+
+    def test_parse_retry_after(self):
+        """
+        Delay seconds, HTTP dates and garbage
+        """
+        self.assertEqual(120.0, parse_retry_after("120"))
+        self.assertEqual(30.0, parse_retry_after("Wed, 21 Oct 2015 07:28:30 GMT", now=1445412480.0))
+        self.assertEqual(0.0, parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT", now=1445412480.0 + 60))
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertIsNone(parse_retry_after(None))
+
+    def test_policy_delay(self):
+        """
+        Backoff doubles per failure within jitter bounds and is capped
+        """
+        policy = RetryPolicy(base=1.0, max_delay=8.0, rng=random.Random(1))
+        for failures, ceiling in ((1, 1.0), (2, 2.0), (3, 4.0), (4, 8.0), (10, 8.0)):
+            for _ in range(50):
+                delay = policy.delay(failures)
+                self.assertGreaterEqual(delay, ceiling / 2)
+                self.assertLessEqual(delay, ceiling)
+        # Retry-After is a lower bound
+        self.assertGreaterEqual(policy.delay(1, 30.0), 30.0)
+        self.assertLessEqual(policy.delay(1, 30.0), 30.5)
+
+    def test_breaker(self):
+        """
+        Open, half open with a single probe, closed on success
+        """
+        breaker = CircuitBreaker(RetryPolicy(base=1.0, rng=random.Random(1)))
+        self.assertEqual(0.0, breaker.allow("a", now=0.0))
+
+        pause = breaker.failure("a", retry_after=10.0, now=0.0)
+        self.assertGreaterEqual(pause, 10.0)
+        self.assertGreater(breaker.allow("a", now=5.0), 0.0)
+        # Other hosts are unaffected
+        self.assertEqual(0.0, breaker.allow("b", now=5.0))
+
+        # Half open, only one probe
+        self.assertEqual(0.0, breaker.allow("a", now=11.0))
+        self.assertGreater(breaker.allow("a", now=11.0), 0.0)
+        breaker.success("a")
+        self.assertEqual(0.0, breaker.allow("a", now=11.0))
+        self.assertFalse(breaker.is_open("a"))
+
+    def test_breaker_probe_failure(self):
+        """
+        Failed probe reopens the breaker with a longer backoff
+        """
+        breaker = CircuitBreaker(RetryPolicy(base=1.0, rng=random.Random(1)))
+        breaker.failure("a", now=0.0)
+        self.assertEqual(0.0, breaker.allow("a", now=2.0))
+        pause = breaker.failure("a", now=2.0)
+        self.assertGreaterEqual(pause, 1.0)
+        self.assertTrue(breaker.is_open("a"))
+
+    def test_scheduler_order(self):
+        """
+        Deferred jobs are submitted in due order, not deferral order
+        """
+        received = list()
+        done = threading.Event()
+
+        def submit(job):
+            received.append(job)
+            if len(received) == 3:
+                done.set()
+
+        scheduler = RetryScheduler(submit)
+        start = time.monotonic()
+        scheduler.defer("c", 0.15)
+        scheduler.defer("a", 0.05)
+        scheduler.defer("b", 0.1)
+        self.assertTrue(done.wait(2))
+        scheduler.stop()
+
+        self.assertEqual(["a", "b", "c"], received)
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+        self.assertEqual(0, len(scheduler))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+import logging
+from typing import Iterable, Iterator, NamedTuple
+from DownloadEngine import DownloadEngine, DownloadResult
+from Services import Config, Service
+"""
+Interface every service component implements, so services share the
+pooled DownloadEngine instead of each crawling one request at a time.
+Enumeration happens in three batched steps:
+
+    creators()      resolves every creator url of a run at once
+    posts()         lists a creator's posts as a generator of pages, a
+                    page is handed over as soon as it is listed
+    attachments()   resolves the files of a whole page at once into the
+                    urls and file names the engine downloads
+
+download() drives the three steps for every creator and streams
+attachments into the engine while later pages and creators are still
+being listed, the engine is joined once at the end. None of the steps
+download files or wait on the engine, so a caller may also drive them
+itself, for example a page at a time from an executor of an event loop.
+
+A component takes the settings of PandoraArgInterpretor.interpret and
+reads the Config entries of its service, listed by configs(). Adding a
+service takes a Service member, its Config entries and a subclass
+registered in Services.COMPONENTS. The services the README names as
+likely fit as:
+
+    Hitomi     a gallery url is a creator, posts() yields the gallery's
+               page list in one page, attachments() maps the image
+               entries to their cdn urls
+    Sankaku    a tag search url is a creator, posts() follows the
+               search's page cursor, attachments() takes the file urls
+               of a page of posts in one request
+
+Usage:
+    component = get_component(Service.KEMONO)(settings)
+    results = component.download(["https://kemono.su/patreon/user/123"], engine)
+    component.close()
+"""
+
+
+class Creator(NamedTuple):
+    """
+    Account whose posts are listed
+    """
+    # Site serving the account, 'https://kemono.su'
+    site: str
+    # Where the account posts, 'patreon' on Kemono, "" when a site has one place
+    service: str
+    # Id of the account on the site
+    id: str
+    # Url the creator was given by
+    url: str
+
+
+class Attachment(NamedTuple):
+    """
+    File of a post resolved for download
+    """
+    url: str
+    # File name under the download folder, None to name it after the url
+    fname: str | None = None
+
+
+class ServiceComponent():
+    """
+    Base of the components of Services.COMPONENTS. Subclasses implement
+    creators(), posts() and attachments(), and may override finish() and
+    close().
+    """
+    # Service whose Config entries the component reads
+    service = Service.BASIC
+
+    def __init__(self, settings: dict) -> None:
+        """
+        Args:
+            settings (dict): dict returned by PandoraArgInterpretor.interpret
+        """
+        self.settings = settings
+
+    @classmethod
+    def configs(cls) -> list[Config]:
+        """
+        Returns:
+            list[Config]: Config entries of the component's service
+        """
+        return [config for config in Config if config.value[2] == cls.service]
+
+    def creators(self, urls: Iterable[str]) -> list[Creator]:
+        """
+        Resolves creator urls in one batch
+
+        Args:
+            urls (Iterable[str]): creator urls
+
+        Raises:
+            ValueError: a url is not a creator url of the service
+
+        Returns:
+            list[Creator]: creator of every url, in order
+        """
+        raise NotImplementedError
+
+    def posts(self, creator: Creator) -> Iterator[list]:
+        """
+        Lists the posts of a creator
+
+        Args:
+            creator (Creator): creator returned by creators()
+
+        Returns:
+            Iterator[list]: pages of post records, each page yielded once it
+                is listed
+        """
+        raise NotImplementedError
+
+    def attachments(self, creator: Creator, page: list) -> list[Attachment]:
+        """
+        Resolves the files of a page of posts in one batch
+
+        Args:
+            creator (Creator): creator whose page it is
+            page (list): page yielded by posts()
+
+        Returns:
+            list[Attachment]: files to download, the files of a post together
+        """
+        raise NotImplementedError
+
+    def finish(self, creator: Creator, results: list[DownloadResult]) -> None:
+        """
+        Called once every file of creator finished downloading, does nothing
+        unless overridden
+
+        Args:
+            creator (Creator): creator downloaded
+            results (list[DownloadResult]): result of every file
+        """
+
+    def download(self, urls: Iterable[str], engine: DownloadEngine) -> list[DownloadResult]:
+        """
+        Downloads the files of every creator. Files of a page start
+        downloading while later pages and creators are listed, finish() is
+        called for every creator once all of them are downloaded.
+
+        Args:
+            urls (Iterable[str]): creator urls
+            engine (DownloadEngine): engine to download with, joined before returning
+
+        Raises:
+            ValueError: a url is not a creator url of the service
+            Exception: listing a creator failed, raised once the files
+                submitted so far are downloaded and the creators listed
+                before it are finished
+
+        Returns:
+            list[DownloadResult]: result of every file
+        """
+        creators = self.creators(urls)
+        # Creator of every file submitted, by path
+        owners = dict()
+        # Creators whose every file is submitted
+        submitted = list()
+        try:
+            for creator in creators:
+                files = 0
+                for page in self.posts(creator):
+                    for attachment in self.attachments(creator, page):
+                        owners[engine.submit(attachment.url, attachment.fname).path] = creator
+                        files += 1
+                logging.debug("{url}: {files} files submitted".format(url=creator.url, files=files))
+                submitted.append(creator)
+        finally:
+            results = engine.join()
+            by_creator = {creator: list() for creator in submitted}
+            for result in results:
+                creator_results = by_creator.get(owners.get(result.path))
+                if creator_results is not None:
+                    creator_results.append(result)
+            for creator, creator_results in by_creator.items():
+                self.finish(creator, creator_results)
+        return results
+
+    def close(self) -> None:
+        """
+        Releases what the component holds, does nothing unless overridden
+        """
+
+    def __enter__(self) -> "ServiceComponent":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
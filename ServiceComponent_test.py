@@ -0,0 +1,137 @@
+import logging
+import os
+import tempfile
+import unittest
+from unittest import mock
+import PandoraArgInterpretor
+from DownloadEngine import DownloadEngine
+from KemonoComponent import KemonoComponent
+from MockServer import MockServer, pattern
+from RetryScheduler import RetryPolicy
+from ServiceComponent import Attachment, Creator, ServiceComponent
+from Services import Config, Service, get_component
+
+
+class _GalleryComponent(ServiceComponent):
+    """
+    Service whose creators are galleries of the mock server listed in
+    pages of two files
+    """
+
+    def __init__(self, settings: dict, server: MockServer, galleries: dict[str, int]) -> None:
+        super().__init__(settings)
+        self.server = server
+        self.galleries = galleries
+        self.calls = list()
+        self.finished = dict()
+        # Galleries whose listing drops after their first page
+        self.broken = set()
+
+    def creators(self, urls):
+        creators = list()
+        for url in urls:
+            if "/gallery/" not in url:
+                raise ValueError(url)
+            creators.append(Creator(self.server.url(""), "", url.rsplit("/", 1)[1], url))
+        return creators
+
+    def posts(self, creator):
+        names = ["{id}-{i}.bin".format(id=creator.id, i=i) for i in range(self.galleries[creator.id])]
+        for start in range(0, len(names), 2):
+            if start and creator.id in self.broken:
+                raise ConnectionResetError(creator.url)
+            yield names[start:start + 2]
+
+    def attachments(self, creator, page):
+        self.calls.append(len(page))
+        return [Attachment(self.server.add_generated("/" + name, 1000, seed=len(name)), name) for name in page]
+
+    def finish(self, creator, results):
+        self.finished[creator.id] = len(results)
+
+
+class ServiceComponentTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """
+        Starts a local server and creates a scratch download folder
+        """
+        logging.basicConfig(level=logging.INFO)
+        self.server = MockServer()
+        self.server.start()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        self.tmp.cleanup()
+
+    def settings(self, *args: str) -> dict:
+        return PandoraArgInterpretor.interpret(['.py', '-d', self.tmp.name] + list(args))
+
+    def test_download(self):
+        """
+        Attachments are resolved a page at a time and downloaded by one
+        engine run, each creator finished with its own results
+        """
+        component = _GalleryComponent(self.settings(), self.server, {"a": 5, "b": 2})
+        engine = DownloadEngine(self.settings('-t', '2'), RetryPolicy(base=0.01))
+        with component, mock.patch.object(engine, "join", wraps=engine.join) as join:
+            results = component.download([self.server.url("/gallery/a"), self.server.url("/gallery/b")], engine)
+
+        self.assertEqual(7, len(results))
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual([2, 2, 1, 2], component.calls)
+        self.assertEqual({"a": 5, "b": 2}, component.finished)
+        # Creators share one engine run
+        self.assertEqual(1, join.call_count)
+        with open(os.path.join(self.tmp.name, "a-0.bin"), 'rb') as fp:
+            self.assertEqual(pattern(1000, len("a-0.bin")), fp.read())
+
+    def test_listing_error(self):
+        """
+        A creator whose listing fails stops the run only once the files
+        submitted are downloaded and the creators before it finished
+        """
+        component = _GalleryComponent(self.settings(), self.server, {"a": 3, "b": 4, "c": 1})
+        component.broken.add("b")
+        engine = DownloadEngine(self.settings(), RetryPolicy(base=0.01))
+        urls = [self.server.url("/gallery/" + gallery) for gallery in ("a", "b", "c")]
+        with mock.patch.object(engine, "join", wraps=engine.join) as join, \
+                self.assertRaises(ConnectionResetError):
+            component.download(urls, engine)
+
+        self.assertEqual(1, join.call_count)
+        self.assertEqual({"a": 3}, component.finished)
+        self.assertEqual(["a-0.bin", "a-1.bin", "a-2.bin", "b-0.bin", "b-1.bin"], sorted(os.listdir(self.tmp.name)))
+
+    def test_invalid_url(self):
+        component = _GalleryComponent(self.settings(), self.server, dict())
+        engine = DownloadEngine(self.settings(), RetryPolicy(base=0.01))
+
+        with self.assertRaises(ValueError):
+            component.download(["http://a/post/1"], engine)
+
+    def test_configs(self):
+        """
+        Components read the Config entries of their service
+        """
+        configs = KemonoComponent.configs()
+
+        self.assertIn(Config.KEMONO_SYNC, configs)
+        self.assertTrue(all(config.value[2] == Service.KEMONO for config in configs))
+        self.assertIn(Config.HELP, ServiceComponent.configs())
+
+    def test_registered(self):
+        self.assertTrue(issubclass(get_component(Service.KEMONO), ServiceComponent))
+
+    def test_not_implemented(self):
+        component = ServiceComponent(self.settings())
+
+        with self.assertRaises(NotImplementedError):
+            component.creators(["http://a/gallery/1"])
+        with self.assertRaises(NotImplementedError):
+            component.download(["http://a/gallery/1"], DownloadEngine(self.settings()))
+
+
+if __name__ == '__main__':
+    unittest.main()
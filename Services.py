@@ -1,6 +1,7 @@
 from enum import Enum
+import functools
+import importlib
 import logging
-import time
 
 
 class Service(Enum):
@@ -8,14 +9,21 @@ class Service(Enum):
     Service supported by PandoraDownloader
     Each member value is associated with its class instance name
     For example, Service.Kemono = KemonoComponent.
+    Components implement ServiceComponent and are listed in COMPONENTS.
     Author: Jeff Chen
     Date: 8/29/2023
-    # TODO add component
     """
     BASIC = 0
     KEMONO = 1
 
 
+# Module and class of the ServiceComponent of every service with one,
+# imported only once a switch of the service is used
+COMPONENTS = {
+    Service.KEMONO: ("KemonoComponent", "KemonoComponent"),
+}
+
+
 class Config(Enum):
     """
     Configurations and settings supported by Pandora. Each member value
@@ -70,13 +78,55 @@ class Config(Enum):
                     "<textfile.txt> or <url>: Bulk download from text file containing links")
     # True to unzip, false to no unzip
     UNZIP = (('-u', '--unzip'), 0, Service.BASIC,
-             ": Enables unzipping of files automatically, requires 7z and setup to be done correctly")
+             ": Extracts archives as they finish downloading, formats other than zip and tar require 7z")
     # [500, 502]
     HTTPS_CODES = (('-z', '--http_codes'), 4, Service.BASIC,
                    "\"500, 502,...\" : HTTP codes to retry downloads on, default is 429 and 403")
     # 100 for 100 retries
     HTTPS_RETRIES = (('-r', '--http_retries'), 1, Service.BASIC,
                      "<#> : Maximum number of HTTP code retries, default is infinite")
+    # 2 for at most two connections to any one host
+    HOST_CONNS = (('--host_conns',), 1, Service.BASIC,
+                  "<#> : Maximum concurrent connections per host (default is no limit besides thread count)")
+    # 1048576 for ~1MB/s
+    RATE_LIMIT = (('--rate_limit',), 1, Service.BASIC,
+                  "<#> : Maximum total download speed in bytes/sec across all threads (default is no limit)")
+    # True to download on an asyncio event loop, false for download threads
+    ASYNC_DOWNLOAD = (('-a', '--async'), 0, Service.BASIC,
+                      ": Download on a single event loop instead of threads, -t becomes the concurrent download limit")
+    # './pandora.db' to remember downloads across runs
+    DEDUP_DB = (('--dedup',), 5, Service.BASIC,
+                "<file.db> : Index of downloaded files, known files are skipped and identical files hardlinked")
+    # True to survive a crash with every finished download intact
+    SYNC_WRITES = (('--fsync',), 0, Service.BASIC,
+                   ": Flush finished downloads to disk before moving them into place, in batches")
+    # './responses.db' to revalidate listings instead of downloading them again
+    RESPONSE_CACHE = (('--cache',), 5, Service.BASIC,
+                      "<file.db> : Cache of listing responses, re-runs revalidate them with conditional requests")
+    # 67108864 for ~64MB
+    RESPONSE_CACHE_SZ = (('--cache_sz',), 1, Service.BASIC,
+                         "<#> : Maximum size of the response cache in bytes, least recently used evicted first (default is 256MB)")
+    # './metrics.json' or './metrics.prom' to watch an unattended run
+    METRICS_FILE = (('--metrics',), 5, Service.BASIC,
+                    "<file.json> or <file.prom> : Periodically dump download metrics, Prometheus text format for '.prom'")
+    # 10 for a dump and progress line every 10 seconds
+    METRICS_INTERVAL = (('--metrics_interval',), 1, Service.BASIC,
+                        "<#> : Seconds between metrics dumps and progress lines (default is 10)")
+    # './ledger.db' on a shared filesystem to split one bulk list between several processes
+    WORK_LEDGER = (('--ledger',), 5, Service.BASIC,
+                   "<file.db> : Work ledger shared by processes downloading the same bulk list, each url is fetched by one")
+    # 300 to let other processes take over the urls of a crashed one after ~5 minutes
+    WORK_LEASE = (('--lease',), 1, Service.BASIC,
+                  "<#> : Seconds a process holds ledger urls without renewing its claim (default is 300)")
+    # 'sha256', or 'blake2b' or 'xxh64' (needs the xxhash package) for faster digests
+    VERIFY_HASH = (('--verify',), 2, Service.BASIC,
+                   "<sha256|blake2b|xxh64|xxh3|xxh128> : Hash downloads as they stream, re-fetch files whose length or url's sha256 do not match")
+    # 1073741824 to keep the buffers and queues of every stage within ~1GB
+    MEMORY_BUDGET = (('-m', '--memory'), 1, Service.BASIC,
+                     "<#> : Memory budget in bytes split between download, write, parse and unzip stages, full stages block (default is no limit)")
+    # 16777216 to lose at most ~16MB of an interrupted download
+    JOURNAL_CHECKPOINT = (('--checkpoint',), 1, Service.BASIC,
+                          "<#> : Bytes downloaded between checkpoints of a partial file's resume journal, also saved every second (default is 4MB)")
     # Display help options and halt program execution
     HELP = (('-h', '--help'), -1, Service.BASIC, ": Help")
 
@@ -93,6 +143,15 @@ class Config(Enum):
     # '0 = packed, 1 = partial, 2 = unpacked'
     KEMONO_FILE_STRUCTURE = (('--kfstructure',), 1, Service.KEMONO,
                              "<#> : 0 for packed, 1 for partial unpacked, 2 for unpacked")
+    # 10000 for at most 10000 files in a folder, 0 for no limit
+    KEMONO_SHARD_SZ = (('--kshard',), 1, Service.KEMONO,
+                       "<#> : Files in a folder before continuing in a numbered folder beside it (default 10000, 0 for no limit)")
+    # './kemono.db' to remember what each creator has posted across runs
+    KEMONO_SYNC = (('--ksync',), 5, Service.KEMONO,
+                   "<file.db> : Sync state, re-runs only list posts newer than the last run using conditional requests")
+    # True to re-list every page of a creator, unchanged pages cost a 304
+    KEMONO_SYNC_FULL = (('--ksyncfull',), 0, Service.KEMONO,
+                        ": With --ksync, list every page instead of stopping at the newest known post")
 
 
 def get_all_config() -> list[tuple]:
@@ -108,20 +167,11 @@ def get_all_config() -> list[tuple]:
 def print_help() -> None:
     """
     Prints help information about how to use switches
-    May seem inefficient to create help buffer each invocation; however
-    help is usually printed just once and then the program quits out. 
     """
-    configs = get_all_config()
-    buffer = "Switch details\n"
-    for config in configs:
-        # Process tuple of switches
-        for _, n in enumerate(config[0]):
-            # print switch
-            buffer += ("{switch}{space}".format(switch=n, space=", "))
-        # Process description
-        buffer += "{d}\n".format(d=config[3])
-
-    logging.info(buffer)
+    lines = ["Switch details"]
+    for switches, _, _, description in get_all_config():
+        lines.append("".join("{switch}, ".format(switch=switch) for switch in switches) + description)
+    logging.info("\n".join(lines) + "\n")
 
 
 def __fixed_format_generator(initial):
@@ -160,6 +210,7 @@ def __fixed_format_generator(initial):
     return formatter
 
 
+@functools.cache
 def get_switch_to_info_table() -> dict:
     """
     Generates a dict table for all config switches as key and a tuple containing config id, 
@@ -181,6 +232,8 @@ def get_switch_to_info_table() -> dict:
     data_type: data to send for config, more details in Config enum in this file
     Service: What service the switch is associated with.
 
+    Built once and shared by every caller, it must not be modified.
+
     Returns:
         dict: all config switches and a tuple containing config id, 
         value to pass in, and related service as value,
@@ -192,6 +245,7 @@ def get_switch_to_info_table() -> dict:
     return (dict(dict_table))
 
 
+@functools.cache
 def get_switch_to_config_table() -> dict:
     """
     Generates a dict table for all config switches as key and value containing 
@@ -211,6 +265,9 @@ def get_switch_to_config_table() -> dict:
     "switch": what switch the KVpair is associated with
     Config.value: Config.value the switch is associated with
 
+    Built once and shared by every caller, it must not be modified, it is
+    looked up by every PandoraArgInterpretor.interpret call.
+
     Returns:
         dict: all config switches with their associated Config.value
     """
@@ -220,3 +277,60 @@ def get_switch_to_config_table() -> dict:
         for switch in config[0]:
             dict_table.append((switch, config))
     return dict(dict_table)
+
+
+def get_setting(settings: dict | None, config: Config, default=None):
+    """
+    Looks up the value a config was set to in a dict returned by
+    PandoraArgInterpretor.interpret, falling back to default when the
+    config was not provided.
+
+    Args:
+        settings (dict | None): {Service:{Config.value:param}} as returned by interpret
+        config (Config): config to look up
+        default (Any, optional): value returned if config was not set. Defaults to None.
+
+    Returns:
+        Any: param the config was set to or default
+    """
+    if not settings:
+        return default
+    return settings.get(config.value[2], {}).get(config.value, default)
+
+
+@functools.cache
+def get_component(service: Service) -> type | None:
+    """
+    Imports the component class of a service on first use, so a run pays
+    only for the services it uses
+
+    Args:
+        service (Service): service to look up
+
+    Returns:
+        type | None: ServiceComponent subclass of the service, None if it has none
+    """
+    entry = COMPONENTS.get(service)
+    if entry is None:
+        return None
+    module, name = entry
+    return getattr(importlib.import_module(module), name)
+
+
+def get_components(settings: dict | None) -> dict[Service, type]:
+    """
+    Looks up the components of the services whose switches were used
+
+    Args:
+        settings (dict | None): {Service:{Config.value:param}} as returned by interpret
+
+    Returns:
+        dict[Service, type]: component class of every service set in settings, in Service order
+    """
+    if not settings:
+        return dict()
+    components = dict()
+    for service in Service:
+        if service in settings and get_component(service) is not None:
+            components[service] = get_component(service)
+    return components
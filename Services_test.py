@@ -1,5 +1,8 @@
 import logging
+import subprocess
+import sys
 import unittest
+import PandoraArgInterpretor
 import Services
 from Services import Service
 
@@ -19,8 +22,7 @@ class ServicesTestCase(unittest.TestCase):
         Info: needs to be updated given adjustments in Config
         """
         s = Services.get_switch_to_config_table()
-        m = dict({'-d': (('-d', '--download_folder'), 6, Service.BASIC, "<path> : REQUIRED - Set download path for single instance, must use '\\' or '/'"), '--download_folder': (('-d', '--download_folder'), 6, Service.BASIC, "<path> : REQUIRED - Set download path for single instance, must use '\\' or '/'"), '-v': (('-v', '--verbose'), 1, Service.BASIC, ': 0 for no output, 1 for important info, 2 for important info and warnings, 3 for all'), '--verbose': (('-v', '--verbose'), 1, Service.BASIC, ': 0 for no output, 1 for important info, 2 for important info and warnings, 3 for all'), '-t': (('-t', '--threads'), 1, Service.BASIC, '<#> : Change download thread count (default is 6)'), '--threads': (('-t', '--threads'), 1, Service.BASIC, '<#> : Change download thread count (default is 6)'), '-c': (('-c', '--chunk_sz'), 1, Service.BASIC, '<#> : Adjust download chunk size in bytes (Default is 64M)'), '--chunk_sz': (('-c', '--chunk_sz'), 1, Service.BASIC, '<#> : Adjust download chunk size in bytes (Default is 64M)'), '-f': (('-f', '--bulk'), 5, Service.BASIC, '<textfile.txt> or <url>: Bulk download from text file containing links'), '--bulk': (('-f', '--bulk'), 5, Service.BASIC, '<textfile.txt> or <url>: Bulk download from text file containing links'), '-u': (('-u', '--unzip'), 0, Service.BASIC, ': Enables unzipping of files automatically, requires 7z and setup to be done correctly'),
-                 '--unzip': (('-u', '--unzip'), 0, Service.BASIC, ': Enables unzipping of files automatically, requires 7z and setup to be done correctly'), '-z': (('-z', '--http_codes'), 4, Service.BASIC, '"500, 502,..." : HTTP codes to retry downloads on, default is 429 and 403'), '--http_codes': (('-z', '--http_codes'), 4, Service.BASIC, '"500, 502,..." : HTTP codes to retry downloads on, default is 429 and 403'), '-r': (('-r', '--http_retries'), 1, Service.BASIC, '<#> : Maximum number of HTTP code retries, default is infinite'), '--http_retries': (('-r', '--http_retries'), 1, Service.BASIC, '<#> : Maximum number of HTTP code retries, default is infinite'), '-h': (('-h',), -1, Service.BASIC, ': Help'), '--kxftype': (('--kxftype',), 2, Service.KEMONO, '<download format> : Custom file name, tokens-> [#] counter, [server] -> server name'), '--kxfile': (('--kxfile',), 3, Service.KEMONO, '"txt, zip, ..., png" : Exclude files with listed extensions, NO \'.\'s'), '--kxpost': (('--kxpost',), 3, Service.KEMONO, '"keyword1, keyword2,..." : Keyword in excluded posts, not case sensitive'), '--kxlink': (('--kxlink',), 3, Service.KEMONO, '"keyword1, keyword2,..." : Keyword in excluded link, not case sensitive. Is for link plaintext, not its target'), '--kfstructure': (('--kfstructure',), 1, Service.KEMONO, '<#> : 0 for packed, 1 for partial unpacked, 2 for unpacked')})
+        m = dict({'-d': (('-d', '--download_folder'), 6, Service.BASIC, "<path> : REQUIRED - Set download path for single instance, must use '\\' or '/'"), '--download_folder': (('-d', '--download_folder'), 6, Service.BASIC, "<path> : REQUIRED - Set download path for single instance, must use '\\' or '/'"), '-v': (('-v', '--verbose'), 1, Service.BASIC, ': 0 for no output, 1 for important info, 2 for important info and warnings, 3 for all'), '--verbose': (('-v', '--verbose'), 1, Service.BASIC, ': 0 for no output, 1 for important info, 2 for important info and warnings, 3 for all'), '-t': (('-t', '--threads'), 1, Service.BASIC, '<#> : Change download thread count (default is 6)'), '--threads': (('-t', '--threads'), 1, Service.BASIC, '<#> : Change download thread count (default is 6)'), '-c': (('-c', '--chunk_sz'), 1, Service.BASIC, '<#> : Adjust download chunk size in bytes (Default is 64M)'), '--chunk_sz': (('-c', '--chunk_sz'), 1, Service.BASIC, '<#> : Adjust download chunk size in bytes (Default is 64M)'), '-f': (('-f', '--bulk'), 5, Service.BASIC, '<textfile.txt> or <url>: Bulk download from text file containing links'), '--bulk': (('-f', '--bulk'), 5, Service.BASIC, '<textfile.txt> or <url>: Bulk download from text file containing links'), '-u': (('-u', '--unzip'), 0, Service.BASIC, ': Extracts archives as they finish downloading, formats other than zip and tar require 7z'), '--unzip': (('-u', '--unzip'), 0, Service.BASIC, ': Extracts archives as they finish downloading, formats other than zip and tar require 7z'), '-z': (('-z', '--http_codes'), 4, Service.BASIC, '"500, 502,..." : HTTP codes to retry downloads on, default is 429 and 403'), '--http_codes': (('-z', '--http_codes'), 4, Service.BASIC, '"500, 502,..." : HTTP codes to retry downloads on, default is 429 and 403'), '-r': (('-r', '--http_retries'), 1, Service.BASIC, '<#> : Maximum number of HTTP code retries, default is infinite'), '--http_retries': (('-r', '--http_retries'), 1, Service.BASIC, '<#> : Maximum number of HTTP code retries, default is infinite'), '--host_conns': (('--host_conns',), 1, Service.BASIC, '<#> : Maximum concurrent connections per host (default is no limit besides thread count)'), '--rate_limit': (('--rate_limit',), 1, Service.BASIC, '<#> : Maximum total download speed in bytes/sec across all threads (default is no limit)'), '-a': (('-a', '--async'), 0, Service.BASIC, ': Download on a single event loop instead of threads, -t becomes the concurrent download limit'), '--async': (('-a', '--async'), 0, Service.BASIC, ': Download on a single event loop instead of threads, -t becomes the concurrent download limit'), '--dedup': (('--dedup',), 5, Service.BASIC, '<file.db> : Index of downloaded files, known files are skipped and identical files hardlinked'), '--fsync': (('--fsync',), 0, Service.BASIC, ': Flush finished downloads to disk before moving them into place, in batches'), '--cache': (('--cache',), 5, Service.BASIC, '<file.db> : Cache of listing responses, re-runs revalidate them with conditional requests'), '--cache_sz': (('--cache_sz',), 1, Service.BASIC, '<#> : Maximum size of the response cache in bytes, least recently used evicted first (default is 256MB)'), '--metrics': (('--metrics',), 5, Service.BASIC, "<file.json> or <file.prom> : Periodically dump download metrics, Prometheus text format for '.prom'"), '--metrics_interval': (('--metrics_interval',), 1, Service.BASIC, '<#> : Seconds between metrics dumps and progress lines (default is 10)'), '--ledger': (('--ledger',), 5, Service.BASIC, '<file.db> : Work ledger shared by processes downloading the same bulk list, each url is fetched by one'), '--lease': (('--lease',), 1, Service.BASIC, '<#> : Seconds a process holds ledger urls without renewing its claim (default is 300)'), '--verify': (('--verify',), 2, Service.BASIC, "<sha256|blake2b|xxh64|xxh3|xxh128> : Hash downloads as they stream, re-fetch files whose length or url's sha256 do not match"), '-m': (('-m', '--memory'), 1, Service.BASIC, '<#> : Memory budget in bytes split between download, write, parse and unzip stages, full stages block (default is no limit)'), '--memory': (('-m', '--memory'), 1, Service.BASIC, '<#> : Memory budget in bytes split between download, write, parse and unzip stages, full stages block (default is no limit)'), '--checkpoint': (('--checkpoint',), 1, Service.BASIC, "<#> : Bytes downloaded between checkpoints of a partial file's resume journal, also saved every second (default is 4MB)"), '-h': (('-h', '--help'), -1, Service.BASIC, ': Help'), '--help': (('-h', '--help'), -1, Service.BASIC, ': Help'), '--kxftype': (('--kxftype',), 2, Service.KEMONO, '<download format> : Custom file name, tokens-> [#] counter, [server] -> server name'), '--kxfile': (('--kxfile',), 3, Service.KEMONO, '"txt, zip, ..., png" : Exclude files with listed extensions, NO \'.\'s'), '--kxpost': (('--kxpost',), 3, Service.KEMONO, '"keyword1, keyword2,..." : Keyword in excluded posts, not case sensitive'), '--kxlink': (('--kxlink',), 3, Service.KEMONO, '"keyword1, keyword2,..." : Keyword in excluded link, not case sensitive. Is for link plaintext, not its target'), '--kfstructure': (('--kfstructure',), 1, Service.KEMONO, '<#> : 0 for packed, 1 for partial unpacked, 2 for unpacked'), '--kshard': (('--kshard',), 1, Service.KEMONO, '<#> : Files in a folder before continuing in a numbered folder beside it (default 10000, 0 for no limit)'), '--ksync': (('--ksync',), 5, Service.KEMONO, '<file.db> : Sync state, re-runs only list posts newer than the last run using conditional requests'), '--ksyncfull': (('--ksyncfull',), 0, Service.KEMONO, ': With --ksync, list every page instead of stopping at the newest known post')})
         self.assertEqual(s, m)
 
     def test_get_switch_to_info_table(self):
@@ -28,9 +30,43 @@ class ServicesTestCase(unittest.TestCase):
         tests get_switch_to_info_table
         """
         s = Services.get_switch_to_info_table()
-        m = dict({'-d': (0, 6, Service.BASIC), '--download_folder': (0, 6, Service.BASIC), '-v': (1, 1, Service.BASIC), '--verbose': (1, 1, Service.BASIC), '-t': (2, 1, Service.BASIC), '--threads': (2, 1, Service.BASIC), '-c': (3, 1, Service.BASIC), '--chunk_sz': (3, 1, Service.BASIC), '-f': (4, 5, Service.BASIC), '--bulk': (4, 5, Service.BASIC), '-u': (5, 0, Service.BASIC), '--unzip': (
-            5, 0, Service.BASIC), '-z': (6, 4, Service.BASIC), '--http_codes': (6, 4, Service.BASIC), '-r': (7, 1, Service.BASIC), '--http_retries': (7, 1, Service.BASIC), '-h': (8, -1, Service.BASIC), '--kxftype': (9, 2, Service.KEMONO), '--kxfile': (10, 3, Service.KEMONO), '--kxpost': (11, 3, Service.KEMONO), '--kxlink': (12, 3, Service.KEMONO), '--kfstructure': (13, 1, Service.KEMONO)})
+        m = dict({'-d': (0, 6, Service.BASIC), '--download_folder': (0, 6, Service.BASIC), '-v': (1, 1, Service.BASIC), '--verbose': (1, 1, Service.BASIC), '-t': (2, 1, Service.BASIC), '--threads': (2, 1, Service.BASIC), '-c': (3, 1, Service.BASIC), '--chunk_sz': (3, 1, Service.BASIC), '-f': (4, 5, Service.BASIC), '--bulk': (4, 5, Service.BASIC), '-u': (5, 0, Service.BASIC), '--unzip': (5, 0, Service.BASIC), '-z': (6, 4, Service.BASIC), '--http_codes': (6, 4, Service.BASIC), '-r': (7, 1, Service.BASIC), '--http_retries': (7, 1, Service.BASIC), '--host_conns': (8, 1, Service.BASIC), '--rate_limit': (9, 1, Service.BASIC), '-a': (10, 0, Service.BASIC), '--async': (10, 0, Service.BASIC), '--dedup': (11, 5, Service.BASIC), '--fsync': (12, 0, Service.BASIC), '--cache': (13, 5, Service.BASIC), '--cache_sz': (14, 1, Service.BASIC), '--metrics': (15, 5, Service.BASIC), '--metrics_interval': (16, 1, Service.BASIC), '--ledger': (17, 5, Service.BASIC), '--lease': (18, 1, Service.BASIC), '--verify': (19, 2, Service.BASIC), '-m': (20, 1, Service.BASIC), '--memory': (20, 1, Service.BASIC), '--checkpoint': (21, 1, Service.BASIC), '-h': (22, -1, Service.BASIC), '--help': (22, -1, Service.BASIC), '--kxftype': (23, 2, Service.KEMONO), '--kxfile': (24, 3, Service.KEMONO), '--kxpost': (25, 3, Service.KEMONO), '--kxlink': (26, 3, Service.KEMONO), '--kfstructure': (27, 1, Service.KEMONO), '--kshard': (28, 1, Service.KEMONO), '--ksync': (29, 5, Service.KEMONO), '--ksyncfull': (30, 0, Service.KEMONO)})
         self.assertEqual(s, m)
-        
+
+    def test_tables_built_once(self):
+        self.assertIs(Services.get_switch_to_config_table(), Services.get_switch_to_config_table())
+        self.assertIs(Services.get_switch_to_info_table(), Services.get_switch_to_info_table())
+
+    def test_print_help(self):
+        with self.assertLogs(level=logging.INFO) as logs:
+            Services.print_help()
+        lines = logs.records[0].getMessage().splitlines()
+        self.assertEqual("Switch details", lines[0])
+        self.assertEqual("-h, --help, : Help", lines[1 + [c for c in Services.Config].index(Services.Config.HELP)])
+        self.assertEqual(len(Services.Config) + 1, len(lines))
+
+    def test_get_components(self):
+        """
+        Components are looked up only for services whose switches were used
+        """
+        settings = PandoraArgInterpretor.interpret(['.py', '-d', '.'])
+        self.assertEqual({}, Services.get_components(settings))
+        self.assertEqual({}, Services.get_components(None))
+        self.assertIsNone(Services.get_component(Service.BASIC))
+        settings = PandoraArgInterpretor.interpret(['.py', '-d', '.', '--kfstructure', '1'])
+        components = Services.get_components(settings)
+        self.assertEqual([Service.KEMONO], list(components))
+        self.assertEqual("KemonoComponent", components[Service.KEMONO].__name__)
+
+    def test_lazy_imports(self):
+        """
+        Interpreting switches imports no service component
+        """
+        code = ("import sys, PandoraArgInterpretor; PandoraArgInterpretor.interpret(['.py', '-d', '.', '--kxfile', 'a']);"
+                "print('KemonoComponent' in sys.modules)")
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual("False", output.strip())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,572 @@
+import concurrent.futures
+import functools
+import logging
+import multiprocessing
+import os
+import shutil
+import struct
+import subprocess
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+from dataclasses import dataclass
+from Metrics import Metrics
+"""
+Post download stage of Config.UNZIP. Archives are extracted in a process
+pool as soon as each one finishes downloading, so extraction overlaps the
+downloads still running instead of following them. zip and tar archives
+are handled in process, anything else (7z, rar, zip methods zipfile does
+not support) is handed to the 7z executable when it is installed.
+
+Zips downloaded in a single stream are extracted while they stream by a
+StreamingZipExtractor so the archive is never read back from disk; the
+pool only extracts archives the streaming extractor could not finish.
+
+Archive 'file.zip' is extracted into the folder 'file' next to it.
+Members that would land outside that folder are refused.
+"""
+
+# Archive suffixes stripped to name the extraction folder, longest first
+ARCHIVE_SUFFIXES = (".tar.gz", ".tar.bz2", ".tar.xz", ".tgz", ".tbz2", ".txz", ".zip", ".tar", ".7z", ".rar")
+# Magic bytes of formats only 7z extracts
+SEVEN_ZIP_MAGIC = (b"7z\xbc\xaf\x27\x1c", b"Rar!\x1a\x07")
+ZIP_MAGIC = (b"PK\x03\x04", b"PK\x05\x06")
+# Executables tried for the 7z fallback
+SEVEN_ZIP_NAMES = ("7z", "7zz", "7za")
+# Decompressed bytes produced per step, bounds memory on highly compressed members
+INFLATE_SZ = 1024 * 1024
+
+
+@dataclass
+class ExtractResult:
+    """
+    Outcome of extracting an archive
+
+    path: archive extracted
+    dest: folder it was extracted into
+    files: number of files extracted
+    streamed: True if it was extracted while downloading
+    error: description of the failure, None if extraction succeeded
+    seconds: time the pool spent extracting, 0 if streamed
+    """
+    path: str
+    dest: str
+    files: int = 0
+    streamed: bool = False
+    error: str | None = None
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def get_dest(path: str) -> str:
+    """
+    Returns:
+        str: folder an archive is extracted into, the archive's path
+            without its archive suffix
+    """
+    lower = path.lower()
+    for suffix in ARCHIVE_SUFFIXES:
+        if lower.endswith(suffix) and len(path) > len(suffix):
+            return path[:-len(suffix)]
+    stem = os.path.splitext(path)[0]
+    return stem if stem != path else path + ".d"
+
+
+def is_archive(path: str) -> bool:
+    """
+    Checks the content, not the name, of a file for a supported archive
+
+    Returns:
+        bool: True if path is a zip, tar (optionally compressed), 7z or rar archive
+    """
+    try:
+        with open(path, "rb") as fp:
+            magic = fp.read(8)
+        if magic.startswith(ZIP_MAGIC) or magic.startswith(SEVEN_ZIP_MAGIC):
+            return True
+        return tarfile.is_tarfile(path)
+    except OSError:
+        return False
+
+
+def _safe_target(dest: str, name: str) -> str | None:
+    """
+    Returns the path a member named name extracts to, None if it would
+    land outside dest
+    """
+    name = name.replace("\\", "/")
+    if name.startswith("/") or (len(name) > 1 and name[1] == ":"):
+        return None
+    root = os.path.realpath(dest)
+    target = os.path.realpath(os.path.join(root, name))
+    if target != root and not target.startswith(root + os.sep):
+        return None
+    return target
+
+
+def _extract_zip(path: str, dest: str) -> int:
+    """
+    Extracts a zip member by member, refusing members outside dest
+
+    Returns:
+        int: files extracted
+    """
+    files = 0
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            target = _safe_target(dest, info.filename)
+            if target is None:
+                logging.warning("Refusing to extract {name} outside {dest}".format(name=info.filename, dest=dest))
+                continue
+            if info.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with archive.open(info) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, INFLATE_SZ)
+            files += 1
+    return files
+
+
+def _extract_tar(path: str, dest: str) -> int:
+    """
+    Extracts a tar, links and special files are skipped and members
+    outside dest refused
+
+    Returns:
+        int: files extracted
+    """
+    with tarfile.open(path) as archive:
+        members = list()
+        for member in archive:
+            if not (member.isfile() or member.isdir()) or _safe_target(dest, member.name) is None:
+                logging.warning("Refusing to extract {name} from {path}".format(name=member.name, path=path))
+                continue
+            members.append(member)
+        if hasattr(tarfile, "data_filter"):
+            archive.extractall(dest, members, filter="data")
+        else:
+            archive.extractall(dest, members)
+        return sum(1 for member in members if member.isfile())
+
+
+def _extract_7z(path: str, dest: str) -> int:
+    """
+    Extracts with the 7z executable
+
+    Raises:
+        RuntimeError: 7z is not installed or failed
+
+    Returns:
+        int: files in dest after extraction
+    """
+    exe = next((found for found in map(shutil.which, SEVEN_ZIP_NAMES) if found), None)
+    if exe is None:
+        raise RuntimeError("{path} needs 7z, which is not installed".format(path=path))
+    completed = subprocess.run([exe, "x", "-y", "-o" + dest, path], stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE)
+    if completed.returncode != 0:
+        raise RuntimeError("7z exited with {code}: {error}".format(
+            code=completed.returncode, error=completed.stderr.decode(errors="replace").strip()))
+    return sum(len(names) for _, _, names in os.walk(dest))
+
+
+def extract(path: str, dest: str | None = None) -> ExtractResult:
+    """
+    Extracts an archive, in process when possible and with 7z otherwise.
+    Runs in the pool's worker processes.
+
+    Args:
+        path (str): archive to extract
+        dest (str | None, optional): folder to extract into. Defaults to None
+            for get_dest(path).
+
+    Returns:
+        ExtractResult: outcome of the extraction
+    """
+    dest = dest or get_dest(path)
+    start = time.perf_counter()
+    try:
+        os.makedirs(dest, exist_ok=True)
+        files = None
+        if zipfile.is_zipfile(path):
+            try:
+                files = _extract_zip(path, dest)
+            except NotImplementedError:
+                # Compression method zipfile lacks, deflate64 for example
+                pass
+        elif tarfile.is_tarfile(path):
+            files = _extract_tar(path, dest)
+        if files is None:
+            files = _extract_7z(path, dest)
+        return ExtractResult(path, dest, files, seconds=time.perf_counter() - start)
+    except Exception as e:
+        return ExtractResult(path, dest, error=repr(e), seconds=time.perf_counter() - start)
+
+
+class StreamingZipExtractor():
+    """
+    Extracts a zip from its bytes in download order by following the local
+    file headers, fed through update() like a hashlib object. Stored and
+    deflated members are supported, including members whose sizes follow
+    them in a data descriptor when they are deflated. Any other member or a
+    malformed archive stops the extractor and sets failed; update() never
+    raises so a bad archive cannot break the download feeding it.
+    """
+    # Parser states
+    __HEADER = 0
+    __DATA = 1
+    __DESCRIPTOR = 2
+    __DONE = 3
+    __LOCAL = b"PK\x03\x04"
+    __ENDS = (b"PK\x01\x02", b"PK\x05\x06", b"PK\x06\x06")
+    __HEADER_FMT = struct.Struct("<4sHHHHHIIIHH")
+
+    def __init__(self, dest: str) -> None:
+        """
+        Args:
+            dest (str): folder to extract into
+        """
+        self.dest = dest
+        self.files = 0
+        self.failed = None
+        self.written = list()
+        self.__buffer = bytearray()
+        self.__state = self.__HEADER
+        self.__entry = None
+
+    @property
+    def complete(self) -> bool:
+        """
+        Returns:
+            bool: True once the central directory was reached with every
+                member extracted
+        """
+        return self.__state == self.__DONE and self.failed is None
+
+    def update(self, data: bytes) -> None:
+        """
+        Feeds the next bytes of the archive
+        """
+        if self.failed is not None or self.__state == self.__DONE:
+            return
+        self.__buffer += data
+        try:
+            while self.__step():
+                pass
+        except Exception as e:
+            self.__fail(repr(e))
+
+    def abort(self) -> None:
+        """
+        Stops extracting and removes every file extracted so far
+        """
+        if self.failed is None:
+            self.__fail("aborted")
+        for path in self.written:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.written.clear()
+
+    def __fail(self, reason: str) -> None:
+        self.failed = reason
+        self.__buffer = bytearray()
+        if self.__entry and self.__entry["fp"]:
+            self.__entry["fp"].close()
+        self.__entry = None
+
+    def __step(self) -> bool:
+        """
+        Parses as much of the buffer as the current state allows
+
+        Returns:
+            bool: True if progress was made and parsing should continue
+        """
+        if self.__state == self.__HEADER:
+            return self.__header()
+        if self.__state == self.__DATA:
+            return self.__data()
+        if self.__state == self.__DESCRIPTOR:
+            return self.__descriptor()
+        return False
+
+    def __header(self) -> bool:
+        """
+        Parses a local file header and opens its member
+        """
+        buffer = self.__buffer
+        if len(buffer) < 4:
+            return False
+        if bytes(buffer[:4]) in self.__ENDS:
+            self.__state = self.__DONE
+            self.__buffer = bytearray()
+            return False
+        if bytes(buffer[:4]) != self.__LOCAL:
+            self.__fail("Not a zip local file header")
+            return False
+        if len(buffer) < self.__HEADER_FMT.size:
+            return False
+        _, _, flags, method, _, _, crc, csize, usize, nlen, elen = self.__HEADER_FMT.unpack_from(buffer)
+        end = self.__HEADER_FMT.size + nlen + elen
+        if len(buffer) < end:
+            return False
+        raw_name = bytes(buffer[self.__HEADER_FMT.size:self.__HEADER_FMT.size + nlen])
+        extra = bytes(buffer[self.__HEADER_FMT.size + nlen:end])
+        del buffer[:end]
+
+        deferred = bool(flags & 0x08)
+        name = raw_name.decode("utf-8" if flags & 0x800 else "cp437")
+        target = _safe_target(self.dest, name)
+        if target is None:
+            self.__fail("Member {name} outside {dest}".format(name=name, dest=self.dest))
+            return False
+        if flags & 0x01:
+            self.__fail("Encrypted member")
+            return False
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) or (deferred and method == zipfile.ZIP_STORED):
+            self.__fail("Cannot stream compression method {method}".format(method=method))
+            return False
+        if csize == 0xFFFFFFFF or usize == 0xFFFFFFFF:
+            csize = self.__zip64_size(extra, usize == 0xFFFFFFFF, csize)
+        if name.endswith("/"):
+            # Directory, any data it carries is an empty deflate stream
+            os.makedirs(target, exist_ok=True)
+            fp = None
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fp = open(target, "wb")
+            self.written.append(target)
+        self.__entry = {"fp": fp, "name": name, "crc": 0, "expected": crc, "deferred": deferred,
+                        "remaining": None if deferred else csize,
+                        "inflate": zlib.decompressobj(-15) if method == zipfile.ZIP_DEFLATED else None}
+        self.__state = self.__DATA
+        return True
+
+    @staticmethod
+    def __zip64_size(extra: bytes, has_usize: bool, csize: int) -> int:
+        """
+        Reads the compressed size from a zip64 extra field
+        """
+        offset = 0
+        while offset + 4 <= len(extra):
+            tag, size = struct.unpack_from("<HH", extra, offset)
+            if tag == 0x0001:
+                return struct.unpack_from("<Q", extra, offset + 4 + (8 if has_usize else 0))[0]
+            offset += 4 + size
+        return csize
+
+    def __data(self) -> bool:
+        """
+        Writes member data, inflating it if deflated
+        """
+        entry = self.__entry
+        inflate = entry["inflate"]
+        if entry["remaining"] != 0:
+            if not self.__buffer:
+                return False
+            take = len(self.__buffer) if entry["remaining"] is None else min(len(self.__buffer), entry["remaining"])
+            chunk = bytes(self.__buffer[:take])
+            del self.__buffer[:take]
+            if entry["remaining"] is not None:
+                entry["remaining"] -= take
+            if inflate is None:
+                self.__write(chunk)
+            else:
+                while chunk and not inflate.eof:
+                    self.__write(inflate.decompress(chunk, INFLATE_SZ))
+                    chunk = inflate.unconsumed_tail
+                if inflate.eof and entry["remaining"] is None:
+                    # Bytes past the end of the deflate stream belong to the descriptor
+                    self.__buffer[:0] = inflate.unused_data
+                    self.__state = self.__DESCRIPTOR
+                    return True
+        if entry["remaining"] == 0:
+            if inflate is not None:
+                self.__write(inflate.flush())
+            self.__close(entry["expected"])
+            self.__state = self.__HEADER
+            return True
+        return False
+
+    def __descriptor(self) -> bool:
+        """
+        Reads the data descriptor following a member of unknown size. Its
+        length varies, the next header signature tells which one was used.
+        """
+        buffer = self.__buffer
+        if len(buffer) < 28:
+            return False
+        offset = 4 if bytes(buffer[:4]) == b"PK\x07\x08" else 0
+        for length in (offset + 12, offset + 20):
+            if bytes(buffer[length:length + 2]) == b"PK":
+                crc = struct.unpack_from("<I", buffer, offset)[0]
+                del buffer[:length]
+                if self.__entry:
+                    self.__close(crc)
+                self.__state = self.__HEADER
+                return True
+        self.__fail("Malformed data descriptor")
+        return False
+
+    def __write(self, data: bytes) -> None:
+        if data and self.__entry["fp"]:
+            self.__entry["fp"].write(data)
+            self.__entry["crc"] = zlib.crc32(data, self.__entry["crc"])
+
+    def __close(self, expected: int) -> None:
+        """
+        Closes the current member, checking its CRC
+        """
+        entry = self.__entry
+        self.__entry = None
+        if entry["fp"] is None:
+            return
+        entry["fp"].close()
+        if entry["crc"] != expected:
+            raise ValueError("CRC mismatch in {name}".format(name=entry["name"]))
+        self.files += 1
+
+
+class UnzipStage():
+    """
+    Extracts finished archives in a pool of worker processes. The pool is
+    started with the first archive, so runs without archives pay nothing.
+    Thread safe.
+    """
+
+    def __init__(self, workers: int | None = None, metrics: Metrics | None = None,
+                 max_pending: int | None = None) -> None:
+        """
+        Args:
+            workers (int | None, optional): extraction processes. Defaults to
+                None for one per CPU.
+            metrics (Metrics | None, optional): records extraction times.
+                Defaults to None for a private Metrics.
+            max_pending (int | None, optional): archives in the pool before
+                submit blocks, None for no limit. Defaults to None.
+        """
+        self.workers = workers
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.max_pending = max_pending
+        self.results = list()
+        self.__executor = None
+        self.__futures = set()
+        self.__slots = threading.Semaphore(max_pending) if max_pending is not None else None
+        self.__streams = dict()
+        self.__lock = threading.Lock()
+        self.metrics.gauge("queue_depth", self.__len__, stage="unzip")
+
+    def __len__(self) -> int:
+        """
+        Returns:
+            int: archives submitted to the pool and not extracted yet
+        """
+        with self.__lock:
+            return sum(not future.done() for future in self.__futures)
+
+    def stream(self, path: str) -> StreamingZipExtractor | None:
+        """
+        Creates an extractor for a zip about to be downloaded to path in a
+        single stream. submit() or discard() must follow once the download ends.
+
+        Args:
+            path (str): final path of the download
+
+        Returns:
+            StreamingZipExtractor | None: extractor to feed the body to, None if
+                path is not named like a zip
+        """
+        if not path.lower().endswith(".zip"):
+            return None
+        extractor = StreamingZipExtractor(get_dest(path))
+        with self.__lock:
+            self.__streams[path] = extractor
+        return extractor
+
+    def discard(self, path: str) -> None:
+        """
+        Drops the extractor of a download that failed along with its files
+        """
+        with self.__lock:
+            extractor = self.__streams.pop(path, None)
+        if extractor:
+            extractor.abort()
+
+    def submit(self, path: str) -> None:
+        """
+        Schedules a finished download for extraction, files that are not
+        archives are ignored. Returns without waiting for the extraction,
+        unless max_pending archives are already in the pool.
+
+        Args:
+            path (str): downloaded file
+        """
+        with self.__lock:
+            extractor = self.__streams.pop(path, None)
+        if extractor and extractor.complete:
+            self.__done(ExtractResult(path, extractor.dest, extractor.files, True))
+            return
+        if extractor:
+            logging.debug("Streaming extraction of {path} stopped: {reason}".format(path=path, reason=extractor.failed))
+        if not is_archive(path):
+            return
+        if self.__slots is not None:
+            self.__slots.acquire()
+        with self.__lock:
+            if self.__executor is None:
+                # Download threads are running, fork could copy a held lock
+                self.__executor = concurrent.futures.ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn"))
+            future = self.__executor.submit(extract, path)
+            self.__futures.add(future)
+        future.add_done_callback(functools.partial(self.__collect, path))
+
+    def join(self) -> list[ExtractResult]:
+        """
+        Waits for every submitted archive and stops the worker processes
+
+        Returns:
+            list[ExtractResult]: every extraction finished so far
+        """
+        with self.__lock:
+            executor = self.__executor
+            self.__executor = None
+        if executor:
+            executor.shutdown(wait=True)
+        with self.__lock:
+            self.__futures.clear()
+            return list(self.results)
+
+    def __collect(self, path: str, future: concurrent.futures.Future) -> None:
+        """
+        Records the result of a pool extraction
+        """
+        try:
+            result = future.result()
+        except Exception as e:
+            # Worker process died
+            result = ExtractResult(path, get_dest(path), error=repr(e))
+        with self.__lock:
+            self.__futures.discard(future)
+        if self.__slots is not None:
+            self.__slots.release()
+        self.__done(result)
+
+    def __done(self, result: ExtractResult) -> None:
+        if not result.streamed:
+            self.metrics.observe("unzip_seconds", result.seconds)
+            self.metrics.inc("stage_seconds_total", result.seconds, stage="unzip")
+        if result.error:
+            logging.warning("Failed to extract {path}: {error}".format(path=result.path, error=result.error))
+        else:
+            logging.info("Extracted {n} files from {path}{how}".format(
+                n=result.files, path=result.path, how=" while downloading" if result.streamed else ""))
+        with self.__lock:
+            self.results.append(result)
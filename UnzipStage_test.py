@@ -0,0 +1,225 @@
+import io
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from UnzipStage import StreamingZipExtractor, UnzipStage, extract, get_dest, is_archive
+
+
+class _Unseekable(io.RawIOBase):
+    """
+    Write only stream, zipfile writes sizes into data descriptors when it
+    cannot seek back, the way archives produced on the fly are served
+    """
+
+    def __init__(self) -> None:
+        self.data = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.data += data
+        return len(data)
+
+
+MEMBERS = {"a.txt": b"hello" * 1000, "sub/b.bin": bytes(range(256)) * 300, "empty.txt": b"",
+           "big.txt": b"x" * 3000000}
+
+
+def make_zip(method: int = zipfile.ZIP_DEFLATED, seekable: bool = True, members: dict = MEMBERS) -> bytes:
+    """
+    Returns:
+        bytes: zip archive of members
+    """
+    fp = io.BytesIO() if seekable else _Unseekable()
+    with zipfile.ZipFile(fp, "w", method) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return fp.getvalue() if seekable else bytes(fp.data)
+
+
+class UnzipStageTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """
+        Creates a scratch folder
+        """
+        logging.basicConfig(level=logging.INFO)
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def write(self, fname: str, data: bytes) -> str:
+        path = os.path.join(self.tmp.name, fname)
+        with open(path, 'wb') as fp:
+            fp.write(data)
+        return path
+
+    def assertExtracted(self, dest: str, members: dict = MEMBERS) -> None:
+        for name, data in members.items():
+            with open(os.path.join(dest, name), 'rb') as fp:
+                self.assertEqual(data, fp.read(), name)
+
+    def test_get_dest(self):
+        """
+        Archive suffixes are stripped to name the extraction folder
+        """
+        self.assertEqual("/d/a", get_dest("/d/a.zip"))
+        self.assertEqual("/d/a", get_dest("/d/a.tar.gz"))
+        self.assertEqual("/d/a.v2", get_dest("/d/a.v2.ZIP"))
+        self.assertEqual("/d/a", get_dest("/d/a.bin"))
+        self.assertEqual("/d/a.d", get_dest("/d/a"))
+
+    def test_is_archive(self):
+        """
+        Archives are recognized by content
+        """
+        self.assertTrue(is_archive(self.write("a.bin", make_zip())))
+        self.assertFalse(is_archive(self.write("b.zip", b"not a zip at all")))
+        self.assertFalse(is_archive(os.path.join(self.tmp.name, "missing")))
+
+    def test_extract_zip(self):
+        """
+        Zip is extracted next to itself
+        """
+        result = extract(self.write("a.zip", make_zip()))
+
+        self.assertTrue(result.ok)
+        self.assertEqual(4, result.files)
+        self.assertExtracted(os.path.join(self.tmp.name, "a"))
+
+    def test_extract_tar(self):
+        """
+        Compressed tar is extracted, links are skipped
+        """
+        src = os.path.join(self.tmp.name, "src")
+        os.makedirs(os.path.join(src, "sub"))
+        for name, data in MEMBERS.items():
+            self.write(os.path.join("src", name), data)
+        os.symlink("/etc/passwd", os.path.join(src, "link"))
+        path = os.path.join(self.tmp.name, "a.tar.gz")
+        with tarfile.open(path, "w:gz") as archive:
+            for name in list(MEMBERS) + ["link"]:
+                archive.add(os.path.join(src, name), name)
+        result = extract(path)
+
+        self.assertTrue(result.ok)
+        self.assertEqual(4, result.files)
+        self.assertExtracted(os.path.join(self.tmp.name, "a"))
+        self.assertFalse(os.path.lexists(os.path.join(self.tmp.name, "a", "link")))
+
+    def test_traversal(self):
+        """
+        Members escaping the extraction folder are refused
+        """
+        members = {"ok.txt": b"ok", "../evil.txt": b"evil", "/abs.txt": b"evil"}
+        path = self.write("a.zip", make_zip(members=members))
+        result = extract(path)
+
+        self.assertTrue(result.ok)
+        self.assertEqual(1, result.files)
+        self.assertEqual(["a", "a.zip"], sorted(os.listdir(self.tmp.name)))
+
+        extractor = StreamingZipExtractor(os.path.join(self.tmp.name, "s"))
+        extractor.update(make_zip(members={"../evil.txt": b"evil"}))
+        self.assertIsNotNone(extractor.failed)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "evil.txt")))
+
+    def test_not_archive(self):
+        """
+        Files that are not archives of any format fail when 7z is missing
+        """
+        result = extract(self.write("a.zip", b"garbage"))
+        if shutil.which("7z") is None:
+            self.assertFalse(result.ok)
+
+    def test_streaming(self):
+        """
+        Stored, deflated and descriptor zips are extracted from odd sized pieces
+        """
+        for i, (method, seekable) in enumerate([(zipfile.ZIP_STORED, True), (zipfile.ZIP_DEFLATED, True),
+                                                (zipfile.ZIP_DEFLATED, False)]):
+            data = make_zip(method, seekable)
+            for step in (7777, len(data)):
+                dest = os.path.join(self.tmp.name, "{i}-{step}".format(i=i, step=step))
+                extractor = StreamingZipExtractor(dest)
+                for offset in range(0, len(data), step):
+                    extractor.update(memoryview(data)[offset:offset + step])
+
+                self.assertTrue(extractor.complete, extractor.failed)
+                self.assertEqual(4, extractor.files)
+                self.assertExtracted(dest)
+
+    def test_streaming_unsupported(self):
+        """
+        Stored members of unknown size cannot be streamed, the pool extracts them
+        """
+        data = make_zip(zipfile.ZIP_STORED, seekable=False)
+        path = self.write("a.zip", data)
+        stage = UnzipStage(1)
+        stage.stream(path).update(data)
+        stage.submit(path)
+        results = stage.join()
+
+        self.assertEqual(1, len(results))
+        self.assertTrue(results[0].ok)
+        self.assertFalse(results[0].streamed)
+        self.assertExtracted(os.path.join(self.tmp.name, "a"))
+
+    def test_streaming_abort(self):
+        """
+        Files extracted from a download that failed are removed
+        """
+        data = make_zip(members={"a.txt": b"a" * 1000, "b.txt": b"b" * 1000})
+        stage = UnzipStage(1)
+        path = os.path.join(self.tmp.name, "a.zip")
+        stage.stream(path).update(data[:len(data) // 2 + 100])
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, "a", "a.txt")))
+        stage.discard(path)
+
+        self.assertEqual([], os.listdir(os.path.join(self.tmp.name, "a")))
+        self.assertEqual([], stage.join())
+
+    def test_stage(self):
+        """
+        Streamed zips are not extracted twice, non archives are ignored
+        """
+        stage = UnzipStage(2)
+        streamed = self.write("s.zip", make_zip())
+        extractor = stage.stream(streamed)
+        extractor.update(make_zip())
+        self.assertIsNone(stage.stream(self.write("x.bin", b"x")))
+        for name in ("p1.zip", "p2.zip"):
+            stage.submit(self.write(name, make_zip()))
+        stage.submit(streamed)
+        stage.submit(os.path.join(self.tmp.name, "x.bin"))
+        results = {os.path.basename(r.path): r for r in stage.join()}
+
+        self.assertEqual({"s.zip", "p1.zip", "p2.zip"}, set(results))
+        self.assertTrue(results["s.zip"].streamed)
+        self.assertTrue(all(r.ok for r in results.values()))
+        for name in ("s", "p1", "p2"):
+            self.assertExtracted(os.path.join(self.tmp.name, name))
+
+    def test_max_pending(self):
+        """
+        Submit blocks while max_pending archives wait for the pool
+        """
+        stage = UnzipStage(1, max_pending=1)
+        members = {"a.txt": b"a"}
+        for i in range(4):
+            stage.submit(self.write("{i}.zip".format(i=i), make_zip(members=members)))
+            self.assertLessEqual(len(stage), 1)
+        results = stage.join()
+
+        self.assertEqual(4, len(results))
+        self.assertTrue(all(r.ok for r in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,352 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Iterable, Iterator
+from BulkReader import iter_links
+from Services import Config, get_setting
+"""
+Shared ledger of Config.WORK_LEDGER that lets several Pandora processes,
+on one machine or several machines sharing a filesystem, download one
+Config.DOWNLOAD_URL list together without fetching any url twice.
+
+Every process loads the list into the ledger, duplicates are ignored and
+a list already loaded whole is not read again, then claims urls in
+batches. A claim is a lease of Config.WORK_LEASE seconds that a heartbeat
+renews while the process is alive, the claims of a process that crashed
+expire and are taken over by the others. A url claimed MAX_CLAIMS times
+without finishing is given up on as failed, it is likely what crashed
+its workers.
+
+The ledger is a sqlite database in rollback journal mode, sqlite's WAL
+mode only works for processes on one machine. Machines sharing a ledger
+need a filesystem with working locks and clocks within a few seconds of
+each other.
+
+Usage:
+    with WorkLedger(path) as ledger:
+        ledger.load_source(source)
+        for url in ledger.claims(12):
+            ...
+            ledger.complete(url, ok)
+"""
+
+DEFAULT_LEASE = 300
+# Claims of one url before it is failed
+MAX_CLAIMS = 5
+# Links inserted per transaction when loading
+LOAD_BATCH = 5000
+# Completions buffered before they are written
+COMPLETE_BATCH = 64
+# Item states
+PENDING = 0
+CLAIMED = 1
+DONE = 2
+FAILED = 3
+STATE_NAMES = {PENDING: "pending", CLAIMED: "claimed", DONE: "done", FAILED: "failed"}
+
+
+def make_owner() -> str:
+    """
+    Returns:
+        str: id of this process unique across machines, 'host-pid-random'
+    """
+    return "{host}-{pid}-{rand}".format(host=socket.gethostname(), pid=os.getpid(), rand=uuid.uuid4().hex[:8])
+
+
+class WorkLedger():
+    """
+    Connection of one process to a shared ledger of urls. Thread safe,
+    the engine's producer claims while its workers complete.
+    """
+
+    def __init__(self, path: str, lease: float = DEFAULT_LEASE, owner: str | None = None) -> None:
+        """
+        Args:
+            path (str): database file, created if it does not exist
+            lease (float, optional): seconds a claim lasts without renewal. Defaults to DEFAULT_LEASE.
+            owner (str | None, optional): id claims are made under. Defaults to None for make_owner().
+
+        Raises:
+            ValueError: lease is not positive
+        """
+        if lease <= 0:
+            raise ValueError("lease must be positive")
+        self.path = path
+        self.lease = lease
+        self.owner = owner or make_owner()
+        # Seconds between looks for expired claims once nothing is pending
+        self.poll_interval = min(lease / 4, 5)
+        self.__completed = list()
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__heartbeat = None
+        # Waits up to 60s for another process's transaction instead of failing
+        self.__db = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        with self.__lock:
+            self.__db.execute("PRAGMA journal_mode=DELETE")
+            self.__transaction(
+                "CREATE TABLE IF NOT EXISTS items (url TEXT PRIMARY KEY, state INTEGER NOT NULL DEFAULT 0, "
+                "owner TEXT, lease_until REAL, claims INTEGER NOT NULL DEFAULT 0)",
+                "CREATE INDEX IF NOT EXISTS items_state ON items (state, lease_until)",
+                "CREATE TABLE IF NOT EXISTS sources (key TEXT PRIMARY KEY, links INTEGER)")
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> "WorkLedger | None":
+        """
+        Args:
+            settings (dict): dict returned by PandoraArgInterpretor.interpret
+
+        Raises:
+            ValueError: Config.WORK_LEASE is not positive
+
+        Returns:
+            WorkLedger | None: ledger of Config.WORK_LEDGER, None if not set
+        """
+        path = get_setting(settings, Config.WORK_LEDGER)
+        if not path:
+            return None
+        return cls(path, get_setting(settings, Config.WORK_LEASE, DEFAULT_LEASE))
+
+    def __enter__(self) -> "WorkLedger":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def load(self, links: Iterable[str], key: str | None = None) -> int:
+        """
+        Adds links to the ledger, links already in it keep their state
+
+        Args:
+            links (Iterable[str]): links to add, consumed in batches
+            key (str | None, optional): identifies the list, a list whose key
+                was loaded whole before is skipped. Defaults to None to always load.
+
+        Returns:
+            int: links added
+        """
+        if key is not None:
+            with self.__lock:
+                if self.__db.execute("SELECT 1 FROM sources WHERE key = ?", (key,)).fetchone():
+                    return 0
+        added = 0
+        total = 0
+        batch = list()
+        for link in links:
+            batch.append((link,))
+            if len(batch) >= LOAD_BATCH:
+                added += self.__insert(batch)
+                total += len(batch)
+                batch = list()
+        added += self.__insert(batch)
+        total += len(batch)
+        if key is not None:
+            with self.__lock:
+                self.__db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?)", (key, total))
+        return added
+
+    def load_source(self, source: str) -> int:
+        """
+        Loads a Config.DOWNLOAD_URL source, a file is skipped if this exact
+        file, by size and modification time, was loaded whole before
+
+        Returns:
+            int: links added
+        """
+        key = None
+        if os.path.isfile(source):
+            stat = os.stat(source)
+            key = "{path}:{size}:{mtime}".format(path=os.path.abspath(source), size=stat.st_size,
+                                                  mtime=stat.st_mtime_ns)
+        added = self.load(iter_links(source), key)
+        logging.info("Work ledger {path}: {added} links added from {source}".format(
+            path=self.path, added=added, source=source))
+        return added
+
+    def claim(self, n: int, now: float | None = None) -> list[str]:
+        """
+        Claims up to n pending urls, or urls whose claim expired, oldest first
+
+        Args:
+            n (int): most urls to claim
+            now (float | None, optional): current time. Defaults to None for time.time().
+
+        Returns:
+            list[str]: urls claimed by this process
+        """
+        now = time.time() if now is None else now
+        self.flush()
+        with self.__lock:
+            self.__db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.__db.execute("SELECT url, claims FROM items WHERE state = ? ORDER BY rowid LIMIT ?",
+                                         (PENDING, n)).fetchall()
+                if len(rows) < n:
+                    rows += self.__db.execute("SELECT url, claims FROM items WHERE state = ? AND lease_until < ? "
+                                              "LIMIT ?", (CLAIMED, now, n - len(rows))).fetchall()
+                poisoned = [(FAILED, url) for url, claims in rows if claims >= MAX_CLAIMS]
+                claimed = [url for url, claims in rows if claims < MAX_CLAIMS]
+                self.__db.executemany("UPDATE items SET state = ? WHERE url = ?", poisoned)
+                self.__db.executemany("UPDATE items SET state = ?, owner = ?, lease_until = ?, claims = claims + 1 "
+                                      "WHERE url = ?", [(CLAIMED, self.owner, now + self.lease, url) for url in claimed])
+                self.__db.execute("COMMIT")
+            except BaseException:
+                self.__db.execute("ROLLBACK")
+                raise
+        for url, _ in poisoned:
+            logging.warning("Giving up on {url}, claimed {n} times without finishing".format(url=url, n=MAX_CLAIMS))
+        if claimed:
+            self.__start_heartbeat()
+        return claimed
+
+    def complete(self, url: str, ok: bool) -> None:
+        """
+        Marks a claimed url done or failed, written with the next batch
+
+        Args:
+            url (str): url claimed by this process
+            ok (bool): True if it was downloaded
+        """
+        with self.__lock:
+            self.__completed.append((DONE if ok else FAILED, url, self.owner))
+            full = len(self.__completed) >= COMPLETE_BATCH
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes the completions buffered so far
+        """
+        with self.__lock:
+            if not self.__completed:
+                return
+            completed = self.__completed
+            self.__completed = list()
+            # A url this process lost to another after its lease expired stays theirs
+            self.__transaction(("UPDATE items SET state = ?, lease_until = NULL WHERE url = ? AND owner = ?",
+                                completed))
+
+    def renew(self, now: float | None = None) -> int:
+        """
+        Extends the lease of every url this process holds
+
+        Returns:
+            int: urls renewed
+        """
+        now = time.time() if now is None else now
+        with self.__lock:
+            cursor = self.__db.execute("UPDATE items SET lease_until = ? WHERE owner = ? AND state = ?",
+                                       (now + self.lease, self.owner, CLAIMED))
+            return cursor.rowcount
+
+    def claims(self, batch_sz: int, wait: bool = True) -> Iterator[str]:
+        """
+        Yields urls claimed batch_sz at a time until none are left
+
+        Args:
+            batch_sz (int): urls claimed at a time
+            wait (bool, optional): while other processes hold claims, keep
+                polling every poll_interval seconds so claims expiring after
+                a crash are taken over. Defaults to True.
+
+        Yields:
+            str: url claimed by this process
+        """
+        while True:
+            urls = self.claim(batch_sz)
+            if urls:
+                yield from urls
+                continue
+            if not wait or not self.held_elsewhere():
+                return
+            self.__stop.wait(self.poll_interval)
+
+    def held_elsewhere(self) -> int:
+        """
+        Returns:
+            int: urls claimed by other processes and not finished
+        """
+        with self.__lock:
+            return self.__db.execute("SELECT COUNT(*) FROM items WHERE state = ? AND owner != ?",
+                                     (CLAIMED, self.owner)).fetchone()[0]
+
+    def counts(self) -> dict[str, int]:
+        """
+        Returns:
+            dict[str, int]: urls of the ledger per state name
+        """
+        self.flush()
+        counts = {name: 0 for name in STATE_NAMES.values()}
+        with self.__lock:
+            for state, n in self.__db.execute("SELECT state, COUNT(*) FROM items GROUP BY state"):
+                counts[STATE_NAMES[state]] = n
+        return counts
+
+    def close(self) -> None:
+        """
+        Writes buffered completions, hands urls still claimed back to the
+        other processes and closes the database
+        """
+        self.__stop.set()
+        if self.__heartbeat is not None:
+            self.__heartbeat.join()
+            self.__heartbeat = None
+        self.flush()
+        with self.__lock:
+            self.__transaction(("UPDATE items SET state = ?, owner = NULL, lease_until = NULL "
+                                "WHERE owner = ? AND state = ?", [(PENDING, self.owner, CLAIMED)]))
+            self.__db.close()
+
+    def __insert(self, batch: list[tuple[str]]) -> int:
+        """
+        Inserts a batch of links in one transaction
+
+        Returns:
+            int: links that were new
+        """
+        if not batch:
+            return 0
+        with self.__lock:
+            before = self.__db.total_changes
+            self.__transaction(("INSERT OR IGNORE INTO items (url) VALUES (?)", batch))
+            return self.__db.total_changes - before
+
+    def __transaction(self, *statements: str | tuple[str, list]) -> None:
+        """
+        Runs statements, or (statement, rows) pairs run for every row, in
+        one write transaction, lock must be held
+        """
+        self.__db.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in statements:
+                if isinstance(statement, tuple):
+                    self.__db.executemany(*statement)
+                else:
+                    self.__db.execute(statement)
+            self.__db.execute("COMMIT")
+        except BaseException:
+            self.__db.execute("ROLLBACK")
+            raise
+
+    def __start_heartbeat(self) -> None:
+        with self.__lock:
+            if self.__heartbeat is not None:
+                return
+            self.__heartbeat = threading.Thread(target=self.__beat, name="pandora-ledger", daemon=True)
+            self.__heartbeat.start()
+
+    def __beat(self) -> None:
+        """
+        Renews the leases of this process and writes its completions a few
+        times per lease
+        """
+        while not self.__stop.wait(self.lease / 3):
+            try:
+                self.flush()
+                self.renew()
+            except sqlite3.Error as e:
+                logging.warning("Could not renew work ledger claims: {error}".format(error=repr(e)))
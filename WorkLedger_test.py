@@ -0,0 +1,170 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+import unittest
+import PandoraArgInterpretor
+import WorkLedger as ledger_module
+from AsyncDownloadEngine import AsyncDownloadEngine
+from DownloadEngine import DownloadEngine
+from MockServer import MockServer
+from RetryScheduler import RetryPolicy
+from WorkLedger import WorkLedger
+
+
+class WorkLedgerTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """
+        Creates a scratch folder and the ledger path
+        """
+        logging.basicConfig(level=logging.INFO)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "ledger.db")
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def settings(self, folder: str, *args: str) -> dict:
+        """
+        Interprets args the same way the command line would
+        """
+        os.makedirs(folder, exist_ok=True)
+        return PandoraArgInterpretor.interpret(['.py', '-d', folder] + list(args))
+
+    def test_disjoint_claims(self):
+        """
+        Processes sharing a ledger never claim the same url
+        """
+        urls = ["http://a/{i}".format(i=i) for i in range(50)]
+        with WorkLedger(self.path, owner="a") as a, WorkLedger(self.path, owner="b") as b:
+            self.assertEqual(50, a.load(urls))
+            self.assertEqual(0, b.load(urls))
+            claimed_a = a.claim(20)
+            claimed_b = b.claim(100)
+
+            self.assertEqual(urls[:20], claimed_a)
+            self.assertEqual(urls[20:], claimed_b)
+            self.assertEqual([], a.claim(10))
+            self.assertEqual({"pending": 0, "claimed": 50, "done": 0, "failed": 0}, a.counts())
+
+    def test_complete(self):
+        with WorkLedger(self.path) as ledger:
+            ledger.load(["u1", "u2", "u3"])
+            ledger.claim(3)
+            ledger.complete("u1", True)
+            ledger.complete("u2", False)
+
+            self.assertEqual({"pending": 0, "claimed": 1, "done": 1, "failed": 1}, ledger.counts())
+        with WorkLedger(self.path) as ledger:
+            # Claims left unfinished are handed back on close
+            self.assertEqual({"pending": 1, "claimed": 0, "done": 1, "failed": 1}, ledger.counts())
+            self.assertEqual(["u3"], ledger.claim(3))
+
+    def test_expired_claims_taken_over(self):
+        """
+        Claims of a process that stopped renewing them go to another
+        """
+        with WorkLedger(self.path, lease=60, owner="crashed") as crashed, WorkLedger(self.path, owner="b") as b:
+            crashed.load(["u1", "u2"])
+            self.assertEqual(["u1", "u2"], crashed.claim(2, now=0))
+            self.assertEqual([], b.claim(2, now=30))
+            self.assertEqual(["u1", "u2"], b.claim(2, now=61))
+            # Finishing what it lost changes nothing
+            crashed.complete("u1", False)
+            b.complete("u1", True)
+
+            self.assertEqual({"pending": 0, "claimed": 1, "done": 1, "failed": 0}, b.counts())
+
+    def test_renew(self):
+        with WorkLedger(self.path, lease=60, owner="a") as a, WorkLedger(self.path, owner="b") as b:
+            a.load(["u1"])
+            a.claim(1, now=0)
+            self.assertEqual(1, a.renew(now=50))
+
+            self.assertEqual([], b.claim(1, now=100))
+            self.assertEqual(["u1"], b.claim(1, now=111))
+
+    def test_poison_url_failed(self):
+        """
+        A url whose claims keep expiring is given up on
+        """
+        with WorkLedger(self.path, lease=1000) as ledger:
+            ledger.load(["poison"])
+            for n in range(ledger_module.MAX_CLAIMS):
+                self.assertEqual(["poison"], ledger.claim(1, now=n * 2000))
+            ledger.load(["poison", "fine"])
+
+            self.assertEqual(["fine"], ledger.claim(2, now=ledger_module.MAX_CLAIMS * 2000))
+            self.assertEqual(1, ledger.counts()["failed"])
+
+    def test_load_source_once(self):
+        """
+        A bulk file is read only once however many processes load it
+        """
+        bulk = os.path.join(self.tmp.name, "links.txt")
+        with open(bulk, 'w') as fp:
+            fp.write("http://a/1\nhttp://a/2\n\nhttp://a/1\n")
+        with WorkLedger(self.path) as a, WorkLedger(self.path) as b:
+            self.assertEqual(2, a.load_source(bulk))
+            self.assertEqual(0, b.load_source(bulk))
+            with open(bulk, 'a') as fp:
+                fp.write("http://a/3\n")
+            self.assertEqual(1, b.load_source(bulk))
+            self.assertEqual(3, b.counts()["pending"])
+
+    def test_claims_wait_for_others(self):
+        """
+        claims() waits while others hold claims and takes over those that expire
+        """
+        with WorkLedger(self.path, lease=30, owner="crashed") as crashed, WorkLedger(self.path, lease=0.1) as b:
+            crashed.load(["u1", "u2", "u3"])
+            # Expires in 0.2s, long before its heartbeat would renew it
+            crashed.claim(1, now=time.time() - 29.8)
+            start = time.monotonic()
+
+            self.assertEqual(["u2", "u3", "u1"], list(b.claims(2)))
+            self.assertGreater(time.monotonic() - start, 0.15)
+            self.assertEqual([], list(b.claims(2, wait=False)))
+
+    def test_engines_share_ledger(self):
+        """
+        Engines downloading one bulk list through a ledger fetch every url once
+        """
+        with MockServer() as server:
+            bulk = os.path.join(self.tmp.name, "links.txt")
+            with open(bulk, 'w') as fp:
+                for i in range(40):
+                    fp.write(server.add_generated("/f{i}.bin".format(i=i), 2000, seed=i) + "\n")
+            results = list()
+            # Short leases poll for each other's leftovers every 0.5s
+            engines = [DownloadEngine(self.settings(os.path.join(self.tmp.name, "a"), '-f', bulk, '--ledger',
+                                                    self.path, '--lease', '2', '-t', '2'), RetryPolicy(base=0.01)),
+                       AsyncDownloadEngine(self.settings(os.path.join(self.tmp.name, "b"), '-f', bulk, '--ledger',
+                                                         self.path, '--lease', '2', '-t', '2'), RetryPolicy(base=0.01))]
+            threads = [threading.Thread(target=lambda engine=engine: results.extend(engine.run()))
+                       for engine in engines]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(40, len(results))
+            self.assertTrue(all(result.ok for result in results))
+            self.assertEqual(40, len({result.url for result in results}))
+            self.assertTrue(all(hits == 1 for hits in server.hits.values()))
+        with WorkLedger(self.path) as ledger:
+            self.assertEqual({"pending": 0, "claimed": 0, "done": 40, "failed": 0}, ledger.counts())
+
+    def test_from_settings(self):
+        settings = lambda *args: self.settings(self.tmp.name, *args)
+        self.assertIsNone(WorkLedger.from_settings(settings()))
+        with WorkLedger.from_settings(settings('--ledger', self.path, '--lease', '30')) as ledger:
+            self.assertEqual((self.path, 30), (ledger.path, ledger.lease))
+        with self.assertRaises(ValueError):
+            WorkLedger.from_settings(settings('--ledger', self.path, '--lease', '0'))
+
+
+if __name__ == '__main__':
+    unittest.main()